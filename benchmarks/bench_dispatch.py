@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+'''
+bench_dispatch -- report handling throughput of process_report()
+
+Feeds decoded TPV, SKY and PPS reports in realistic mixes straight into
+process_report() and prints the messages handled per second.
+
+Usage:
+    python3 benchmarks/bench_dispatch.py --messages 20000
+'''
+
+import os
+import sys
+import time
+
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import gpsd_exporter
+
+from fake_gpsd import synthetic_epoch, pps_report
+
+# name: (exporter options, satellites per SKY, TPV per SKY, PPS per SKY)
+MIXES = {
+    'gps-only 1 Hz': ([], 12, 1, 0),
+    'timing 1 Hz + PPS': (['--pps-histogram'], 40, 1, 1),
+    'rover 20 Hz': (['--offset-from-geopoint', '--geopoint-lat', '52.3676', '--geopoint-lon', '4.9041'], 24, 20, 0),
+}
+
+
+def make_reports(satellites, tpv_per_sky, pps_per_sky, count):
+    reports = []
+    ts = time.time()
+    while len(reports) < count:
+        for _ in range(tpv_per_sky):
+            tpv, sky = synthetic_epoch(ts, satellites)
+            reports.append(tpv)
+            ts += 1.0 / tpv_per_sky
+        reports.append(sky)
+        for _ in range(pps_per_sky):
+            reports.append(pps_report(ts))
+    return reports[:count]
+
+
+def main():
+    parser = ArgumentParser(description=__import__('__main__').__doc__.split("\n")[1])
+    parser.add_argument('--messages', type=int, default=20000,
+                        help="reports per mix [default: %(default)s]")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="timing repetitions, the best run is reported [default: %(default)s]")
+    args = parser.parse_args()
+
+    print(f'{"mix":<20} {"messages/s":>12} {"us/message":>11}')
+    for name, (options, satellites, tpv_per_sky, pps_per_sky) in MIXES.items():
+        exporter_args = gpsd_exporter.build_parser().parse_args(options)
+        metrics = gpsd_exporter.init_metrics(exporter_args)
+        source = gpsd_exporter.bind_source(metrics, 'bench', 'localhost', gpsd_exporter.GPSD_PORT, exporter_args)
+        reports = make_reports(satellites, tpv_per_sky, pps_per_sky, args.messages)
+
+        best = None
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            for report in reports:
+                gpsd_exporter.process_report(report, source, exporter_args)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+
+        print(f'{name:<20} {len(reports) / best:>12.0f} {best / len(reports) * 1e6:>11.1f}')
+
+
+if __name__ == "__main__":
+    sys.exit(main())
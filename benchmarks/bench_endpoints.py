@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+'''
+bench_endpoints -- memory and CPU of one exporter monitoring many gpsd
+
+Starts fake gpsd instances, runs gpsd_exporter.py with one --gpsd option
+per instance and samples the RSS and CPU time of the exporter process.
+
+Usage:
+    python3 benchmarks/bench_endpoints.py --endpoints 1,4,16,64 --rate 1 --satellites 32
+'''
+
+import os
+import sys
+import time
+import subprocess
+
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_gpsd import FakeGpsd
+
+EXPORTER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'gpsd_exporter.py')
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+
+def rss_kib(pid):
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+def cpu_seconds(pid):
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    # utime and stime are fields 14 and 15 of /proc/<pid>/stat
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+def measure(count, args):
+    servers = [FakeGpsd(args.base_port + i, args.rate, args.satellites).start() for i in range(count)]
+    cmd = [sys.executable, EXPORTER, '-E', str(args.exporter_port), '--gpsd-client', args.client]
+    for i in range(count):
+        cmd.extend(['--gpsd', f'127.0.0.1:{args.base_port + i}'])
+
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        time.sleep(args.warmup)
+        cpu_start = cpu_seconds(proc.pid)
+        time.sleep(args.duration)
+        cpu = (cpu_seconds(proc.pid) - cpu_start) / args.duration
+        rss = rss_kib(proc.pid)
+    finally:
+        proc.terminate()
+        proc.wait()
+        for server in servers:
+            server.stop()
+    return rss, cpu
+
+
+def main():
+    parser = ArgumentParser(description=__import__('__main__').__doc__.split("\n")[1])
+    parser.add_argument('--endpoints', default='1,4,16',
+                        help="comma separated gpsd counts to measure [default: %(default)s]")
+    parser.add_argument('--client', choices=['gps', 'asyncio'], default='gps',
+                        help="gpsd client of the exporter [default: %(default)s]")
+    parser.add_argument('--rate', type=float, default=1.0,
+                        help="TPV/SKY epochs per second per gpsd [default: %(default)s]")
+    parser.add_argument('--satellites', type=int, default=32,
+                        help="satellites per SKY report [default: %(default)s]")
+    parser.add_argument('--warmup', type=float, default=3,
+                        help="seconds before sampling starts [default: %(default)s]")
+    parser.add_argument('--duration', type=float, default=10,
+                        help="seconds the CPU time is sampled over [default: %(default)s]")
+    parser.add_argument('--base-port', type=int, default=22947,
+                        help="first port for the fake gpsd instances [default: %(default)s]")
+    parser.add_argument('--exporter-port', type=int, default=29015,
+                        help="port of the exporter under test [default: %(default)s]")
+    args = parser.parse_args()
+
+    print(f'client {args.client}, {args.rate} Hz, {args.satellites} satellites per gpsd')
+    print(f'{"gpsd":>5} {"RSS (MiB)":>10} {"CPU (%)":>8} {"RSS/gpsd (KiB)":>15} {"CPU/gpsd (%)":>13}')
+    baseline = None
+    for count in (int(c) for c in args.endpoints.split(',')):
+        rss, cpu = measure(count, args)
+        if baseline is None:
+            baseline = (count, rss, cpu)
+        extra = count - baseline[0]
+        rss_each = (rss - baseline[1]) / extra if extra else 0
+        cpu_each = (cpu - baseline[2]) / extra if extra else 0
+        print(f'{count:>5} {rss / 1024:>10.1f} {cpu * 100:>8.2f} {rss_each:>15.0f} {cpu_each * 100:>13.3f}')
+
+
+if __name__ == "__main__":
+    sys.exit(main())
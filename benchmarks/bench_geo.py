@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+'''
+bench_geo -- accuracy and cost of the geo offset computation
+
+Draws random fixes around a geo point and computes their offset with
+MeterOffsetSmall() plus gps.misc.EarthDistanceSmall() (the computation of
+--offset-from-geopoint up to 1.1.19) and with the GeoProjector, from lat/lon
+and from ECEF. The error is measured against the exact east/north
+offset, the ECEF difference rotated into the local frame of the geo point.
+
+Usage:
+    python3 benchmarks/bench_geo.py --fixes 100000 --radius 50
+'''
+
+import os
+import sys
+import math
+import time
+import random
+
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import gps
+import gpsd_exporter
+
+
+def ecef(lat, lon, alt):
+    phi, lam = math.radians(lat), math.radians(lon)
+    n = gpsd_exporter.WGS84_A / math.sqrt(1 - gpsd_exporter.WGS84_E2 * math.sin(phi) ** 2)
+    return ((n + alt) * math.cos(phi) * math.cos(lam),
+            (n + alt) * math.cos(phi) * math.sin(lam),
+            (n * (1 - gpsd_exporter.WGS84_E2) + alt) * math.sin(phi))
+
+
+def make_fixes(lat, lon, alt, radius, count, seed=1):
+    """ TPV like dicts within radius meters of the geo point. """
+    rng = random.Random(seed)
+    fixes = []
+    for _ in range(count):
+        f = {'lat': lat + rng.uniform(-radius, radius) / 111000,
+             'lon': lon + rng.uniform(-radius, radius) / (111000 * math.cos(math.radians(lat))),
+             'altHAE': alt + rng.uniform(-10, 10)}
+        f['ecefx'], f['ecefy'], f['ecefz'] = ecef(f['lat'], f['lon'], f['altHAE'])
+        fixes.append(f)
+    return fixes
+
+
+def legacy(fixes, lat, lon):
+    result = []
+    for f in fixes:
+        x, y = gpsd_exporter.MeterOffsetSmall((lat, lon), (f['lat'], f['lon']))
+        distance = gps.misc.EarthDistanceSmall((f['lat'], f['lon']), (lat, lon))
+        result.append((-x, -y, distance))
+    return result
+
+
+def projected(fixes, projector, keys):
+    result = []
+    for f in fixes:
+        east, north, _ = projector.offset({k: f[k] for k in keys})
+        result.append((east, north, math.hypot(east, north)))
+    return result
+
+
+def main():
+    parser = ArgumentParser(description=__import__('__main__').__doc__.split("\n")[1])
+    parser.add_argument('--fixes', type=int, default=100000,
+                        help="fixes per method [default: %(default)s]")
+    parser.add_argument('--radius', type=float, default=50,
+                        help="meters around the geo point the fixes are drawn from [default: %(default)s]")
+    parser.add_argument('--lat', type=float, default=52.3676,
+                        help="latitude of the geo point [default: %(default)s]")
+    parser.add_argument('--lon', type=float, default=4.9041,
+                        help="longitude of the geo point [default: %(default)s]")
+    parser.add_argument('--alt', type=float, default=45.0,
+                        help="height above the ellipsoid of the geo point [default: %(default)s]")
+    args = parser.parse_args()
+
+    fixes = make_fixes(args.lat, args.lon, args.alt, args.radius, args.fixes)
+    projector = gpsd_exporter.GeoProjector(args.lat, args.lon, args.alt)
+
+    # exact offsets: the ECEF difference rotated into the east/north frame
+    truth = []
+    for f in fixes:
+        east, north, _ = projector.offset(f)
+        truth.append((east, north, math.hypot(east, north)))
+
+    methods = {
+        'MeterOffsetSmall': lambda: legacy(fixes, args.lat, args.lon),
+        'projector lat/lon': lambda: projected(fixes, projector, ('lat', 'lon', 'altHAE')),
+        'projector ECEF': lambda: projected(fixes, projector, ('ecefx', 'ecefy', 'ecefz')),
+    }
+
+    print(f'{args.fixes} fixes within {args.radius:g} m\n')
+    print(f'{"method":<20} {"us/fix":>8} {"max east/north error (mm)":>26} {"max distance error (mm)":>24}')
+    for name, method in methods.items():
+        started = time.perf_counter()
+        result = method()
+        elapsed = time.perf_counter() - started
+        axis_error = max(max(abs(r[0] - t[0]), abs(r[1] - t[1])) for r, t in zip(result, truth))
+        distance_error = max(abs(r[2] - t[2]) for r, t in zip(result, truth))
+        print(f'{name:<20} {elapsed / len(fixes) * 1e6:>8.2f} {axis_error * 1000:>26.3f} {distance_error * 1000:>24.3f}')
+
+
+if __name__ == "__main__":
+    sys.exit(main())
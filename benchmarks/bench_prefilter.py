@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+'''
+bench_prefilter -- CPU the exporter spends reading a busy receiver
+
+Runs the exporter as a new process against a fake gpsd that replays a busy
+receiver: 20 Hz TPV, ATT, IMU and GST reports, and a 40 satellite SKY, a
+PPS and a TOFF report every second. Only TPV and SKY (and PPS with
+--pps-histogram) have handlers, the other classes used to be decoded all
+the same. Prints the reports the exporter counted and the CPU time it used
+per second and per report, for both gpsd clients. --exporter runs another
+copy of gpsd_exporter.py, e.g. an older release to compare with.
+
+Usage:
+    python3 benchmarks/bench_prefilter.py --duration 30
+    python3 benchmarks/bench_prefilter.py --exporter /tmp/gpsd_exporter_old.py --exporter-args=--pps-histogram
+'''
+
+import os
+import re
+import sys
+import json
+import time
+import shlex
+import tempfile
+import subprocess
+import http.client
+
+from argparse import ArgumentParser
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_gpsd import FakeGpsd, DEVICE, gpsd_time, synthetic_epoch, pps_report
+
+MESSAGES = re.compile(rb'^gpsd_exporter_messages_total\{[^}]*\} (\S+)$', re.M)
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+
+def busy_capture(path, rate, seconds=10):
+    """ Write seconds of a busy receiver at rate epochs per second to path. """
+    ts = time.time()
+    with open(path, 'w') as f:
+        for epoch in range(int(seconds * rate)):
+            tpv, sky = synthetic_epoch(ts, 40)
+            reports = [tpv,
+                       {'class': 'ATT', 'device': DEVICE, 'time': gpsd_time(ts), 'heading': 12.5,
+                        'pitch': 0.3, 'roll': -0.2, 'yaw': 12.5, 'acc_x': 0.01, 'acc_y': -0.02, 'acc_z': 9.81,
+                        'gyro_x': 0.001, 'gyro_y': 0.002, 'gyro_z': -0.001, 'temp': 31.5},
+                       {'class': 'IMU', 'device': DEVICE, 'time': gpsd_time(ts), 'acc_x': 0.01,
+                        'acc_y': -0.02, 'acc_z': 9.81, 'gyro_x': 0.001, 'gyro_y': 0.002, 'gyro_z': -0.001},
+                       {'class': 'GST', 'device': DEVICE, 'time': gpsd_time(ts), 'rms': 1.2, 'major': 1.9,
+                        'minor': 1.1, 'orient': 35.0, 'lat': 1.5, 'lon': 1.2, 'alt': 3.1}]
+            if epoch % rate == 0:
+                offset = pps_report(ts)
+                toff = dict(offset, **{'class': 'TOFF', 'device': DEVICE})
+                reports += [sky, offset, toff]
+            f.writelines(json.dumps(report, separators=(',', ':')) + '\n' for report in reports)
+            ts += 1.0 / rate
+
+
+def messages(port):
+    """ Reports the exporter counted so far, of all classes. """
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    conn.request('GET', '/metrics')
+    body = conn.getresponse().read()
+    conn.close()
+    return sum(float(value) for value in MESSAGES.findall(body))
+
+
+def cpu_seconds(pid):
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    # utime and stime, fields 14 and 15 of stat(5)
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+def measure(command, port, warmup, duration):
+    """ (reports, CPU seconds) of the exporter over duration seconds after warmup. """
+    process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        time.sleep(warmup)
+        if process.poll() is not None:
+            raise RuntimeError(f'exporter exited with {process.returncode}: {" ".join(command)}')
+        count, cpu = messages(port), cpu_seconds(process.pid)
+        time.sleep(duration)
+        return messages(port) - count, cpu_seconds(process.pid) - cpu
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = ArgumentParser(description=__import__('__main__').__doc__.split("\n")[1])
+    parser.add_argument('--duration', type=float, default=30,
+                        help="seconds measured per client [default: %(default)s]")
+    parser.add_argument('--warmup', type=float, default=3,
+                        help="seconds before measuring [default: %(default)s]")
+    parser.add_argument('--rate', type=int, default=20,
+                        help="epochs per second of the busy receiver [default: %(default)s]")
+    parser.add_argument('--gpsd-port', type=int, default=29474,
+                        help="port of the fake gpsd [default: %(default)s]")
+    parser.add_argument('--exporter-port', type=int, default=29019,
+                        help="port the exporter listens on [default: %(default)s]")
+    parser.add_argument('--exporter', default=os.path.join(ROOT, 'gpsd_exporter.py'),
+                        help="gpsd_exporter.py to run [default: the one in this tree]")
+    parser.add_argument('--exporter-args', default='',
+                        help="extra options of the exporter, e.g. --pps-histogram")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        capture = os.path.join(directory, 'busy.jsonl')
+        busy_capture(capture, args.rate)
+        server = FakeGpsd(args.gpsd_port, args.rate, None, capture=capture).start()
+        try:
+            print(f'{"client":<8} {"reports/s":>10} {"CPU ms/s":>9} {"CPU us/report":>14}')
+            for client in ('gps', 'asyncio'):
+                command = ([sys.executable, args.exporter, '-G', f'127.0.0.1:{args.gpsd_port}',
+                            '-E', str(args.exporter_port), '--gpsd-client', client] +
+                           shlex.split(args.exporter_args))
+                count, cpu = measure(command, args.exporter_port, args.warmup, args.duration)
+                print(f'{client:<8} {count / args.duration:>10.0f} {cpu / args.duration * 1000:>9.1f} '
+                      f'{cpu / max(count, 1) * 1e6:>14.1f}')
+        finally:
+            server.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+'''
+bench_recovery -- time the exporter needs to notice a dead gpsd and to recover from it
+
+Runs the exporter as a new process against a fake gpsd and takes gpsd away
+in two ways: "hang" keeps the connection open but stops sending, like a hung
+gpsd or a host that vanished; "restart" closes the connection and brings
+gpsd back on the same port after --down seconds. Prints the seconds until the
+exporter reports the connection as lost and until TPV reports are counted
+again once gpsd is back, and whether gpsd_lat was still exported in between.
+--exporter runs another copy of gpsd_exporter.py, e.g. an older release
+to compare with.
+
+Usage:
+    python3 benchmarks/bench_recovery.py --runs 3 --rate 1
+    python3 benchmarks/bench_recovery.py --exporter /tmp/gpsd_exporter_old.py --rate 1
+'''
+
+import os
+import re
+import sys
+import time
+import subprocess
+import http.client
+
+from argparse import ArgumentParser
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_gpsd import FakeGpsd
+
+TPV_COUNT = re.compile(rb'^gpsd_exporter_messages_total\{[^}]*class="TPV"[^}]*\} (\S+)$', re.M)
+STATE = re.compile(rb'^gpsd_exporter_connection_state\{[^}]*\} (\S+)$', re.M)
+RECONNECTS = re.compile(rb'^gpsd_exporter_reconnects_total\{[^}]*\} (\S+)$', re.M)
+LAT = re.compile(rb'^gpsd_lat\{', re.M)
+
+
+def get_metrics(port):
+    try:
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+        conn.request('GET', '/metrics')
+        body = conn.getresponse().read()
+        conn.close()
+        return body
+    except OSError:
+        return None
+
+
+def value(pattern, body):
+    match = pattern.search(body or b'')
+    return float(match.group(1)) if match else 0.0
+
+
+def lost(body, reconnects):
+    """ The exporter counted the lost connection, or reports it in its state gauge. A reconnect
+    to a hung gpsd succeeds, so the state alone may be back at connected by the next poll. """
+    state = STATE.search(body)
+    return value(RECONNECTS, body) > reconnects or (state is not None and float(state.group(1)) != 2)
+
+
+def wait_for(port, condition, poll, timeout):
+    """ Seconds until condition(/metrics body) holds, None after timeout. """
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        body = get_metrics(port)
+        if body is not None and condition(body):
+            return time.perf_counter() - started
+        time.sleep(poll)
+    return None
+
+
+def run_once(scenario, server, args):
+    """ (seconds to notice, seconds to recover, gpsd_lat exported while gpsd was gone), and the gpsd serving now. """
+    port = args.exporter_port
+    # a few reports on the connection to learn their cadence from
+    time.sleep(args.settle)
+    body = get_metrics(port)
+    reconnects = value(RECONNECTS, body)
+
+    started = time.perf_counter()
+    if scenario == 'hang':
+        server.paused = True
+    else:
+        server.stop()
+    noticed = wait_for(port, lambda b: lost(b, reconnects), args.poll, args.give_up)
+    stale = LAT.search(get_metrics(port) or b'') is not None
+
+    time.sleep(max(0.0, args.down - (time.perf_counter() - started)))
+    if scenario == 'hang':
+        server.paused = False
+    else:
+        server = FakeGpsd(args.gpsd_port, args.rate, 24).start()
+    count = value(TPV_COUNT, get_metrics(port))
+    recovered = wait_for(port, lambda b: value(TPV_COUNT, b) > count, args.poll, args.give_up)
+    return (noticed, recovered, stale), server
+
+
+def seconds(value):
+    return f'{value:.2f}' if value is not None else 'never'
+
+
+def main():
+    parser = ArgumentParser(description=__import__('__main__').__doc__.split("\n")[1])
+    parser.add_argument('--runs', type=int, default=3,
+                        help="outages per scenario [default: %(default)s]")
+    parser.add_argument('--rate', type=float, default=1,
+                        help="epochs per second of the fake gpsd [default: %(default)s]")
+    parser.add_argument('--down', type=float, default=3,
+                        help="seconds gpsd stays away [default: %(default)s]")
+    parser.add_argument('--settle', type=float, default=5,
+                        help="seconds gpsd reports before each outage [default: %(default)s]")
+    parser.add_argument('--give-up', type=float, default=120,
+                        help="seconds to wait for the exporter to notice or recover [default: %(default)s]")
+    parser.add_argument('--poll', type=float, default=0.05,
+                        help="seconds between polls of /metrics [default: %(default)s]")
+    parser.add_argument('--gpsd-port', type=int, default=29471,
+                        help="port of the fake gpsd [default: %(default)s]")
+    parser.add_argument('--exporter-port', type=int, default=29016,
+                        help="port the exporter listens on [default: %(default)s]")
+    parser.add_argument('--exporter', default=os.path.join(ROOT, 'gpsd_exporter.py'),
+                        help="gpsd_exporter.py to run [default: the one in this tree]")
+    parser.add_argument('--gpsd-client', choices=['gps', 'asyncio'], default='gps',
+                        help="client the exporter reads gpsd with [default: %(default)s]")
+    args = parser.parse_args()
+
+    server = FakeGpsd(args.gpsd_port, args.rate, 24).start()
+    command = [sys.executable, args.exporter, '-G', f'127.0.0.1:{args.gpsd_port}',
+               '-E', str(args.exporter_port), '--gpsd-client', args.gpsd_client]
+    process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    print(f'{"scenario":<10} {"noticed (s)":>12} {"recovered (s)":>14} {"stale fix exported":>19}')
+    try:
+        if wait_for(args.exporter_port, lambda b: value(TPV_COUNT, b) > 0, args.poll, 30) is None:
+            raise RuntimeError(f'no TPV from {" ".join(command)}')
+        for scenario in ('hang', 'restart'):
+            for _ in range(args.runs):
+                (noticed, recovered, stale), server = run_once(scenario, server, args)
+                print(f'{scenario:<10} {seconds(noticed):>12} {seconds(recovered):>14} {"yes" if stale else "no":>19}')
+    finally:
+        process.terminate()
+        process.wait()
+        server.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+'''
+bench_sat_store -- cost per SKY report and per scrape of the satellite state
+
+Compares the former queue based satellite bookkeeping (one queue entry per
+satellite per SKY report, drained on every scrape) with the SatelliteStore
+used by gpsd_exporter.
+
+Usage:
+    python3 benchmarks/bench_sat_store.py --satellites 64 --rate 5 --scrape-interval 15
+'''
+
+import os
+import sys
+import queue
+import random
+import timeit
+
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import gpsd_exporter
+
+
+class LegacySatQueue(object):
+    """ The satellite bookkeeping as it was before SatelliteStore. """
+
+    def __init__(self):
+        self.queue = queue.Queue()
+
+    def update(self, satellites, ts=0):
+        for sat in satellites:
+            self.queue.put({'sat': sat, 'ts': ts})
+        while self.queue.qsize() > 2000:
+            self.queue.get()
+
+    def snapshot(self):
+        last_measurement = {}
+        while not self.queue.empty():
+            measurement = self.queue.get()
+            last_measurement[measurement['sat']['PRN']] = measurement['sat']
+        return list(last_measurement.values())
+
+
+def make_satellites(count):
+    """ A SKY satellites array spread over the GPS, Galileo, BeiDou and GLONASS constellations. """
+    satellites = []
+    for i in range(count):
+        gnssid = (0, 2, 3, 6)[i % 4]
+        svid = i // 4 + 1
+        satellites.append({
+            'PRN': gnssid * 100 + svid, 'gnssid': gnssid, 'svid': svid,
+            'az': random.uniform(0, 360), 'el': random.uniform(0, 90),
+            'ss': random.uniform(20, 50), 'used': random.random() > 0.4, 'health': 1,
+        })
+    return satellites
+
+
+def bench(store, satellites, reports_per_scrape, repeat):
+    per_report = min(timeit.repeat(lambda: store.update(satellites), number=reports_per_scrape,
+                                   repeat=repeat)) / reports_per_scrape
+
+    def scrape():
+        for _ in range(reports_per_scrape):
+            store.update(satellites)
+        store.snapshot()
+
+    per_cycle = min(timeit.repeat(scrape, number=1, repeat=repeat))
+    per_scrape = per_cycle - per_report * reports_per_scrape
+    return per_report, per_scrape
+
+
+def main():
+    parser = ArgumentParser(description=__import__('__main__').__doc__.split("\n")[1])
+    parser.add_argument('--satellites', type=int, default=64,
+                        help="satellites per SKY report [default: %(default)s]")
+    parser.add_argument('--rate', type=float, default=5,
+                        help="SKY reports per second [default: %(default)s]")
+    parser.add_argument('--scrape-interval', type=float, default=15,
+                        help="seconds between scrapes [default: %(default)s]")
+    parser.add_argument('--repeat', type=int, default=20,
+                        help="timing repetitions, the best run is reported [default: %(default)s]")
+    args = parser.parse_args()
+
+    satellites = make_satellites(args.satellites)
+    reports_per_scrape = max(1, int(args.rate * args.scrape_interval))
+
+    print(f'{args.satellites} satellites, {reports_per_scrape} SKY reports per scrape')
+    print(f'{"implementation":<16} {"per SKY (us)":>14} {"per scrape (us)":>16}')
+    for name, store in (('queue', LegacySatQueue()),
+                        ('SatelliteStore', gpsd_exporter.SatelliteStore(gpsd_exporter.DEFAULT_SAT_TTL))):
+        per_report, per_scrape = bench(store, satellites, reports_per_scrape, args.repeat)
+        print(f'{name:<16} {per_report * 1e6:>14.1f} {per_scrape * 1e6:>16.1f}')
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+'''
+bench_scrape -- /metrics latency with concurrent scrapers
+
+Runs gpsd_exporter.py against a fake gpsd and measures the scrape latency
+with 1, 10 and 100 concurrent scrapers, with and without the payload
+cache (--metrics-max-age 0 renders the registry on every scrape).
+
+Usage:
+    python3 benchmarks/bench_scrape.py --scrapers 1,10,100 --rate 10 --satellites 64
+'''
+
+import os
+import sys
+import time
+import threading
+import subprocess
+import http.client
+
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_gpsd import FakeGpsd
+
+EXPORTER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'gpsd_exporter.py')
+
+
+def scraper(port, deadline, latencies, errors):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            conn.request('GET', '/metrics', headers={'Accept-Encoding': 'gzip'})
+            conn.getresponse().read()
+        except (OSError, http.client.HTTPException):
+            errors.append(time.perf_counter() - started)
+            conn.close()
+            continue
+        latencies.append(time.perf_counter() - started)
+    conn.close()
+
+
+def wait_for_exporter(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/metrics')
+            if b'gpsd_lat{' in conn.getresponse().read():
+                return
+        except OSError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError('exporter did not come up')
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run(max_age, scrapers, args):
+    cmd = [sys.executable, EXPORTER, '-E', str(args.exporter_port), '-G', f'127.0.0.1:{args.gpsd_port}',
+           '--metrics-max-age', str(max_age)]
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_exporter(args.exporter_port)
+        latencies = []
+        errors = []
+        deadline = time.monotonic() + args.duration
+        threads = [threading.Thread(target=scraper, args=(args.exporter_port, deadline, latencies, errors))
+                   for _ in range(scrapers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    latencies.sort()
+    return (len(latencies) / args.duration, percentile(latencies, 0.5), percentile(latencies, 0.99),
+            len(errors))
+
+
+def main():
+    parser = ArgumentParser(description=__import__('__main__').__doc__.split("\n")[1])
+    parser.add_argument('--scrapers', default='1,10,100',
+                        help="comma separated numbers of concurrent scrapers [default: %(default)s]")
+    parser.add_argument('--rate', type=float, default=1.0,
+                        help="TPV/SKY epochs per second [default: %(default)s]")
+    parser.add_argument('--satellites', type=int, default=64,
+                        help="satellites per SKY report [default: %(default)s]")
+    parser.add_argument('--duration', type=float, default=5,
+                        help="seconds per measurement [default: %(default)s]")
+    parser.add_argument('--gpsd-port', type=int, default=22947,
+                        help="port of the fake gpsd [default: %(default)s]")
+    parser.add_argument('--exporter-port', type=int, default=29015,
+                        help="port of the exporter under test [default: %(default)s]")
+    args = parser.parse_args()
+
+    server = FakeGpsd(args.gpsd_port, args.rate, args.satellites).start()
+    print(f'{args.rate} Hz, {args.satellites} satellites')
+    print(f'{"cache":<6} {"scrapers":>8} {"scrapes/s":>10} {"p50 (ms)":>9} {"p99 (ms)":>9} {"errors":>7}')
+    try:
+        for max_age, name in ((0, 'off'), (1.0, 'on')):
+            for scrapers in (int(n) for n in args.scrapers.split(',')):
+                rate, p50, p99, errors = run(max_age, scrapers, args)
+                print(f'{name:<6} {scrapers:>8} {rate:>10.0f} {p50 * 1000:>9.2f} {p99 * 1000:>9.2f} {errors:>7}')
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+'''
+bench_startup -- time from exec of the exporter to its first /metrics and first TPV
+
+Starts the exporter as a new process against a fake gpsd, again and again,
+and polls /metrics from the moment of the exec. Prints the time until the
+first /metrics is served and until the first TPV report shows up in
+gpsd_exporter_messages_total, for the script and for "python3 -m
+gpsd_exporter" (which runs from the cached bytecode) with either gpsd
+client. --budget makes the run fail when the median time to the first TPV
+of any variant exceeds it, so it can guard against startup regressions.
+
+Usage:
+    python3 benchmarks/bench_startup.py --runs 20
+    python3 benchmarks/bench_startup.py --runs 10 --budget 500 --json startup.json
+'''
+
+import os
+import sys
+import json
+import time
+import subprocess
+import http.client
+
+from argparse import ArgumentParser
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_gpsd import FakeGpsd
+
+TPV_SAMPLE = b'gpsd_exporter_messages_total{class="TPV"'
+
+
+def get_metrics(port):
+    """ The /metrics body, None while the exporter is not listening yet. """
+    try:
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+        conn.request('GET', '/metrics')
+        body = conn.getresponse().read()
+        conn.close()
+        return body
+    except OSError:
+        return None
+
+
+def start_once(command, port, poll, timeout=30):
+    """ Seconds from the exec of command until the first /metrics and the first TPV. """
+    started = time.perf_counter()
+    process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    first_metrics = first_tpv = None
+    try:
+        while time.perf_counter() - started < timeout:
+            body = get_metrics(port)
+            if body is not None:
+                if first_metrics is None:
+                    first_metrics = time.perf_counter() - started
+                if TPV_SAMPLE in body:
+                    first_tpv = time.perf_counter() - started
+                    break
+            if process.poll() is not None:
+                raise RuntimeError(f'exporter exited with {process.returncode}: {" ".join(command)}')
+            time.sleep(poll)
+    finally:
+        process.terminate()
+        process.wait()
+    return first_metrics, first_tpv
+
+
+def median(values):
+    values = sorted(v for v in values if v is not None)
+    return values[len(values) // 2] if values else float('nan')
+
+
+def main():
+    parser = ArgumentParser(description=__import__('__main__').__doc__.split("\n")[1])
+    parser.add_argument('--runs', type=int, default=20,
+                        help="starts per variant [default: %(default)s]")
+    parser.add_argument('--gpsd-port', type=int, default=29470,
+                        help="port of the fake gpsd [default: %(default)s]")
+    parser.add_argument('--exporter-port', type=int, default=29015,
+                        help="port the exporter listens on [default: %(default)s]")
+    parser.add_argument('--poll', type=float, default=0.002,
+                        help="seconds between polls of /metrics [default: %(default)s]")
+    parser.add_argument('--rate', type=float, default=20,
+                        help="epochs per second of the fake gpsd [default: %(default)s]")
+    parser.add_argument('--budget', type=float, default=None,
+                        help="fail when the median time to the first TPV of a variant exceeds this many ms")
+    parser.add_argument('--json', default=None,
+                        help="write the times of every start to this file")
+    args = parser.parse_args()
+
+    server = FakeGpsd(args.gpsd_port, args.rate, 24).start()
+    options = ['-G', f'127.0.0.1:{args.gpsd_port}', '-E', str(args.exporter_port), '--retry-delay', '1']
+    variants = {
+        'script, gps': [sys.executable, 'gpsd_exporter.py'] + options,
+        'script, asyncio': [sys.executable, 'gpsd_exporter.py', '--gpsd-client', 'asyncio'] + options,
+        '-m, gps': [sys.executable, '-m', 'gpsd_exporter'] + options,
+        '-m, asyncio': [sys.executable, '-m', 'gpsd_exporter', '--gpsd-client', 'asyncio'] + options,
+    }
+
+    # compile the bytecode -m runs from, like the docker image build does
+    subprocess.check_call([sys.executable, '-m', 'compileall', '-q', os.path.join(ROOT, 'gpsd_exporter.py')])
+
+    results = {}
+    failed = False
+    print(f'{"variant":<16} {"first /metrics (ms)":>20} {"first TPV (ms)":>15}')
+    try:
+        for name, command in variants.items():
+            runs = [start_once(command, args.exporter_port, args.poll) for _ in range(args.runs)]
+            results[name] = [{'first_metrics_ms': m * 1000, 'first_tpv_ms': t * 1000 if t else None}
+                             for m, t in runs]
+            first_metrics = median(m for m, _ in runs) * 1000
+            first_tpv = median(t for _, t in runs) * 1000
+            print(f'{name:<16} {first_metrics:>20.1f} {first_tpv:>15.1f}')
+            if args.budget is not None and not first_tpv <= args.budget:
+                failed = True
+    finally:
+        server.stop()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if failed:
+        print(f'\nmedian time to the first TPV exceeds the budget of {args.budget:g} ms')
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+'''
+bench_stream -- cost of /stream clients for the gpsd reader
+
+Runs the exporter with --stream against a fake gpsd and measures the mean
+time the reader spends on a TPV and a SKY report (from
+gpsd_exporter_process_seconds) without clients, and then with more and more
+/stream clients connected, one of which never reads. Prints the frames every
+reading client received per second, and the slow clients that were dropped.
+
+Usage:
+    python3 benchmarks/bench_stream.py --clients 10,100,300 --rate 20
+'''
+
+import os
+import sys
+import time
+import socket
+import threading
+
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import gpsd_exporter
+from fake_gpsd import FakeGpsd
+
+
+class Client(object):
+    """ A /stream client on its own thread that counts the frames it reads, or never reads. """
+
+    def __init__(self, port, read=True):
+        self.frames = 0
+        self.sock = socket.socket()
+        if not read:
+            # fill up at once instead of after megabytes of loopback buffers
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        self.sock.connect(('127.0.0.1', port))
+        self.sock.sendall(b'GET /stream HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        if read:
+            threading.Thread(target=self.read, daemon=True).start()
+
+    def read(self):
+        try:
+            while True:
+                data = self.sock.recv(65536)
+                if not data:
+                    break
+                self.frames += data.count(b'\n\n')
+        except OSError:
+            pass
+
+    def close(self):
+        self.sock.close()
+
+
+def process_time(metrics, source):
+    """ Total seconds and count of the TPV and SKY reports processed so far. """
+    registry = metrics['registry']
+    total = count = 0.0
+    for cls in ('TPV', 'SKY'):
+        labels = {'source': source, 'class': cls}
+        total += registry.get_sample_value('gpsd_exporter_process_seconds_sum', labels) or 0
+        count += registry.get_sample_value('gpsd_exporter_process_seconds_count', labels) or 0
+    return total, count
+
+
+def main():
+    parser = ArgumentParser(description=__import__('__main__').__doc__.split("\n")[1])
+    parser.add_argument('--clients', default='10,100,300',
+                        help="comma separated numbers of reading clients [default: %(default)s]")
+    parser.add_argument('--rate', type=float, default=20,
+                        help="epochs per second of the fake gpsd [default: %(default)s]")
+    parser.add_argument('--satellites', type=int, default=40,
+                        help="satellites per SKY report [default: %(default)s]")
+    parser.add_argument('--duration', type=float, default=5,
+                        help="seconds per measurement [default: %(default)s]")
+    parser.add_argument('--gpsd-port', type=int, default=29480,
+                        help="port of the fake gpsd [default: %(default)s]")
+    parser.add_argument('--exporter-port', type=int, default=29016,
+                        help="port of the exporter [default: %(default)s]")
+    args = parser.parse_args()
+
+    server = FakeGpsd(args.gpsd_port, args.rate, args.satellites).start()
+    endpoint = f'127.0.0.1:{args.gpsd_port}'
+    exporter_args = gpsd_exporter.build_parser().parse_args(
+        ['-G', endpoint, '--stream', '--stream-clients', '10000', '--retry-delay', '1'])
+    metrics = gpsd_exporter.init_metrics(exporter_args)
+    sources = [gpsd_exporter.bind_source(metrics, *gpsd_exporter.parse_endpoint(endpoint), exporter_args)]
+    http_server = gpsd_exporter.start_exporter(args.exporter_port, '127.0.0.1', metrics)
+    http_server.routes['/stream'] = gpsd_exporter.serve_stream
+    threading.Thread(target=gpsd_exporter.run_endpoints, args=(sources, exporter_args), daemon=True).start()
+    time.sleep(1)
+
+    print(f'{args.rate:g} Hz, {args.satellites} satellites per SKY')
+    print(f'{"clients":>8} {"us/report":>10} {"frames/s/client":>16} {"dropped":>8}')
+    try:
+        for n in [0] + [int(n) for n in args.clients.split(',')]:
+            clients = [Client(args.exporter_port) for _ in range(n)]
+            stalled = Client(args.exporter_port, read=False) if n else None
+            time.sleep(1)
+
+            total, count = process_time(metrics, endpoint)
+            frames = sum(client.frames for client in clients)
+            time.sleep(args.duration)
+            total, count = [b - a for a, b in zip((total, count), process_time(metrics, endpoint))]
+            frames = sum(client.frames for client in clients) - frames
+
+            dropped = metrics['registry'].get_sample_value('gpsd_exporter_stream_dropped_total')
+            print(f'{n:>8} {total / max(count, 1) * 1e6:>10.1f} '
+                  f'{frames / max(n, 1) / args.duration:>16.1f} {dropped:>8.0f}')
+
+            for client in clients + ([stalled] if stalled else []):
+                client.close()
+            time.sleep(0.5)
+    finally:
+        http_server.shutdown()
+        server.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
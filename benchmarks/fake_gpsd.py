@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+'''
+fake_gpsd -- a local TCP server that speaks the gpsd JSON protocol
+
+Sends VERSION on connect and, once the client sent ?WATCH, either replays
+a recorded gpsd session (one JSON report per line, as written by
+"gpspipe -w") or streams synthetic TPV, SKY and TOFF reports with one PPS
+report per second. PPS and TOFF reports are only sent when the ?WATCH asks
+for pps, as gpsd does. The epoch rate and the number of satellites per SKY
+report can be changed for both.
+
+Timestamps in the replayed reports are moved to the time of sending, TPV
+times carry microseconds so a client can measure the delivery latency.
+
+Usage:
+    python3 benchmarks/fake_gpsd.py --port 2947 --count 4 --rate 10 --satellites 40
+    python3 benchmarks/fake_gpsd.py --capture benchmarks/captures/rover_20hz.jsonl
+'''
+
+import os
+import sys
+import copy
+import gzip
+import json
+import math
+import time
+import socket
+import random
+import logging
+import threading
+import socketserver
+import calendar
+
+from argparse import ArgumentParser
+
+log = logging.getLogger(__name__)
+
+DEVICE = '/dev/ttyACM0'
+PPS_DEVICE = '/dev/pps0'
+USEC = 1000000
+NSEC = 1000000000
+CAPTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'captures')
+
+
+def gpsd_time(ts):
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(ts)) + '.%06dZ' % (int(ts * USEC) % USEC)
+
+
+def parse_gpsd_time(value):
+    date, _, fraction = value.rstrip('Z').partition('.')
+    return calendar.timegm(time.strptime(date, '%Y-%m-%dT%H:%M:%S')) + float('0.' + (fraction or '0'))
+
+
+
+def synthetic_epoch(ts, satellites, lat=52.3676, lon=4.9041):
+    """ One TPV and one SKY report for a stationary receiver. """
+    tpv = {
+        'class': 'TPV', 'device': DEVICE, 'mode': 3, 'status': 2, 'time': gpsd_time(ts),
+        'leapseconds': 18, 'ept': 0.005,
+        'lat': lat + random.gauss(0, 1e-6), 'lon': lon + random.gauss(0, 1e-6),
+        'altHAE': 45.0 + random.gauss(0, 0.5), 'altMSL': 2.0 + random.gauss(0, 0.5),
+        'epx': 1.2, 'epy': 1.5, 'epv': 3.1, 'eph': 1.9, 'sep': 3.6, 'geoidSep': 43.0,
+        'track': 0.0, 'magtrack': 0.0, 'magvar': 2.1, 'speed': 0.01, 'climb': 0.0,
+        'eps': 0.3, 'epc': 6.2,
+        'ecefx': 3904345.36, 'ecefy': 335122.17, 'ecefz': 5026443.21, 'ecefpAcc': 2.1,
+        'ecefvx': 0.01, 'ecefvy': 0.0, 'ecefvz': -0.01, 'ecefvAcc': 0.3,
+        'velN': 0.0, 'velE': 0.01, 'velD': 0.0,
+    }
+    sats = []
+    for i in range(satellites):
+        gnssid = (0, 2, 3, 6)[i % 4]
+        svid = i // 4 + 1
+        sats.append({'PRN': gnssid * 100 + svid, 'gnssid': gnssid, 'svid': svid,
+                     'az': (i * 37.0 + ts / 240) % 360, 'el': 5 + (i * 13) % 85,
+                     'ss': 25 + (i * 7) % 25, 'used': i % 3 != 0, 'health': 1})
+    sky = {
+        'class': 'SKY', 'device': DEVICE, 'time': gpsd_time(ts),
+        'xdop': 0.55, 'ydop': 0.62, 'vdop': 1.1, 'tdop': 0.7, 'hdop': 0.83, 'gdop': 1.5, 'pdop': 1.38,
+        'nSat': len(sats), 'uSat': sum(1 for sat in sats if sat['used']), 'satellites': sats,
+    }
+    return tpv, sky
+
+
+def pps_report(ts):
+    sec = int(ts)
+    return {'class': 'PPS', 'device': PPS_DEVICE, 'real_sec': sec, 'real_nsec': 0,
+            'clock_sec': sec, 'clock_nsec': int(random.gauss(1500, 200)) % 1000000000,
+            'precision': -20}
+
+
+def toff_report(ts, latency=0.05):
+    """ The TOFF report of the fix at ts, its message stamped latency seconds later. """
+    real = int(ts * NSEC)
+    clock = int((ts + random.gauss(latency, latency / 10)) * NSEC)
+    return {'class': 'TOFF', 'device': DEVICE, 'real_sec': real // NSEC, 'real_nsec': real % NSEC,
+            'clock_sec': clock // NSEC, 'clock_nsec': clock % NSEC, 'precision': -1}
+
+
+def resize_satellites(satellites, count):
+    """ Trim or repeat a satellites array to count entries, repeated satellites get new svids. """
+    if not satellites or count is None:
+        return satellites
+    resized = satellites[:count]
+    svid = max(sat.get('svid', sat['PRN']) for sat in satellites)
+    while len(resized) < count:
+        for sat in satellites[:count - len(resized)]:
+            svid += 1
+            sat = dict(sat, svid=svid, PRN=sat.get('gnssid', 0) * 1000 + svid)
+            resized.append(sat)
+    return resized
+
+
+class Capture(object):
+    """
+    A recorded gpsd session, split in epochs: every epoch starts at a TPV
+    report and holds the reports up to the next TPV.
+    """
+
+    def __init__(self, path, satellites=None):
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt') as f:
+            reports = [json.loads(line) for line in f if line.strip()]
+
+        self.header = []
+        self.epochs = []
+        for report in reports:
+            if report['class'] == 'TPV':
+                self.epochs.append([])
+            if report['class'] == 'SKY' and satellites is not None:
+                report['satellites'] = resize_satellites(report.get('satellites', []), satellites)
+                report['nSat'] = len(report['satellites'])
+                report['uSat'] = sum(1 for sat in report['satellites'] if sat.get('used'))
+            (self.epochs[-1] if self.epochs else self.header).append(report)
+
+        times = [parse_gpsd_time(epoch[0]['time']) for epoch in self.epochs if 'time' in epoch[0]]
+        self.rate = (len(times) - 1) / (times[-1] - times[0]) if len(times) > 1 and times[-1] > times[0] else 1.0
+
+    def replay(self):
+        """ Generator of the reports of the capture, epoch by epoch, with their timestamps
+        moved to the time sent in. """
+        ts = yield
+        while True:
+            for epoch in self.epochs:
+                reports = []
+                for report in epoch:
+                    report = copy.copy(report)
+                    if 'time' in report:
+                        report['time'] = gpsd_time(time.time())
+                    if 'real_sec' in report:
+                        report['real_sec'] = report['clock_sec'] = int(ts)
+                    reports.append(report)
+                ts = yield reports
+
+
+class GpsdHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        server = self.server
+        sock = self.request
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            self.send({'class': 'VERSION', 'release': '3.25', 'rev': '3.25',
+                       'proto_major': 3, 'proto_minor': 15})
+            # wait for ?WATCH, PPS and TOFF only go out when it asks for pps, as with gpsd
+            watch = sock.recv(4096)
+            if not watch:
+                return
+            self.pps = b'"pps":true' in watch
+            if server.capture:
+                self.send(*(report for report in server.capture.header if report['class'] != 'VERSION'))
+            else:
+                self.send({'class': 'DEVICES', 'devices': [
+                    {'class': 'DEVICE', 'path': DEVICE, 'driver': 'u-blox', 'subtype': 'fake',
+                     'activated': gpsd_time(time.time()), 'flags': 1, 'native': 1, 'bps': 115200,
+                     'parity': 'N', 'stopbits': 1, 'cycle': 1.0 / server.rate, 'mincycle': 0.05}]},
+                    {'class': 'WATCH', 'enable': True, 'json': True})
+            self.stream()
+        except OSError:
+            pass
+
+    def send(self, *reports):
+        self.request.sendall(''.join(json.dumps(report, separators=(',', ':')) + '\r\n'
+                                     for report in reports).encode())
+        self.server.sent += len(reports)
+
+    def synthetic(self):
+        server = self.server
+        next_pps = math.floor(time.time()) + 1
+        ts = yield
+        while True:
+            reports = []
+            if ts >= next_pps:
+                reports.append(pps_report(next_pps))
+                next_pps += 1
+            reports.extend(synthetic_epoch(ts, server.satellites))
+            reports.append(toff_report(ts))
+            ts = yield reports
+
+    def stream(self):
+        server = self.server
+        epochs = server.capture.replay() if server.capture else self.synthetic()
+        next(epochs)
+        interval = 1.0 / server.rate
+        next_epoch = time.time()
+        while not server.stopped:
+            reports = epochs.send(time.time())
+            if not self.pps:
+                reports = [report for report in reports if report['class'] not in ('PPS', 'TOFF')]
+            if not server.paused:
+                self.send(*reports)
+            next_epoch += interval
+            delay = next_epoch - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+
+class FakeGpsd(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port, rate=None, satellites=24, host='127.0.0.1', capture=None):
+        if capture is not None and not isinstance(capture, Capture):
+            capture = Capture(capture, satellites)
+        self.capture = capture
+        self.rate = rate or (self.capture.rate if self.capture else 1.0)
+        self.satellites = satellites
+        self.stopped = False
+        # keeps the connections open without sending anything, like a hung gpsd
+        self.paused = False
+        self.sent = 0
+        socketserver.ThreadingTCPServer.__init__(self, (host, port), GpsdHandler)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.stopped = True
+        self.shutdown()
+        self.server_close()
+
+
+def capture_path(name):
+    """ A capture file, or the name of one of the reference captures in benchmarks/captures. """
+    if os.path.exists(name):
+        return name
+    return os.path.join(CAPTURES, name if name.endswith('.jsonl') else name + '.jsonl')
+
+
+def main():
+    parser = ArgumentParser(description=__import__('__main__').__doc__.split("\n")[1])
+    parser.add_argument('-p', '--port', type=int, default=2947,
+                        help="first TCP port to listen on [default: %(default)s]")
+    parser.add_argument('-c', '--count', type=int, default=1,
+                        help="number of fake gpsd instances on consecutive ports [default: %(default)s]")
+    parser.add_argument('-r', '--rate', type=float, default=None,
+                        help="epochs per second [default: rate of the capture, 1 Hz for synthetic data]")
+    parser.add_argument('-s', '--satellites', type=int, default=None,
+                        help="satellites per SKY report [default: as captured, 24 for synthetic data]")
+    parser.add_argument('-C', '--capture', default=None,
+                        help="replay this capture instead of synthetic data: a file or one of "
+                             f"{sorted(os.listdir(CAPTURES))}")
+    args = parser.parse_args()
+
+    capture = capture_path(args.capture) if args.capture else None
+    satellites = args.satellites if capture or args.satellites is not None else 24
+    servers = [FakeGpsd(args.port + i, args.rate, satellites, capture=capture).start()
+               for i in range(args.count)]
+    print(f'serving {args.count} fake gpsd at {servers[0].rate:g} Hz on ports {args.port}-{args.port + args.count - 1}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        for server in servers:
+            server.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+'''
+harness -- throughput, latency and memory of the exporter on a replayed gpsd
+
+Replays the reference captures (or any gpsd capture) through a fake gpsd
+and runs the exporter connection loop against it in this process. Every
+interval it prints the reports handled per second, the receiver-to-gauge
+latency of TPV reports, the /metrics scrape latency and the RSS.
+
+Usage:
+    python3 benchmarks/harness.py
+    python3 benchmarks/harness.py --capture rover_20hz --rate 20 --duration 60 --client asyncio
+    python3 benchmarks/harness.py --capture quad_timing_pps_1hz --exporter-args=--pps-histogram --json out.json
+'''
+
+import os
+import sys
+import json
+import time
+import shlex
+import threading
+import http.client
+import multiprocessing
+
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import gpsd_exporter
+
+from fake_gpsd import FakeGpsd, Capture, capture_path, parse_gpsd_time
+
+REFERENCE_CAPTURES = ['gps_only_1hz', 'quad_timing_pps_1hz', 'rover_20hz']
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def rss_mib():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * PAGE_SIZE / 1048576
+
+
+def percentile(values, p):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class Probe(object):
+    """ Wraps gpsd_exporter.process_report() to count reports and time TPV delivery. """
+
+    def __init__(self):
+        self.messages = 0
+        self.latencies = []
+        self.process_report = gpsd_exporter.process_report
+        gpsd_exporter.process_report = self
+
+    def __call__(self, nx, metrics, args):
+        self.process_report(nx, metrics, args)
+        self.messages += 1
+        if nx.get('class') == 'TPV' and 'time' in nx:
+            self.latencies.append(time.time() - parse_gpsd_time(nx['time']))
+
+    def take(self):
+        messages, latencies = self.messages, self.latencies
+        self.messages, self.latencies = 0, []
+        return messages, latencies
+
+    def close(self):
+        gpsd_exporter.process_report = self.process_report
+
+
+def scrape(port):
+    started = time.perf_counter()
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    conn.request('GET', '/metrics', headers={'Accept-Encoding': 'gzip'})
+    conn.getresponse().read()
+    conn.close()
+    return time.perf_counter() - started
+
+
+def run(name, capture, args):
+    server = None
+    endpoint = args.gpsd
+    if endpoint is None:
+        server = FakeGpsd(args.gpsd_port, args.rate, args.satellites, capture=capture).start()
+        endpoint = f'127.0.0.1:{args.gpsd_port}'
+
+    exporter_args = gpsd_exporter.build_parser().parse_args(
+        ['-G', endpoint, '-E', str(args.exporter_port), '--gpsd-client', args.client,
+         '--retry-delay', '1'] + shlex.split(args.exporter_args))
+    metrics = gpsd_exporter.init_metrics(exporter_args)
+    sources = [gpsd_exporter.bind_source(metrics, n, host, port, exporter_args)
+               for n, host, port in (gpsd_exporter.parse_endpoint(endpoint),)]
+    http_server = gpsd_exporter.start_exporter(args.exporter_port, '127.0.0.1', metrics)
+
+    probe = Probe()
+    threading.Thread(target=gpsd_exporter.run_endpoints, args=(sources, exporter_args), daemon=True).start()
+
+    samples = []
+    print(f'{name}: client {args.client}, {server.rate if server else 0:.0f} Hz')
+    print(f'{"t (s)":>6} {"msg/s":>8} {"lat p50 (ms)":>13} {"lat p99 (ms)":>13} {"scrape (ms)":>12} {"RSS (MiB)":>10}')
+    started = time.monotonic()
+    probe.take()
+    try:
+        while time.monotonic() - started < args.duration:
+            time.sleep(args.interval)
+            messages, latencies = probe.take()
+            sample = {
+                't': round(time.monotonic() - started, 1),
+                'messages_per_second': messages / args.interval,
+                'latency_p50_ms': percentile(latencies, 0.5) * 1000,
+                'latency_p99_ms': percentile(latencies, 0.99) * 1000,
+                'scrape_ms': scrape(args.exporter_port) * 1000,
+                'rss_mib': rss_mib(),
+            }
+            samples.append(sample)
+            print(f'{sample["t"]:>6.1f} {sample["messages_per_second"]:>8.1f} {sample["latency_p50_ms"]:>13.3f} '
+                  f'{sample["latency_p99_ms"]:>13.3f} {sample["scrape_ms"]:>12.2f} {sample["rss_mib"]:>10.1f}')
+    finally:
+        probe.close()
+        http_server.shutdown()
+        http_server.server_close()
+        if server:
+            server.stop()
+    return samples
+
+
+def main():
+    parser = ArgumentParser(description=__import__('__main__').__doc__.split("\n")[1])
+    parser.add_argument('-C', '--capture', action='append', default=[],
+                        help=f"capture to replay, repeatable [default: {', '.join(REFERENCE_CAPTURES)}]")
+    parser.add_argument('-r', '--rate', type=float, default=None,
+                        help="epochs per second [default: rate of the capture]")
+    parser.add_argument('-s', '--satellites', type=int, default=None,
+                        help="satellites per SKY report [default: as captured]")
+    parser.add_argument('--client', choices=['gps', 'asyncio'], default='gps',
+                        help="gpsd client of the exporter [default: %(default)s]")
+    parser.add_argument('--exporter-args', default='',
+                        help="extra options for the exporter, e.g. \"--pps-histogram\"")
+    parser.add_argument('--gpsd', default=None, metavar='HOST:PORT',
+                        help="use this (fake) gpsd instead of replaying a capture in this process")
+    parser.add_argument('--duration', type=float, default=20,
+                        help="seconds per capture [default: %(default)s]")
+    parser.add_argument('--interval', type=float, default=5,
+                        help="seconds per sample [default: %(default)s]")
+    parser.add_argument('--gpsd-port', type=int, default=22947,
+                        help="port of the fake gpsd [default: %(default)s]")
+    parser.add_argument('--exporter-port', type=int, default=29015,
+                        help="port of the exporter under test [default: %(default)s]")
+    parser.add_argument('--json', default=None,
+                        help="write the samples to this file, for comparing runs")
+    args = parser.parse_args()
+
+    # Read everything up front, the exporter drops its privileges once connected when run as root
+    captures = {name: Capture(capture_path(name), args.satellites) for name in args.capture or REFERENCE_CAPTURES}
+    output = open(args.json, 'w') if args.json else None
+
+    # One process per capture, so the connection loop of a finished run cannot bleed into the next
+    results = {}
+    ctx = multiprocessing.get_context('fork')
+    for name, capture in captures.items():
+        receiver, sender = ctx.Pipe(duplex=False)
+        child = ctx.Process(target=lambda: sender.send(run(name, capture, args)))
+        child.start()
+        results[name] = receiver.recv()
+        child.join()
+        print()
+
+    if output:
+        with output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+'''
+push_sink -- a local stand-in for the Pushgateway to try --push-url against
+
+Accepts the batches the exporter POSTs, gzip compressed or not, and prints
+for every batch its size, its number of samples and how old its sample
+timestamps are. --outage makes it answer 503 for a while, to watch the
+exporter spool the batches and push them in bulk once it is back.
+
+Usage:
+    python3 benchmarks/push_sink.py --port 9091 --outage 30,90
+    gpsd_exporter.py --push-url http://127.0.0.1:9091/metrics/job/gpsd --push-interval 5
+'''
+
+import sys
+import gzip
+import time
+
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def parse_outage(value):
+    start, end = (float(part) for part in value.split(','))
+    return start, end
+
+
+class SinkHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        elapsed = time.monotonic() - server.started
+        if server.outage and server.outage[0] <= elapsed < server.outage[1]:
+            self.send_error(503, 'Outage')
+            return
+
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        samples = [line for line in body.split(b'\n') if line and not line.startswith(b'#')]
+        stamps = [int(line.rsplit(b' ', 1)[1]) for line in samples if line.count(b' ') >= 2]
+        age = f'{time.time() - max(stamps) / 1000:8.1f}' if stamps else '       -'
+
+        server.batches += 1
+        print(f'{elapsed:8.1f} {self.path:<32} {len(body):>8} {len(samples):>8} {age}', flush=True)
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = ArgumentParser(description=__import__('__main__').__doc__.split("\n")[1])
+    parser.add_argument('--port', type=int, default=9091,
+                        help="port to listen on [default: %(default)s]")
+    parser.add_argument('--outage', type=parse_outage, default=None, metavar="START,END",
+                        help="answer 503 from START until END seconds after starting")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), SinkHandler)
+    server.started = time.monotonic()
+    server.outage = args.outage
+    server.batches = 0
+    print(f'{"t (s)":>8} {"path":<32} {"bytes":>8} {"samples":>8} {"age (s)":>8}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+'''
+validate_accuracy -- check the sliding window position accuracy against a direct computation
+
+Draws fixes with a known spread around a site, feeds them through the
+--accuracy-windows handler of an exporter set up with and without a geo
+point, and compares the standard deviations and the mean position it
+exports with the ones computed straight from the drawn offsets. The geo
+point is the site itself, the default of the Docker image (with latitude
+and longitude swapped) and a point --distance meters away, where the
+statistics must not depend on it.
+
+Usage:
+    python3 benchmarks/validate_accuracy.py --fixes 20000
+    python3 benchmarks/validate_accuracy.py --lat 52.1 --lon 5.1 --distance 500000 --noise 1
+'''
+
+import os
+import sys
+import math
+import random
+import statistics
+
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import gpsd_exporter
+
+
+def make_fixes(site, count, noise, seed=1):
+    """ TPV like dicts, and their (east, north, up) offsets from the site. """
+    rng = random.Random(seed)
+    fixes, offsets = [], []
+    for _ in range(count):
+        e, n, u = rng.gauss(0, noise), rng.gauss(0, noise), rng.gauss(0, 2 * noise)
+        lat, lon, alt = site.position(e, n, u)
+        fixes.append({'class': 'TPV', 'mode': 3, 'lat': lat, 'lon': lon, 'altHAE': alt})
+        offsets.append((e, n, u))
+    return fixes, offsets
+
+
+def exported(fixes, geo_point, window):
+    """ (std (e, n, u), mean (lat, lon, alt)) of the exporter with this geo point. """
+    options = ['--accuracy-windows', str(window)]
+    if geo_point is not None:
+        options += ['--offset-from-geopoint', '--geopoint-lat', str(geo_point[0]), '--geopoint-lon', str(geo_point[1])]
+    args = gpsd_exporter.build_parser().parse_args(options)
+    metrics = gpsd_exporter.bind_source(gpsd_exporter.init_metrics(args), 'validate', 'localhost', 2947, args)
+    tracker = metrics['ACCURACY']
+    for fix in fixes:
+        gpsd_exporter.handle_accuracy(fix, metrics, args)
+    (_, _, mean, std), = tracker.statistics()
+    return std, tracker.projector.position(*mean)
+
+
+def main():
+    parser = ArgumentParser(description=__import__('__main__').__doc__.split("\n")[1])
+    parser.add_argument('--fixes', type=int, default=20000,
+                        help="fixes drawn around the site [default: %(default)s]")
+    parser.add_argument('--lat', type=float, default=52.1,
+                        help="latitude of the site [default: %(default)s]")
+    parser.add_argument('--lon', type=float, default=5.1,
+                        help="longitude of the site [default: %(default)s]")
+    parser.add_argument('--noise', type=float, default=1.0,
+                        help="standard deviation of the fixes east and north in meters, twice that "
+                             "up [default: %(default)s]")
+    parser.add_argument('--distance', type=float, default=500000,
+                        help="meters north east of the site of the distant geo point [default: %(default)s]")
+    args = parser.parse_args()
+
+    site = gpsd_exporter.GeoProjector(args.lat, args.lon, 10.0)
+    fixes, offsets = make_fixes(site, args.fixes, args.noise)
+    std = [statistics.stdev(axis) for axis in zip(*offsets)]
+    mean = site.position(*(statistics.fmean(axis) for axis in zip(*offsets)))
+    step = args.distance / math.sqrt(2)
+    geo_points = {
+        'none': None,
+        'site': (args.lat, args.lon),
+        'docker default': (38.897809878, -77.036551259)[::-1],
+        f'{args.distance / 1000:g} km away': site.position(step, step)[:2],
+    }
+
+    print(f'{args.fixes} fixes, std {std[0]:.3f} / {std[1]:.3f} / {std[2]:.3f} m\n')
+    print(f'{"geo point":<16} {"std e/n/u error (mm)":>22} {"mean error (mm)":>16}')
+    worst = 0.0
+    for name, geo_point in geo_points.items():
+        # long enough a window for all fixes
+        result_std, result_mean = exported(fixes, geo_point, 10 ** 9)
+        # an axis or a height that is not exported is an error as well
+        std_error = max(abs(a - b) if a is not None else math.inf for a, b in zip(result_std, std))
+        north = (result_mean[0] - mean[0]) * site.m_per_deg_lat
+        east = ((result_mean[1] - mean[1] + 540) % 360 - 180) * site.m_per_deg_lon
+        up = result_mean[2] - mean[2] if result_mean[2] is not None else math.inf
+        mean_error = math.sqrt(north * north + east * east + up * up)
+        worst = max(worst, std_error, mean_error)
+        print(f'{name:<16} {std_error * 1000:>22.3f} {mean_error * 1000:>16.3f}')
+
+    print(f'\nlargest error: {worst * 1000:.3f} mm')
+    return 0 if worst < 0.001 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
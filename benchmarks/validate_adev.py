@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+'''
+validate_adev -- check the incremental Allan and time deviation against a batch computation
+
+Feeds a PPS phase series one sample at a time into the AllanDeviation
+tracker of --pps-adev, then computes the overlapping ADEV and TDEV of the
+same samples in one pass straight from their definitions and prints both
+with their relative difference and the cost per update. The phase series
+is synthetic (white phase noise plus random walk frequency noise) or the
+PPS reports of a session recorded with --record.
+
+Usage:
+    python3 benchmarks/validate_adev.py --samples 40000
+    python3 benchmarks/validate_adev.py --recording session.log.gz --device /dev/pps0
+'''
+
+import os
+import sys
+import math
+import json
+import time
+import random
+
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import gpsd_exporter
+
+
+def synthetic_phase(count, seed=1):
+    """ Phase in seconds: 20 ns white phase noise on a 1e-11 random walk of frequency. """
+    rng = random.Random(seed)
+    phase, x, y = [], 0.0, 0.0
+    for _ in range(count):
+        y += rng.gauss(0, 1e-11)
+        x += y
+        phase.append(x + rng.gauss(0, 20e-9))
+    return phase
+
+
+def recorded_phase(path, device, pps_time1):
+    """ Phase in seconds of the PPS reports of one device in a recording, up to its first gap. """
+    args = gpsd_exporter.build_parser().parse_args(['--pps-time1', str(pps_time1)])
+    phase, last_sec = [], None
+    with gpsd_exporter.open_recording(path) as f:
+        for line in f:
+            report = json.loads(line.split(b'\t', 2)[2])
+            if report.get('class') != 'PPS':
+                continue
+            device = device or report['device']
+            if report['device'] != device:
+                continue
+            if report['real_sec'] == last_sec:
+                continue
+            if last_sec is not None and report['real_sec'] != last_sec + 1:
+                break
+            last_sec = report['real_sec']
+            phase.append(gpsd_exporter.pps_offset(report, args) / gpsd_exporter.NSEC)
+    return phase
+
+
+def batch_deviations(phase, m, window):
+    """ ADEV and TDEV over the last window terms, straight from the definitions. """
+    n = len(phase)
+
+    # AVAR = 1 / (2 tau^2 T) sum (x[i+2m] - 2x[i+m] + x[i])^2
+    d = [phase[i + 2 * m] - 2 * phase[i + m] + phase[i] for i in range(n - 2 * m)]
+    terms = d[-window:]
+    adev = math.sqrt(math.fsum(v * v for v in terms) / (2 * m * m * len(terms)))
+
+    # MVAR = 1 / (2 m^2 tau^2 T) sum_j (sum_{i=j}^{j+m-1} d[i])^2, TVAR = tau^2 / 3 MVAR
+    inner = [math.fsum(d[j:j + m]) for j in range(max(0, len(d) - m + 1 - window), len(d) - m + 1)]
+    mvar = math.fsum(s * s for s in inner) / (2 * m ** 4 * len(inner))
+    tdev = math.sqrt(m * m / 3 * mvar)
+    return adev, tdev
+
+
+def main():
+    parser = ArgumentParser(description=__import__('__main__').__doc__.split("\n")[1])
+    parser.add_argument('--samples', type=int, default=40000,
+                        help="samples of the synthetic phase series [default: %(default)s]")
+    parser.add_argument('--recording', default=None,
+                        help="take the phase from the PPS reports in this --record file")
+    parser.add_argument('--device', default=None,
+                        help="pps device in the recording [default: the first one]")
+    parser.add_argument('--pps-time1', type=float, default=0,
+                        help="time1 correction of the recorded offsets [default: %(default)s]")
+    parser.add_argument('--adev-taus', type=gpsd_exporter.parse_seconds, default=gpsd_exporter.DEFAULT_ADEV_TAUS,
+                        help="averaging times in seconds [default: %(default)s]")
+    parser.add_argument('--adev-window', type=int, default=gpsd_exporter.DEFAULT_ADEV_WINDOW,
+                        help="terms per deviation [default: %(default)s]")
+    args = parser.parse_args()
+
+    if args.recording:
+        phase = recorded_phase(args.recording, args.device, args.pps_time1)
+    else:
+        phase = synthetic_phase(args.samples)
+
+    tracker = gpsd_exporter.AllanDeviation(args.adev_taus, args.adev_window)
+    started = time.perf_counter()
+    for x in phase:
+        tracker.update(x)
+    elapsed = time.perf_counter() - started
+    print(f'{len(phase)} samples, {elapsed / max(len(phase), 1) * 1e6:.1f} us per update\n')
+
+    print(f'{"tau (s)":>8} {"adev":>12} {"batch adev":>12} {"rel diff":>9} '
+          f'{"tdev (s)":>12} {"batch tdev":>12} {"rel diff":>9}')
+    worst = 0.0
+    for tau, adev, tdev in tracker.deviations():
+        batch_adev, batch_tdev = batch_deviations(phase, tau, args.adev_window)
+        adev_diff = abs(adev - batch_adev) / batch_adev
+        tdev_diff = abs(tdev - batch_tdev) / batch_tdev
+        worst = max(worst, adev_diff, tdev_diff)
+        print(f'{tau:>8} {adev:>12.4e} {batch_adev:>12.4e} {adev_diff:>9.1e} '
+              f'{tdev:>12.4e} {batch_tdev:>12.4e} {tdev_diff:>9.1e}')
+
+    print(f'\nlargest relative difference: {worst:.1e}')
+    return 0 if worst < 1e-6 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
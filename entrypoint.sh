@@ -17,6 +17,9 @@ fi
 if [ -n "${GPSD_PORT}" ]; then
   EXPORTER_ARGS="${EXPORTER_ARGS} --port ${GPSD_PORT}"
 fi
+for endpoint in ${GPSD_ENDPOINTS}; do
+  EXPORTER_ARGS="${EXPORTER_ARGS} --gpsd ${endpoint}"
+done
 if [ -n "${EXPORTER_PORT}" ]; then
   EXPORTER_ARGS="${EXPORTER_ARGS} --exporter-port ${EXPORTER_PORT}"
 fi
@@ -30,6 +33,9 @@ fi
 if [ -n "${GEOPOINT_LAT}" ]; then
   EXPORTER_ARGS="${EXPORTER_ARGS} --geopoint-lat ${GEOPOINT_LAT}"
 fi
+if [ -n "${GEOPOINT_ALT}" ]; then
+  EXPORTER_ARGS="${EXPORTER_ARGS} --geopoint-alt ${GEOPOINT_ALT}"
+fi
 
 if [ -n "${GEO_BUCKET_SIZE}" ]; then
   EXPORTER_ARGS="${EXPORTER_ARGS} --geo-bucket-size ${GEO_BUCKET_SIZE}"
@@ -45,11 +51,23 @@ if [ -n "${PPS_BUCKET_COUNT}" ]; then
   EXPORTER_ARGS="${EXPORTER_ARGS} --pps-bucket-count ${PPS_BUCKET_COUNT}"
 fi
 
+if [ -n "${PUSH_URL}" ]; then
+  EXPORTER_ARGS="${EXPORTER_ARGS} --push-url ${PUSH_URL}"
+fi
+if [ -n "${PUSH_SPOOL}" ]; then
+  EXPORTER_ARGS="${EXPORTER_ARGS} --push-spool ${PUSH_SPOOL}"
+fi
+
+if [ -n "${RECORD_FILE}" ]; then
+  EXPORTER_ARGS="${EXPORTER_ARGS} --record ${RECORD_FILE}"
+fi
+
 # Add PPS histogram support if PPS_TIME1 is set
 if [ -n "${PPS_TIME1}" ]; then
   EXPORTER_ARGS="${EXPORTER_ARGS} --pps-histogram --pps-time1 ${PPS_TIME1}"
 fi
 
-echo ./gpsd_exporter.py --offset-from-geopoint ${EXPORTER_ARGS}
-./gpsd_exporter.py --offset-from-geopoint ${EXPORTER_ARGS}
+# run as a module, from the bytecode compiled when the image was built
+echo python3 -m gpsd_exporter --offset-from-geopoint ${EXPORTER_ARGS}
+exec python3 -m gpsd_exporter --offset-from-geopoint ${EXPORTER_ARGS}
 
@@ -19,18 +19,33 @@ It defines classes_and_methods
 
 import sys
 import os
-import gps
 import time
 import math
+import mmap
+import struct
 import pwd
 import grp
 import queue
 import socket
 import json
+import threading
+import gzip
+import atexit
+import signal
+import random
+import calendar
+import urllib.error
+import urllib.parse
+import urllib.request
 
 import logging
-from prometheus_client import Histogram, CollectorRegistry, start_http_server, Gauge, Info
-from prometheus_client.metrics_core import GaugeMetricFamily
+from array import array
+from collections import deque
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from prometheus_client import Histogram, CollectorRegistry, Counter, Gauge, Info, Summary, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client.metrics_core import GaugeMetricFamily, GaugeHistogramMetricFamily, Metric
+from prometheus_client.utils import floatToGoString
 
 log = logging.getLogger(__name__)
 
@@ -47,8 +62,72 @@ GPSD_PORT = 2947
 EXPORTER_PORT = 9015
 DEFAULT_HOST = 'localhost'
 DEFAULT_TIMEOUT = 10  # Default connection timeout in seconds
-DEFAULT_RETRY_DELAY = 10  # Default initial retry delay in seconds
+DEFAULT_RETRY_DELAY = 2  # Default initial retry delay in seconds
+DEFAULT_WATCHDOG_FACTOR = 5  # Report intervals without data before the connection counts as dead
+WATCHDOG_MIN = 1.0  # Shortest deadline of the watchdog in seconds
+CADENCE_WEIGHT = 0.1  # Weight of the last TPV interval in the average the watchdog learns
+KEEPALIVE_IDLE = 10  # Seconds of silence before TCP keepalive probes the gpsd host
+KEEPALIVE_INTERVAL = 5  # Seconds between two keepalive probes
+KEEPALIVE_COUNT = 3  # Unanswered keepalive probes before the connection is dropped
+# values of gpsd_exporter_connection_state
+DISCONNECTED, CONNECTING, CONNECTED = 0, 1, 2
 DEFAULT_MAX_RETRY_DELAY = 300  # Maximum retry delay in seconds (5 minutes)
+DEFAULT_METRICS_MAX_AGE = 1.0  # Seconds a rendered /metrics payload may be served from the cache
+DEFAULT_SAT_TTL = 30  # Seconds a satellite stays exported after its last SKY report
+DEFAULT_ELEVATION_MASK = 10  # Degrees above the horizon a satellite counts as usable from
+GNSS_NAMES = {0: 'GPS', 1: 'SBAS', 2: 'Galileo', 3: 'BeiDou', 4: 'IMES', 5: 'QZSS', 6: 'GLONASS', 7: 'NavIC'}  # gnssid of gpsd
+MAX_LINE_LENGTH = 1024 * 1024  # Longest gpsd report accepted by the asyncio client
+RECORD_BUFFER_SIZE = 64 * 1024  # Bytes of recorded reports collected before they are written
+RECORD_FLUSH_INTERVAL = 1.0  # Seconds recorded reports may wait in memory
+DEFAULT_SKETCH_QUANTILES = '0.5,0.9,0.99,0.999'
+DEFAULT_SKETCH_WINDOW = 600  # Seconds of observations behind the exported quantiles
+DEFAULT_SKETCH_ACCURACY = 0.01  # Relative accuracy of the quantile sketches
+SKETCH_SLOTS = 10  # Sub-windows the sketch window slides by
+SKETCH_MAX_BUCKETS = 2048  # Buckets per sign before a sketch collapses its smallest values
+SKETCH_MIN_VALUE = 1e-9  # Magnitudes below this count as zero
+DEFAULT_ADEV_TAUS = '1,2,5,10,20,50,100,200,500,1000,2000,5000,10000'
+DEFAULT_ADEV_WINDOW = 3600  # Terms per tau the deviations are averaged over
+ACCURACY_SLOTS = 30  # Sub-windows every accuracy window slides by
+AGGREGATE_SLOTS = 10  # Sub-windows a fixed aggregation window slides by
+PPS_WINDOW_SLOTS = 10  # Sub-histograms the --pps-window slides by
+DEFAULT_PROFILE_SECONDS = 30  # Seconds a profile samples the stacks for
+MAX_PROFILE_SECONDS = 300  # Longest profile /debug/profile accepts
+MIN_PROFILE_SECONDS = 1  # Shortest profile /debug/profile accepts
+KEEP_PROFILES = 10  # Newest profiles kept in --profile-dir
+PROFILE_INTERVAL = 0.005  # Seconds between two stack samples of the profiler
+DEFAULT_PUSH_INTERVAL = 15  # Seconds between two pushes to --push-url
+DEFAULT_PUSH_SPOOL_SIZE = 16 * 1024 * 1024  # Bytes of compressed batches kept while --push-url is unreachable
+PUSH_SPOOL_SUFFIX = '.prom.gz'
+DEFAULT_HISTORY_SIZE = 524288  # Records in the history ring, 40 MiB
+DEFAULT_HISTORY_SECONDS = 300  # Seconds /history returns without from=
+MAX_HISTORY_RECORDS = 200000  # Most records one /history request returns
+HISTORY_MAGIC = b'GPSDHIST'
+HISTORY_HEADER = struct.Struct('<8sIIQQ')  # magic, version, record size, capacity, records written
+HISTORY_HEADER_SIZE = 4096  # Bytes before the first record, the header and the names of sources and devices
+HISTORY_RECORD = struct.Struct('<dHHH2x8d')  # time, class, source, device, 8 fields
+HISTORY_MARGIN = 1024  # Oldest records a query of a full ring skips, at most 1/8 of the ring
+DEFAULT_SKYMAP_STEP = 5  # Degrees of azimuth and elevation per sky map cell
+SKYMAP_SAVE_INTERVAL = 60  # Seconds between two saves of the sky map
+DEFAULT_STREAM_QUEUE = 64  # Frames a /stream client may fall behind before it is disconnected
+DEFAULT_STREAM_CLIENTS = 500  # Most /stream clients at a time
+STREAM_BACKLOG = 4096  # Reports waiting to be sent to the /stream clients
+STREAM_KEEPALIVE = 15  # Seconds between keepalives on an idle /stream
+STREAM_WRITE_TIMEOUT = 10  # Seconds a /stream client may block a write
+# report class -> the fields a history record keeps of it
+HISTORY_FIELDS = {
+    'TPV': ('mode', 'lat', 'lon', 'altHAE', 'speed', 'track', 'eph', 'epv'),
+    'SKY': ('nSat', 'uSat', 'ss', 'hdop', 'vdop', 'pdop', 'gdop', 'tdop'),
+    'PPS': ('offset', 'real', 'clock', 'precision', 'qErr'),
+}
+PROCESS_BUCKETS = (.00001, .000025, .00005, .0001, .00025, .0005, .001, .0025, .005, .01, .025, .1, float("inf"))
+FIX_LAG_BUCKETS = (.01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, float("inf"))
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .075, .1, .15, .2, .3, .5, .75, 1, 2.5, float("inf"))
+OUTAGE_BUCKETS = (1, 5, 10, 30, 60, 300, 900, 3600, float("inf"))
+WATCH = {'enable': True, 'json': True, 'scaled': True}
+PPS_CLASSES = ('PPS', 'TOFF')  # reports gpsd only sends when the WATCH asks for pps
+CLASS_PREFIX = b'{"class":"'  # how gpsd starts every report
+WGS84_A = 6378137.0  # Equatorial radius of the WGS84 ellipsoid in meters
+WGS84_E2 = 0.00669437999014132  # First eccentricity squared of the WGS84 ellipsoid
 NSEC = 1000000000
 USEC = 1000000
 MSEC = 1000
@@ -56,35 +135,22 @@ MSEC = 1000
 class DependencyError(Exception):
     pass
 
-# Monkey patch to handle JSON encoding issues with newer Python versions
-try:
-    # Try to patch the JSON decoder if needed
-    original_init = json.JSONDecoder.__init__
-    def patched_init(self, *args, **kwargs):
-        # Remove encoding parameter if present (deprecated in Python 3.9+)
-        kwargs.pop('encoding', None)
-        return original_init(self, *args, **kwargs)
-    json.JSONDecoder.__init__ = patched_init
-except Exception:
-    # If patching fails, continue anyway
-    pass
-
-# Check gps version using packaging module (modern approach)
-try:
-    from packaging import version
-    if version.parse(gps.__version__) < version.parse("3.18"):
-        raise DependencyError('Please upgrade the python gps package to 3.18 or higher.')
-except ImportError:
-    # Fallback to simple string comparison if packaging not available
+def check_gps_version(version):
+    """ Raise DependencyError for a gps package older than 3.18. """
     try:
-        gps_version = gps.__version__.split('.')
-        if len(gps_version) >= 2:
-            major, minor = int(gps_version[0]), int(gps_version[1])
-            if major < 3 or (major == 3 and minor < 18):
-                raise DependencyError('Please upgrade the python gps package to 3.18 or higher.')
+        major, minor = (int(part) for part in version.split('.')[:2])
     except (ValueError, AttributeError):
         # If version check fails, continue anyway
-        pass
+        return
+    if (major, minor) < (3, 18):
+        raise DependencyError('Please upgrade the python gps package to 3.18 or higher.')
+
+
+def import_gps():
+    """ Import the gps package on first use, the asyncio client and --replay never need it. """
+    import gps
+    check_gps_version(gps.__version__)
+    return gps
 
 class CLIError(Exception):
     '''Generic exception to raise and log different fatal errors.'''
@@ -110,9 +176,6 @@ class ModuleDependencyError(ModuleNotFoundError):
     def __unicode__(self):
         return self.msg
 
-sat_queue = queue.Queue()
-
-
 def main(argv=None):  # IGNORE:C0111
     '''Command line options.'''
 
@@ -146,57 +209,7 @@ Usage:
 ''' % (program_shortdesc, str(__date__), program_version, program_build_date)
 
     try:
-        # Setup argument parser
-        parser = ArgumentParser(description=program_license, formatter_class=RawDescriptionHelpFormatter)
-        parser.add_argument("-v", "--verbose", dest="verbose", action="count",
-                             help="set verbosity level [default: %(default)s]")
-        parser.add_argument('-V', '--version', action='version', version=program_version_message)
-        parser.add_argument('-d', '--debug', action='count', default=0, dest="debug",
-                            help="set debug level [default: %(default)s]")
-        
-        parser.add_argument('-p', '--port', type=int, dest="port", default=GPSD_PORT,
-                            help="set gpsd TCP Port number [default: %(default)s]")
-        parser.add_argument('-H', '--hostname', dest="hostname", default=DEFAULT_HOST,
-                            help="set gpsd TCP Hostname/IP address [default: %(default)s]")
-        parser.add_argument('-E', '--exporter-port', type=int, dest="exporter_port", default=EXPORTER_PORT,
-                            help="set TCP Port for the exporter server [default: %(default)s]")
-        parser.add_argument('-L', '--listen-address', dest="listen_address", default='::',
-                            help="set listen address for the exporter server. Use '::' for IPv4+IPv6 dual-stack, "
-                                 "'0.0.0.0' for IPv4-only [default: %(default)s]")
-        
-        parser.add_argument('-t', '--timeout', type=int, dest="timeout", default=DEFAULT_TIMEOUT,
-                            help="set connection timeout in seconds [default: %(default)s]")
-        
-        parser.add_argument('--retry-delay', type=int, dest="retry_delay", default=DEFAULT_RETRY_DELAY,
-                            help="initial retry delay in seconds [default: %(default)s]")
-        parser.add_argument('--max-retry-delay', type=int, dest="max_retry_delay", default=DEFAULT_MAX_RETRY_DELAY,
-                            help="maximum retry delay in seconds [default: %(default)s]")
-        
-        parser.add_argument('-S', '--disable-monitor-satellites', dest="mon_satellites", 
-                            default=True, action="store_false",
-                            help="Stops monitoring all satellites individually")
-        
-        parser.add_argument('--offset-from-geopoint', action="store_true", dest="geo_offset",
-                            default=False, help="track offset (x,y offset and distance) from a stationary location.")
-        parser.add_argument('--geopoint-lat', dest="geo_lat",type=float,
-                            default=False, help="Latitude of a fixed stationary location.")
-        parser.add_argument('--geopoint-lon', dest="geo_lon", type=float,
-                            default=False, help="Longitude of a fixed stationary location.")
-        
-        parser.add_argument('--geo-bucket-size', dest="geo_bucket_size", default=0.5, type=float,
-                            help="Bucket side of Geo histogram [default: %(default)s meter] ")
-        parser.add_argument('--geo-bucket-count', dest="geo_bucket_count", default=40, type=int,
-                            help="Bucket count of Geo histogram [default: %(default)s]")
-
-        ## pps
-        parser.add_argument('--pps-histogram', action="store_true", dest="pps", default=False,
-                            help="generate histogram data from pps devices.")
-        parser.add_argument('--pps-bucket-size', dest="pps_bucket_size", default=250, type=int,
-                            help="Bucket side of PPS histogram [default: %(default)s ns]  (nano seconds)")
-        parser.add_argument('--pps-bucket-count', dest="pps_bucket_count", default=40, type=int,
-                            help="Bucket count of PPS histogram [default: %(default)s]")
-        parser.add_argument('--pps-time1', dest="pps_time1", default=0, type=float,
-                            help="Local pps clock (offset) time1 (ntp.conf) [default: %(default)s]")
+        parser = build_parser(program_license, program_version_message)
 
         # Process arguments
         args = parser.parse_args()
@@ -213,45 +226,50 @@ Usage:
             logging.basicConfig(format=program_name + ': %(message)s', stream=sys.stderr, level=logging.WARN)
 
         log.info('started')
+
+        if args.aggregate_fields and args.push_url and not args.aggregate_window:
+            # every push renders the metrics too, and would reset the aggregates of the scrapes
+            log.info(f'Aggregating over the push interval of {args.push_interval}s')
+            args.aggregate_window = args.push_interval
         
+        endpoints = [parse_endpoint(endpoint, args.port) for endpoint in args.endpoints]
+        if not endpoints:
+            endpoints = [parse_endpoint(args.hostname, args.port)]
+
         metrics = init_metrics(args)
-        
+
+        if args.record or args.skymap:
+            # finish the recording and save the sky map on docker stop / systemctl stop as well
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
         log.info(f'Starting exporter on {args.listen_address}:{args.exporter_port}')
-        start_http_server(args.exporter_port, addr=args.listen_address, registry=metrics['registry'])
+        server = start_exporter(args.exporter_port, args.listen_address, metrics)
 
-        retry_count = 0
-        current_delay = args.retry_delay
-        
-        while True:
-            try:
-                loop_connection(metrics, args)
-                # If we get here, connection was successful, reset retry count
-                retry_count = 0
-                current_delay = args.retry_delay
-                
-            except KeyboardInterrupt:
-                print("Applications closed!")
-                return 0
-            except (StopIteration, ConnectionRefusedError, socket.timeout, ConnectionError, OSError) as e:
-                retry_count += 1
-                log.error(f'Connection to gpsd failed (attempt {retry_count}): {e}')
-                
-                print(f'WARNING: Connection failed (attempt {retry_count}), retrying in {current_delay}s...')
-                print(f'Connection error: {e}')
-                print(f'Error type: {type(e).__name__}')
-                
-                time.sleep(current_delay)
-                
-                # Exponential backoff with maximum delay
-                current_delay = min(current_delay * 2, args.max_retry_delay)
-                
-            except Exception as e:
-                log.error(f'Unexpected error in main loop: {e}')
-                print(f'ERROR: Unexpected error: {e}')
-                return 1
+        if args.profile_dir:
+            enable_profiling(server, args)
+
+        if args.push_url:
+            start_pusher(metrics, args)
+
+        if args.history:
+            server.routes['/history'] = serve_history
+
+        if args.stream:
+            server.routes['/stream'] = serve_stream
+
+        if args.skymap:
+            server.routes['/skymap'] = serve_skymap
+            start_skymap_saver(metrics, args)
+
+        if args.replay:
+            replay_session(metrics, args)
+            # keep serving the replayed metrics
+            threading.Event().wait()
+
+        sources = [bind_source(metrics, name, host, port, args) for name, host, port in endpoints]
+
+        return run_endpoints(sources, args)
 
-                
-        return 0
     except KeyboardInterrupt:
         ### handle keyboard interrupt ###
         return 0
@@ -263,77 +281,534 @@ Usage:
         sys.stderr.write(indent + "  for help use --help")
         return 2
 
+
+def parse_endpoint(endpoint, default_port=GPSD_PORT):
+    """ Split [NAME=]HOST[:PORT] into a (source name, host, port) tuple. IPv6 addresses
+    with a port are written as [ADDRESS]:PORT. """
+    name, _, address = endpoint.rpartition('=')
+
+    if address.startswith('['):
+        host, _, port = address[1:].partition(']')
+        port = port[1:] if port.startswith(':') else ''
+    elif address.count(':') == 1:
+        host, port = address.split(':')
+    else:
+        host, port = address, ''
+
+    try:
+        port = int(port) if port else default_port
+    except ValueError:
+        raise CLIError(f'invalid port in gpsd endpoint "{endpoint}"')
+
+    if not name:
+        name = f'[{host}]:{port}' if ':' in host else f'{host}:{port}'
+
+    return name, host, port
+
+
+def parse_seconds(value):
+    """ Parse a comma separated list of periods (averaging times, windows) in whole seconds. """
+    periods = sorted(set(int(period) for period in value.split(',')))
+    if not periods or periods[0] < 1:
+        raise ValueError(value)
+    return periods
+
+
+def parse_fields(value):
+    """ Parse a comma separated list of report fields. """
+    return [field.strip() for field in value.split(',') if field.strip()]
+
+
+def parse_quantiles(value):
+    """ Parse a comma separated list of quantiles between 0 and 1. """
+    quantiles = sorted(float(q) for q in value.split(','))
+    if not quantiles or quantiles[0] < 0 or quantiles[-1] > 1:
+        raise ValueError(value)
+    return quantiles
+
+
+def run_endpoints(sources, args):
+    """ Keep a connection open to every gpsd, each with its own retry loop. Returns when
+    one of the retry loops gives up. """
+    if args.gpsd_client == 'asyncio':
+        import asyncio
+        return asyncio.run(async_run_endpoints(sources, args))
+
+    # fail on an outdated gps package before the connection threads start
+    import_gps()
+
+    if len(sources) == 1:
+        return run_endpoint(sources[0], args)
+
+    results = queue.Queue()
+    for metrics in sources:
+        threading.Thread(target=lambda m=metrics: results.put(run_endpoint(m, args)),
+                         name=f'gpsd {metrics["source"]}', daemon=True).start()
+    return results.get()
+
+
+def retry_delay(retry_count, args):
+    """ Seconds to wait before retry number retry_count of an outage. The first retry is
+    immediate, a gpsd that restarts is mostly back by then. The others back off
+    exponentially with full jitter, so exporters that lost the same gpsd do not
+    retry in lockstep. """
+    if retry_count <= 1:
+        return 0
+    return random.uniform(0, min(args.retry_delay * 2 ** (retry_count - 2), args.max_retry_delay))
+
+
+def connection_failed(metrics, retry_count, current_delay, e):
+    log.error(f'Connection to gpsd {metrics["source"]} failed (attempt {retry_count}): {e}')
+
+    metrics['RECONNECTS'].inc()
+    if metrics['DISCONNECTED_AT'] is None:
+        metrics['DISCONNECTED_AT'] = time.monotonic()
+        if isinstance(e, socket.timeout):
+            metrics['WATCHDOG_TIMEOUTS'].inc()
+        if metrics['WITHDRAW']:
+            # a lost gpsd has no fix, do not keep exporting the last one
+            metrics['FIELDS'].withdraw()
+            metrics['SAT_STORE'].clear()
+            metrics['CONSTELLATIONS'].withdraw()
+            # a cached rendering would still serve them
+            metrics['CACHE'].invalidate()
+    metrics['STATE'].set(DISCONNECTED)
+    
+    print(f'WARNING: Connection to {metrics["source"]} failed (attempt {retry_count}), retrying in {current_delay:.1f}s...')
+    print(f'Connection error: {e}')
+    print(f'Error type: {type(e).__name__}')
+
+
+def connection_established(metrics):
+    """ Account the outage that ends with this connection, if any. """
+    metrics['STATE'].set(CONNECTED)
+    metrics['LIVENESS'].reset()
+    if metrics['DISCONNECTED_AT'] is not None:
+        metrics['OUTAGE'].observe(time.monotonic() - metrics['DISCONNECTED_AT'])
+        metrics['DISCONNECTED_AT'] = None
+
+
+def enable_keepalive(sock):
+    """ Let TCP probe the gpsd host, so a host that is gone without closing the connection
+    is noticed even while gpsd has nothing to report. """
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    for option, value in (('TCP_KEEPIDLE', KEEPALIVE_IDLE), ('TCP_KEEPINTVL', KEEPALIVE_INTERVAL),
+                          ('TCP_KEEPCNT', KEEPALIVE_COUNT)):
+        if hasattr(socket, option):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+
+
+def run_endpoint(metrics, args):
+
+    retry_count = 0
+    
+    while True:
+        try:
+            metrics['STATE'].set(CONNECTING)
+            loop_connection(metrics, args)
+            
+        except KeyboardInterrupt:
+            print("Applications closed!")
+            return 0
+        except (StopIteration, ConnectionRefusedError, socket.timeout, ConnectionError, OSError) as e:
+            # the retries start over after a connection that delivered fixes, not after
+            # one that a gpsd in trouble accepted and closed again
+            retry_count = 1 if metrics['LIVENESS'].last is not None else retry_count + 1
+            current_delay = retry_delay(retry_count, args)
+            connection_failed(metrics, retry_count, current_delay, e)
+            
+            time.sleep(current_delay)
+            
+        except Exception as e:
+            log.error(f'Unexpected error in main loop: {e}')
+            print(f'ERROR: Unexpected error: {e}')
+            return 1
+
+
+async def async_run_endpoints(sources, args):
+    import asyncio
+    tasks = [asyncio.create_task(async_run_endpoint(metrics, args)) for metrics in sources]
+    done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    for task in pending:
+        task.cancel()
+    return done.pop().result()
+
+
+async def async_run_endpoint(metrics, args):
+    import asyncio
+
+    retry_count = 0
+
+    while True:
+        try:
+            metrics['STATE'].set(CONNECTING)
+            await async_loop_connection(metrics, args)
+
+        except (ConnectionRefusedError, socket.timeout, ConnectionError, OSError) as e:
+            retry_count = 1 if metrics['LIVENESS'].last is not None else retry_count + 1
+            current_delay = retry_delay(retry_count, args)
+            connection_failed(metrics, retry_count, current_delay, e)
+
+            await asyncio.sleep(current_delay)
+
+        except Exception as e:
+            log.error(f'Unexpected error in main loop: {e}')
+            print(f'ERROR: Unexpected error: {e}')
+            return 1
+
+
+def build_parser(description=None, version_message=None):
+    """ The command line options of the exporter. """
+
+    # Setup argument parser
+    parser = ArgumentParser(description=description, formatter_class=RawDescriptionHelpFormatter)
+    parser.add_argument("-v", "--verbose", dest="verbose", action="count",
+                         help="set verbosity level [default: %(default)s]")
+    parser.add_argument('-V', '--version', action='version', version=version_message or __version__)
+    parser.add_argument('-d', '--debug', action='count', default=0, dest="debug",
+                        help="set debug level [default: %(default)s]")
     
+    parser.add_argument('-p', '--port', type=int, dest="port", default=GPSD_PORT,
+                        help="set gpsd TCP Port number [default: %(default)s]")
+    parser.add_argument('-H', '--hostname', dest="hostname", default=DEFAULT_HOST,
+                        help="set gpsd TCP Hostname/IP address [default: %(default)s]")
+    parser.add_argument('-G', '--gpsd', dest="endpoints", action="append", default=[],
+                        metavar="[NAME=]HOST[:PORT]",
+                        help="gpsd to monitor, repeat to monitor several gpsd instances from one "
+                             "exporter. NAME sets the source label [default: HOSTNAME:PORT]")
+    parser.add_argument('-E', '--exporter-port', type=int, dest="exporter_port", default=EXPORTER_PORT,
+                        help="set TCP Port for the exporter server [default: %(default)s]")
+    parser.add_argument('-L', '--listen-address', dest="listen_address", default='::',
+                        help="set listen address for the exporter server. Use '::' for IPv4+IPv6 dual-stack, "
+                             "'0.0.0.0' for IPv4-only [default: %(default)s]")
+    parser.add_argument('--metrics-max-age', type=float, dest="metrics_max_age", default=DEFAULT_METRICS_MAX_AGE,
+                        help="serve the rendered metrics from the cache until gpsd reports new data "
+                             "or the cached copy is this many seconds old, 0 disables the cache "
+                             "[default: %(default)s]")
+    
+    parser.add_argument('--gpsd-client', dest="gpsd_client", choices=['gps', 'asyncio'], default='gps',
+                        help="client used to read gpsd: 'gps' uses the python gps package, 'asyncio' "
+                             "reads the JSON stream directly from the socket [default: %(default)s]")
+    parser.add_argument('-t', '--timeout', type=int, dest="timeout", default=DEFAULT_TIMEOUT,
+                        help="set connection timeout in seconds, also the longest gpsd may stay "
+                             "silent [default: %(default)s]")
+    parser.add_argument('--watchdog-factor', type=float, dest="watchdog_factor", default=DEFAULT_WATCHDOG_FACTOR,
+                        help="reconnect when gpsd sends nothing for this many TPV intervals, "
+                             "0 only reconnects after --timeout [default: %(default)s]")
+    parser.add_argument('--keep-stale', action="store_false", dest="withdraw",
+                        help="keep exporting the last fix and satellites while gpsd is disconnected")
+    
+    parser.add_argument('--retry-delay', type=int, dest="retry_delay", default=DEFAULT_RETRY_DELAY,
+                        help="initial retry delay in seconds, the first retry after losing gpsd "
+                             "is immediate [default: %(default)s]")
+    parser.add_argument('--max-retry-delay', type=int, dest="max_retry_delay", default=DEFAULT_MAX_RETRY_DELAY,
+                        help="maximum retry delay in seconds [default: %(default)s]")
+
+    parser.add_argument('--record', dest="record", default=None, metavar="FILE",
+                        help="append every gpsd report with its arrival time to FILE, gzip "
+                             "compressed when FILE ends in .gz")
+    parser.add_argument('--replay', dest="replay", default=None, metavar="FILE",
+                        help="feed a session recorded with --record through the exporter "
+                             "instead of connecting to gpsd")
+    parser.add_argument('--replay-speed', type=float, dest="replay_speed", default=1.0,
+                        help="replay at this multiple of real time, 0 replays as fast as "
+                             "possible [default: %(default)s]")
+
+    parser.add_argument('--push-url', dest="push_url", default=None, metavar="URL",
+                        help="also POST the metrics in the text format to URL, an endpoint that imports "
+                             "the text format, or a Pushgateway with --push-no-timestamps")
+    parser.add_argument('--push-interval', dest="push_interval", type=float, default=DEFAULT_PUSH_INTERVAL,
+                        help="seconds between two pushes [default: %(default)s]")
+    parser.add_argument('--push-spool', dest="push_spool", default=None, metavar="DIR",
+                        help="keep the batches that could not be pushed yet in DIR instead of in "
+                             "memory, so they survive a restart")
+    parser.add_argument('--push-spool-size', dest="push_spool_size", type=int, default=DEFAULT_PUSH_SPOOL_SIZE,
+                        help="bytes of compressed batches kept while URL is unreachable, the oldest "
+                             "are dropped first [default: %(default)s]")
+    parser.add_argument('--push-no-timestamps', dest="push_timestamps", default=True, action="store_false",
+                        help="push the samples without timestamps and only the newest batch, "
+                             "the Pushgateway rejects timestamps")
+
+    parser.add_argument('--history', dest="history", default=None, metavar="FILE",
+                        help="keep the recent TPV, SKY and PPS reports in a ring buffer in FILE, "
+                             "served on /history, which survives a restart")
+    parser.add_argument('--history-size', dest="history_size", type=int, default=DEFAULT_HISTORY_SIZE,
+                        help=f"reports kept in the history, {HISTORY_RECORD.size} bytes each "
+                             "[default: %(default)s]")
+
+    parser.add_argument('--skymap', dest="skymap", default=None, metavar="FILE",
+                        help="bin the satellites of the SKY reports into an azimuth x elevation map of "
+                             "observations, mean signal strength and used fraction, served on /skymap "
+                             "and saved to FILE so it survives a restart")
+    parser.add_argument('--skymap-step', dest="skymap_step", type=float, default=DEFAULT_SKYMAP_STEP,
+                        metavar="DEGREES",
+                        help="degrees of azimuth and elevation per sky map cell [default: %(default)s]")
+
+    parser.add_argument('--stream', dest="stream", default=False, action="store_true",
+                        help="stream every TPV and SKY report as Server-Sent Events on /stream")
+    parser.add_argument('--stream-queue', dest="stream_queue", type=int, default=DEFAULT_STREAM_QUEUE,
+                        help="reports a /stream client may fall behind before it is disconnected "
+                             "[default: %(default)s]")
+    parser.add_argument('--stream-clients', dest="stream_clients", type=int, default=DEFAULT_STREAM_CLIENTS,
+                        help="most /stream clients at a time [default: %(default)s]")
+
+    parser.add_argument('--aggregate-fields', dest="aggregate_fields", type=parse_fields, default=[],
+                        metavar="FIELD[,FIELD...]",
+                        help="export the min, max, mean and count of these TPV and SKY fields (e.g. "
+                             "eph,epv,speed,hdop) next to their last value")
+    parser.add_argument('--aggregate-window', dest="aggregate_window", type=float, default=0,
+                        help="seconds the aggregates are taken over, 0 aggregates since the previous "
+                             "scrape, or over --push-interval with --push-url [default: %(default)s]")
+    
+    parser.add_argument('--profile-dir', dest="profile_dir", default=None, metavar="DIR",
+                        help="enable the sampling profiler: SIGUSR1 samples the stacks of all threads and "
+                             f"writes the profile to DIR, keeping the newest {KEEP_PROFILES}, GET "
+                             "/debug/profile?seconds=N returns one")
+    parser.add_argument('--profile-seconds', dest="profile_seconds", type=float, default=DEFAULT_PROFILE_SECONDS,
+                        help="seconds a profile started by SIGUSR1 samples for [default: %(default)s]")
+    
+    parser.add_argument('-S', '--disable-monitor-satellites', dest="mon_satellites", 
+                        default=True, action="store_false",
+                        help="Stops monitoring all satellites individually")
+    parser.add_argument('--sat-ttl', type=float, dest="sat_ttl", default=DEFAULT_SAT_TTL,
+                        help="drop a satellite from the per satellite metrics when gpsd has not "
+                             "reported it for this many seconds [default: %(default)s]")
+    parser.add_argument('--sat-no-used-label', dest="sat_used_label", default=True, action="store_false",
+                        help="leave the used label off the per satellite metrics, so a satellite keeps "
+                             "its series when it enters or leaves the solution; gpsd_used still exports it")
+    parser.add_argument('--max-sat-series', dest="max_sat_series", type=int, default=0, metavar="N",
+                        help="export at most N satellites per gpsd, used satellites and then the "
+                             "strongest signals first, 0 exports all [default: %(default)s]")
+    parser.add_argument('--elevation-mask', type=float, dest="elevation_mask", default=DEFAULT_ELEVATION_MASK,
+                        metavar="DEGREES",
+                        help="elevation from which gpsd_constellation_above_mask counts a satellite "
+                             "[default: %(default)s]")
+    
+    parser.add_argument('--offset-from-geopoint', action="store_true", dest="geo_offset",
+                        default=False, help="track offset (x,y offset and distance) from a stationary location.")
+    parser.add_argument('--geopoint-lat', dest="geo_lat",type=float,
+                        default=False, help="Latitude of a fixed stationary location.")
+    parser.add_argument('--geopoint-lon', dest="geo_lon", type=float,
+                        default=False, help="Longitude of a fixed stationary location.")
+    parser.add_argument('--geopoint-alt', dest="geo_alt", type=float,
+                        default=None, help="Height above the WGS84 ellipsoid (altHAE) of the fixed stationary "
+                                           "location, adds the vertical offset.")
+    
+    parser.add_argument('--geo-bucket-size', dest="geo_bucket_size", default=0.5, type=float,
+                        help="Bucket side of Geo histogram [default: %(default)s meter] ")
+    parser.add_argument('--geo-bucket-count', dest="geo_bucket_count", default=40, type=int,
+                        help="Bucket count of Geo histogram [default: %(default)s]")
+
+    parser.add_argument('--quantile-sketch', action="store_true", dest="quantile_sketch", default=False,
+                        help="export the PPS and geo offsets and the latencies as summaries with quantiles from a streaming "
+                             "sketch instead of the fixed bucket histograms")
+    parser.add_argument('--sketch-quantiles', dest="sketch_quantiles", type=parse_quantiles,
+                        default=DEFAULT_SKETCH_QUANTILES,
+                        help="quantiles exported by the summaries [default: %(default)s]")
+    parser.add_argument('--sketch-window', dest="sketch_window", type=float, default=DEFAULT_SKETCH_WINDOW,
+                        help="seconds of observations the quantiles are computed over [default: %(default)s]")
+    parser.add_argument('--sketch-accuracy', dest="sketch_accuracy", type=float, default=DEFAULT_SKETCH_ACCURACY,
+                        help="relative accuracy of the quantiles [default: %(default)s]")
+    parser.add_argument('--accuracy-windows', dest="accuracy_windows", type=parse_seconds, default=None,
+                        metavar="SECONDS[,SECONDS...]",
+                        help="export CEP50, CEP95, 2DRMS, mean position and standard deviations of the "
+                             "fixes over these sliding windows, e.g. 60,900,3600. Offsets are taken from "
+                             "the geo point when given, else from the first fix.")
+
+    ## pps
+    parser.add_argument('--pps-histogram', action="store_true", dest="pps", default=False,
+                        help="generate histogram data from pps devices.")
+    parser.add_argument('--pps-bucket-size', dest="pps_bucket_size", default=250, type=int,
+                        help="Bucket side of PPS histogram [default: %(default)s ns]  (nano seconds)")
+    parser.add_argument('--pps-bucket-count', dest="pps_bucket_count", default=40, type=int,
+                        help="Bucket count of PPS histogram [default: %(default)s]")
+    parser.add_argument('--pps-time1', dest="pps_time1", default=0, type=float,
+                        help="Local pps clock (offset) time1 (ntp.conf) [default: %(default)s]")
+    parser.add_argument('--pps-window', dest="pps_window", default=0, type=float,
+                        help="also export the PPS histogram of the last this many seconds, with the same "
+                             "buckets, as gpsd_pps_window_histogram, 0 disables [default: %(default)s]")
+    parser.add_argument('--pps-window-only', action="store_true", dest="pps_window_only", default=False,
+                        help="export the PPS histogram of --pps-window only, not the one since the start")
+    parser.add_argument('--pps-adev', action="store_true", dest="pps_adev", default=False,
+                        help="export the Allan deviation and time deviation of the pps devices.")
+    parser.add_argument('--adev-taus', dest="adev_taus", type=parse_seconds, default=DEFAULT_ADEV_TAUS,
+                        help="averaging times of the deviations in seconds [default: %(default)s]")
+    parser.add_argument('--adev-window', dest="adev_window", type=int, default=DEFAULT_ADEV_WINDOW,
+                        help="number of terms each deviation is averaged over [default: %(default)s]")
+
+    ## latency
+    parser.add_argument('--latency', action="store_true", dest="latency", default=False,
+                        help="export per device histograms of the time from the start of a fix until the "
+                             "system clock stamps its message (TOFF reports) and until the exporter "
+                             "reads its TPV report.")
+
+    return parser
+
+
 def init_metrics(args):
     
     metrics = {}
     registry = CollectorRegistry()
     
-    """ register the Satellite collector who takes the """
-    registry.register(SatCollector())
-
+    """ every metric carries the gpsd it came from in the source label """
+    labels = ['source']
+
+    """ the exporter's own metrics """
+    metrics['MESSAGES'] = Counter('gpsd_exporter_messages', 'Reports read from gpsd per class.',
+                                  ['source', 'class'], registry=registry)
+    metrics['PROCESS_TIME'] = Histogram('gpsd_exporter_process_seconds', 'Time spent applying a report to the metrics per class.',
+                                        ['source', 'class'], buckets=PROCESS_BUCKETS, registry=registry)
+    metrics['FIX_LAG'] = Histogram('gpsd_exporter_fix_lag_seconds', 'Time from the time of a TPV fix until its gauges are set.',
+                                   labels, buckets=FIX_LAG_BUCKETS, registry=registry)
+    metrics['SAT_STORE_SIZE'] = Gauge('gpsd_exporter_satellites', 'Satellites held in the satellite store.',
+                                      labels, registry=registry)
+    metrics['RECONNECTS'] = Counter('gpsd_exporter_reconnects', 'Connections to gpsd that failed or were lost.',
+                                    labels, registry=registry)
+    metrics['OUTAGE'] = Histogram('gpsd_exporter_outage_seconds', 'Time from losing the connection to gpsd until it is back.',
+                                  labels, buckets=OUTAGE_BUCKETS, registry=registry)
+    metrics['READ_BYTES'] = Counter('gpsd_exporter_read_bytes', 'Bytes read from gpsd.', labels, registry=registry)
+    metrics['STATE'] = Gauge('gpsd_exporter_connection_state', 'Connection to gpsd: 0=disconnected, 1=connecting, 2=connected.',
+                             labels, registry=registry)
+    metrics['WATCHDOG'] = Gauge('gpsd_exporter_watchdog_seconds', 'Seconds gpsd may stay silent before the connection counts as dead.',
+                                labels, registry=registry)
+    metrics['WATCHDOG_TIMEOUTS'] = Counter('gpsd_exporter_watchdog_timeouts', 'Connections dropped because gpsd stayed silent.',
+                                           labels, registry=registry)
+    collect_time = Summary('gpsd_exporter_sat_collect_seconds', 'Time spent collecting the per satellite metrics.',
+                           registry=None)
+    metrics['SAT_EVICTED'] = Counter('gpsd_exporter_sat_evicted', 'Satellites dropped from the store after --sat-ttl.',
+                                     labels, registry=None)
+    metrics['SAT_DROPPED'] = Gauge('gpsd_exporter_sat_dropped', 'Satellites left out of the last scrape by --max-sat-series.',
+                                   labels, registry=None)
+
+    """ register the Satellite collector who reads the satellite stores, one per gpsd """
+    metrics['SAT_STORES'] = {}
+    registry.register(SatCollector(metrics['SAT_STORES'], collect_time, args.sat_used_label,
+                                   args.max_sat_series, metrics['SAT_DROPPED']))
+    """ register the constellation collector who reads the per constellation counts, one per gpsd """
+    metrics['CONSTELLATIONS'] = {}
+    registry.register(ConstellationCollector(metrics['CONSTELLATIONS']))
+    # after the collector they measure, so a scrape includes its own collection
+    registry.register(collect_time)
+    registry.register(metrics['SAT_EVICTED'])
+    registry.register(metrics['SAT_DROPPED'])
+
+    """ report field -> (metric name, help) of the TPV and SKY gauges """
     metrics['SKY'] = {
-        'gdop': Gauge('gpsd_gdop', 'Geometric (hyperspherical) dilution of precision', registry=registry),
-        'hdop': Gauge('gpsd_hdop', 'Horizontal dilution of precision', registry=registry),
-        'pdop': Gauge('gpsd_pdop', 'Position (spherical/3D) dilution of precision', registry=registry),
-        'tdop': Gauge('gpsd_tdop', 'Time dilution of precision', registry=registry),
-        'vdop': Gauge('gpsd_vdop', 'Vertical (altitude) dilution of precision', registry=registry),
-        'ydop': Gauge('gpsd_ydop', 'Longitudinal dilution of precision', registry=registry),
-        'xdop': Gauge('gpsd_xdop', 'Latitudinal dilution of precision', registry=registry),
-        'nSat': Gauge('gpsd_nSat', 'Number of satellite objects in "satellites" array', registry=registry),
-        'uSat': Gauge('gpsd_uSat', 'Number of satellites used in navigation solution.', registry=registry),
+        'gdop': ('gpsd_gdop', 'Geometric (hyperspherical) dilution of precision'),
+        'hdop': ('gpsd_hdop', 'Horizontal dilution of precision'),
+        'pdop': ('gpsd_pdop', 'Position (spherical/3D) dilution of precision'),
+        'tdop': ('gpsd_tdop', 'Time dilution of precision'),
+        'vdop': ('gpsd_vdop', 'Vertical (altitude) dilution of precision'),
+        'ydop': ('gpsd_ydop', 'Longitudinal dilution of precision'),
+        'xdop': ('gpsd_xdop', 'Latitudinal dilution of precision'),
+        'nSat': ('gpsd_nSat', 'Number of satellite objects in "satellites" array'),
+        'uSat': ('gpsd_uSat', 'Number of satellites used in navigation solution.'),
     }
 
     metrics['TPV'] = {
-            'lat': Gauge('gpsd_lat', 'Latitude in degrees: +/- signifies North/South.', registry=registry),
-            'lon': Gauge('gpsd_long', 'Longitude in degrees: +/- signifies East/West.', registry=registry),
-            'altHAE': Gauge('gpsd_altHAE', 'Altitude, height above allipsoid, in meters. Probably WGS84.', 
-                            registry=registry),
-            'altMSL': Gauge('gpsd_altMSL', 'MSL Altitude in meters. The geoid used is rarely specified and is often inaccurate.' , registry=registry),
-            'mode': Gauge('gpsd_mode', 'NMEA mode: %d, 0=no mode value yet seen, 1=no fix, 2=2D, 3=3D.' , 
-                          registry=registry),
-            'status': Gauge('gpsd_status', 'GPS fix status: %d, 2=DGPS fix, 3=RTK Fixed point, 4=RTK Floating point, 5=DR fix, 6=GNSSDR' + 
-                             'fix, 7=Time (surveyed) fix, 8=Simulated, 9=P(Y) fix, otherwise not present. ' , 
-                             registry=registry),
-            'leapseconds': Gauge('gpsd_leapseconds', 'Current leap seconds.' , registry=registry),
-            'magvar': Gauge('gpsd_magvar', 'Magnetic variation, degrees.' , registry=registry),
-            'ept': Gauge('gpsd_ept', 'Estimated timestamp error in seconds.' , registry=registry),
-            'epx': Gauge('gpsd_epx', 'Longitude error estimate in meters.' , registry=registry),
-            'epy': Gauge('gpsd_epy', 'Latitude error estimate in meters.' , registry=registry),
-            'epv': Gauge('gpsd_epv', 'Estimated vertical error in meters.' , registry=registry),
-            'eps': Gauge('gpsd_eps', 'Estimated speed error in meters per second.' , registry=registry),
-            'epc': Gauge('gpsd_epc', 'Estimated climb error in meters per second.' , registry=registry),
-            'geoidSep': Gauge('gpsd_geoidSep', 'Geoid separation is the difference between the WGS84 reference ellipsoid and the geoid (Mean Sea Level) in meters. ' , 
-                              registry=registry),
-            'eph': Gauge('gpsd_eph', 'Estimated horizontal Position (2D) Error in meters. Also known as Estimated Position Error (epe).' , 
-                         registry=registry),
-            'sep': Gauge('gpsd_sep', 'Estimated Spherical (3D) Position Error in meters.' , registry=registry),
-            'ecefx': Gauge('gpsd_ecefx', 'ECEF X position in meters.' , registry=registry),
-            'ecefy': Gauge('gpsd_ecefy', 'ECEF Y position in meters.' , registry=registry),
-            'ecefz': Gauge('gpsd_ecefz', 'ECEF Z position in meters.' , registry=registry),
-            'ecefvx': Gauge('gpsd_ecefvx', 'ECEF X velocity in meters per second.' , registry=registry),
-            'ecefvy': Gauge('gpsd_ecefvy', 'ECEF Y velocity in meters per second.' , registry=registry),
-            'ecefvz': Gauge('gpsd_ecefvz', 'ECEF Z velocity in meters per second.' , registry=registry),
-            'ecefpAcc': Gauge('gpsd_ecefpAcc', 'ECEF position error in meters. Certainty unknown.' , 
-                              registry=registry),
-            'velN': Gauge('gpsd_velN', 'North velocity component in meters.' , registry=registry),
-            'velE': Gauge('gpsd_velE', 'East velocity component in meters.' , registry=registry),
-            'velD': Gauge('gpsd_velD', 'Down velocity component in meters.' , registry=registry),
+            'lat': ('gpsd_lat', 'Latitude in degrees: +/- signifies North/South.'),
+            'lon': ('gpsd_long', 'Longitude in degrees: +/- signifies East/West.'),
+            'altHAE': ('gpsd_altHAE', 'Altitude, height above allipsoid, in meters. Probably WGS84.'),
+            'altMSL': ('gpsd_altMSL', 'MSL Altitude in meters. The geoid used is rarely specified and is often inaccurate.' ),
+            'mode': ('gpsd_mode', 'NMEA mode: %d, 0=no mode value yet seen, 1=no fix, 2=2D, 3=3D.' ),
+            'status': ('gpsd_status', 'GPS fix status: %d, 2=DGPS fix, 3=RTK Fixed point, 4=RTK Floating point, 5=DR fix, 6=GNSSDR' + 
+                             'fix, 7=Time (surveyed) fix, 8=Simulated, 9=P(Y) fix, otherwise not present. ' ),
+            'leapseconds': ('gpsd_leapseconds', 'Current leap seconds.' ),
+            'magvar': ('gpsd_magvar', 'Magnetic variation, degrees.' ),
+            'ept': ('gpsd_ept', 'Estimated timestamp error in seconds.' ),
+            'epx': ('gpsd_epx', 'Longitude error estimate in meters.' ),
+            'epy': ('gpsd_epy', 'Latitude error estimate in meters.' ),
+            'epv': ('gpsd_epv', 'Estimated vertical error in meters.' ),
+            'eps': ('gpsd_eps', 'Estimated speed error in meters per second.' ),
+            'epc': ('gpsd_epc', 'Estimated climb error in meters per second.' ),
+            'geoidSep': ('gpsd_geoidSep', 'Geoid separation is the difference between the WGS84 reference ellipsoid and the geoid (Mean Sea Level) in meters. ' ),
+            'eph': ('gpsd_eph', 'Estimated horizontal Position (2D) Error in meters. Also known as Estimated Position Error (epe).' ),
+            'sep': ('gpsd_sep', 'Estimated Spherical (3D) Position Error in meters.' ),
+            'ecefx': ('gpsd_ecefx', 'ECEF X position in meters.' ),
+            'ecefy': ('gpsd_ecefy', 'ECEF Y position in meters.' ),
+            'ecefz': ('gpsd_ecefz', 'ECEF Z position in meters.' ),
+            'ecefvx': ('gpsd_ecefvx', 'ECEF X velocity in meters per second.' ),
+            'ecefvy': ('gpsd_ecefvy', 'ECEF Y velocity in meters per second.' ),
+            'ecefvz': ('gpsd_ecefvz', 'ECEF Z velocity in meters per second.' ),
+            'ecefpAcc': ('gpsd_ecefpAcc', 'ECEF position error in meters. Certainty unknown.' ),
+            'velN': ('gpsd_velN', 'North velocity component in meters.' ),
+            'velE': ('gpsd_velE', 'East velocity component in meters.' ),
+            'velD': ('gpsd_velD', 'Down velocity component in meters.' ),
             }
 
-    metrics['USED'] = Gauge('gpsd_sat_used', 'Used in current solution? ', registry=registry)
-    metrics['SEEN'] = Gauge('gpsd_sat_seen', 'Seen in current solution? ', registry=registry)
-    metrics['VERSION'] = Info('gpsd_version', 'Version Details', registry=registry)
-    metrics['DEVICES'] = Info('gpsd_devices', 'Device Details', ['device'], registry=registry)
+    metrics['SAT_COUNTS'] = {
+        'USED': ('gpsd_sat_used', 'Used in current solution? '),
+        'SEEN': ('gpsd_sat_seen', 'Seen in current solution? '),
+    }
+
+    """ register the field collector who reads the field snapshots, one per gpsd """
+    metrics['FIELD_SNAPSHOTS'] = {}
+    registry.register(FieldCollector(metrics['FIELD_SNAPSHOTS'], dict(list(metrics['SKY'].values()) +
+                                                             list(metrics['TPV'].values()) +
+                                                             list(metrics['SAT_COUNTS'].values()))))
+    metrics['VERSION'] = Info('gpsd_version', 'Version Details', labels, registry=registry)
+    metrics['DEVICES'] = Info('gpsd_devices', 'Device Details', ['source', 'device'], registry=registry)
     metrics['SAT_STATUS'] = {}
     
-    if args.pps:
+    if args.pps and args.pps_window and args.pps_window_only:
+        # only the windowed histogram below
+        pass
+    elif args.pps and args.quantile_sketch:
+        metrics['PPS_HIS'] = QuantileSummary('gpsd_pps_summary', 'PPS offset quantiles (nano seconds)',
+                                             ['source', 'device'], args, registry=registry)
+    elif args.pps:
         PPS_BUCKETS = [float("-inf")]
         PPS_BUCKETS.extend(i * args.pps_bucket_size for i in range(int(args.pps_bucket_count / -2), int(args.pps_bucket_count / 2) + 1))
         PPS_BUCKETS.append(float("inf"))
-        metrics['PPS_HIS'] = Histogram('gpsd_pps_histogram', 'PPS Histogram', ['device'], buckets=PPS_BUCKETS, registry=registry)
+        metrics['PPS_HIS'] = Histogram('gpsd_pps_histogram', 'PPS Histogram', ['source', 'device'], buckets=PPS_BUCKETS, registry=registry)
+
+    if args.pps and args.pps_window:
+        lowest = int(args.pps_bucket_count / -2)
+        metrics['PPS_WINDOW'] = WindowedHistogram('gpsd_pps_window_histogram',
+                                                  f'PPS Histogram of the last {args.pps_window:g} seconds',
+                                                  ['source', 'device'], lowest * args.pps_bucket_size,
+                                                  args.pps_bucket_size, int(args.pps_bucket_count / 2) - lowest + 1,
+                                                  args.pps_window, registry=registry)
         
-    if args.geo_offset:
+    if args.latency and args.quantile_sketch:
+        metrics['TOFF_LATENCY'] = QuantileSummary('gpsd_toff_latency_summary', 'Fix to system clock stamp quantiles (seconds)',
+                                                  ['source', 'device'], args, registry=registry)
+        metrics['TPV_LATENCY'] = QuantileSummary('gpsd_tpv_latency_summary', 'Fix to TPV arrival quantiles (seconds)',
+                                                 ['source', 'device'], args, registry=registry)
+    elif args.latency:
+        metrics['TOFF_LATENCY'] = Histogram('gpsd_toff_latency_histogram', 'Fix to system clock stamp Histogram (seconds)',
+                                            ['source', 'device'], buckets=LATENCY_BUCKETS, registry=registry)
+        metrics['TPV_LATENCY'] = Histogram('gpsd_tpv_latency_histogram', 'Fix to TPV arrival Histogram (seconds)',
+                                           ['source', 'device'], buckets=LATENCY_BUCKETS, registry=registry)
+
+    if args.accuracy_windows:
+        """ register the accuracy collector who reads the position statistics, one per gpsd """
+        metrics['ACCURACY'] = {}
+        registry.register(AccuracyCollector(metrics['ACCURACY']))
+
+    if args.pps_adev:
+        """ register the Allan deviation collector who reads the trackers, one per pps device """
+        metrics['ADEV'] = {}
+        registry.register(AdevCollector(metrics['ADEV']))
+
+    if args.geo_offset and args.quantile_sketch:
+        """ same names as the histograms below, the Y offset goes out as bearing_x """
+        metrics['GEO_OFFSET'] = QuantileSummary('gpsd_geo_offset_m_summary', 'Geo offset quantiles (meters)',
+                                                labels, args, registry=registry)
+        metrics['GEO_OFFSET_Y'] = QuantileSummary('gpsd_geo_bearing_x_summary',
+                                                  'Y offset in meters from static geo point',
+                                                  labels, args, registry=registry)
+        metrics['GEO_OFFSET_X'] = QuantileSummary('gpsd_geo_bearing_y_summary',
+                                                  'X offset in meters from static geo point',
+                                                  labels, args, registry=registry)
+        if args.geo_alt is not None:
+            metrics['GEO_OFFSET_UP'] = QuantileSummary('gpsd_geo_vertical_summary',
+                                                       'Vertical offset in meters from static geo point, up is positive',
+                                                       labels, args, registry=registry)
+            metrics['GEO_OFFSET_3D'] = QuantileSummary('gpsd_geo_offset_3d_m_summary',
+                                                       'Geo offset quantiles including the height (meters)',
+                                                       labels, args, registry=registry)
+    elif args.geo_offset:
         GEO_BUCKETS_OFFSET = list(i * args.geo_bucket_size for i in range(1, args.geo_bucket_count))
         GEO_BUCKETS_OFFSET.append(float("inf"))
 
@@ -342,32 +817,172 @@ def init_metrics(args):
         GEO_BUCKETS_YX.append(float("inf"))
         
         metrics['GEO_OFFSET'] = Histogram('gpsd_geo_offset_m_histogram', 'Geo offset Histogram (meters)', 
-                                          buckets=GEO_BUCKETS_OFFSET, registry=registry)
+                                          labels, buckets=GEO_BUCKETS_OFFSET, registry=registry)
         metrics['GEO_OFFSET_Y'] = Histogram('gpsd_geo_bearing_x_histogram', 
                                             'Y offset in meters from static geo point', 
-                                            buckets=GEO_BUCKETS_YX, registry=registry)
+                                            labels, buckets=GEO_BUCKETS_YX, registry=registry)
         metrics['GEO_OFFSET_X'] = Histogram('gpsd_geo_bearing_y_histogram', 
                                             'X offset in meters from static geo point', 
-                                            buckets=GEO_BUCKETS_YX, registry=registry)
+                                            labels, buckets=GEO_BUCKETS_YX, registry=registry)
+        if args.geo_alt is not None:
+            metrics['GEO_OFFSET_UP'] = Histogram('gpsd_geo_vertical_histogram',
+                                                 'Vertical offset in meters from static geo point, up is positive',
+                                                 labels, buckets=GEO_BUCKETS_YX, registry=registry)
+            metrics['GEO_OFFSET_3D'] = Histogram('gpsd_geo_offset_3d_m_histogram',
+                                                 'Geo offset Histogram including the height (meters)',
+                                                 labels, buckets=GEO_BUCKETS_OFFSET, registry=registry)
 
+    if args.geo_offset:
+        metrics['GEO_PROJECTOR'] = GeoProjector(args.geo_lat, args.geo_lon, args.geo_alt)
+
+
+    if args.aggregate_fields:
+        """ register the aggregate collector who reads the field aggregators, one per gpsd """
+        names = {}
+        for key, (name, _) in list(metrics['SKY'].items()) + list(metrics['TPV'].items()):
+            names[key] = name
+        metrics['AGGREGATES'] = {}
+        registry.register(AggregateCollector(metrics['AGGREGATES'], args.aggregate_fields,
+                                             [names.get(field, 'gpsd_' + field) for field in args.aggregate_fields]))
+
+    if args.history:
+        metrics['HISTORY'] = HistoryRing(args.history, args.history_size)
+
+    if args.skymap:
+        # source -> SkyMap, created by bind_source() from the saved maps
+        metrics['SKYMAPS'] = {}
+        metrics['SKYMAP_FILE'] = SkyMapFile(args.skymap)
+        metrics['SKYMAPS_SAVED'] = metrics['SKYMAP_FILE'].load(args.skymap_step)
+        metrics['SKYMAP_STEP'] = args.skymap_step
+
+    if args.stream:
+        dropped = Counter('gpsd_exporter_stream_dropped', '/stream clients disconnected for falling behind or not reading.',
+                          registry=registry)
+        metrics['STREAM'] = StreamHub(args.stream_queue, args.stream_clients, dropped.inc)
+        Gauge('gpsd_exporter_stream_clients', 'Clients connected to /stream.',
+              registry=registry).set_function(lambda: len(metrics['STREAM'].subscribers))
+
+    if args.push_url:
+        metrics['PUSHES'] = Counter('gpsd_exporter_push_batches', 'Batches pushed to --push-url.', registry=registry)
+        metrics['PUSH_FAILURES'] = Counter('gpsd_exporter_push_failures', 'Pushes to --push-url that failed and are retried.',
+                                           registry=registry)
+        metrics['PUSH_DROPPED'] = Counter('gpsd_exporter_push_dropped',
+                                          'Batches dropped by --push-spool-size or rejected by --push-url.', registry=registry)
+        metrics['PUSH_SPOOL_BYTES'] = Gauge('gpsd_exporter_push_spool_bytes', 'Bytes of batches waiting to be pushed.',
+                                            registry=registry)
 
     metrics['registry'] = registry
+    metrics['RECORDER'] = SessionRecorder(args.record) if args.record else None
+    metrics['CACHE'] = MetricsCache(registry, args.metrics_max_age)
+    metrics['HANDLERS'] = init_handlers(args)
 
     return metrics
 
 
-def getPositionData(gpsd, metrics, args):
+def bind_source(metrics, source, host, port, args):
+    """
+    Return the metrics of one gpsd: the same layout as init_metrics(), with the
+    labeled metrics bound to the source label of that gpsd.
+    """
+    bound = {
+        'source': source,
+        'host': host,
+        'port': port,
+        'FIELDS': FieldSnapshot(name for name, _ in list(metrics['SKY'].values()) +
+                                list(metrics['TPV'].values()) + list(metrics['SAT_COUNTS'].values())),
+        'VERSION': metrics['VERSION'].labels(source),
+        'DEVICES': metrics['DEVICES'],
+        'CACHE': metrics['CACHE'],
+        'HANDLERS': metrics['HANDLERS'],
+        'RECORD': metrics['RECORDER'].writer(source) if metrics['RECORDER'] else None,
+        'SAT_STORE': SatelliteStore(args.sat_ttl, metrics['SAT_EVICTED'].labels(source).inc),
+        'CONSTELLATIONS': ConstellationStats(args.elevation_mask),
+        'MESSAGES': metrics['MESSAGES'],
+        'PROCESS_TIME': metrics['PROCESS_TIME'],
+        # report class -> (count, observe processing time), filled in by process_report()
+        'REPORT_STATS': {},
+        # classes decoded and handed to process_report(), the others only counted by skip_report()
+        'WANTED': frozenset(cls.encode() for cls in metrics['HANDLERS']),
+        'SKIPPED': {},
+        'FIX_LAG': metrics['FIX_LAG'].labels(source),
+        'RECONNECTS': metrics['RECONNECTS'].labels(source),
+        'OUTAGE': metrics['OUTAGE'].labels(source),
+        'READ_BYTES': metrics['READ_BYTES'].labels(source),
+        'DISCONNECTED_AT': None,
+        'STATE': metrics['STATE'].labels(source),
+        'LIVENESS': Liveness(args.watchdog_factor, args.timeout),
+        'WATCHDOG_TIMEOUTS': metrics['WATCHDOG_TIMEOUTS'].labels(source),
+        'WITHDRAW': args.withdraw,
+    }
+    metrics['SAT_STORES'][source] = bound['SAT_STORE']
+    metrics['CONSTELLATIONS'][source] = bound['CONSTELLATIONS']
+    metrics['FIELD_SNAPSHOTS'][source] = bound['FIELDS']
+    metrics['SAT_STORE_SIZE'].labels(source).set_function(bound['SAT_STORE'].__len__)
+    metrics['WATCHDOG'].labels(source).set_function(lambda: bound['LIVENESS'].deadline)
+
+    # report field -> setter of that field in the next field snapshot
+    bound['SKY_SETTERS'] = {key: bound['FIELDS'].setter(name) for key, (name, _) in metrics['SKY'].items()}
+    bound['TPV_SETTERS'] = {key: bound['FIELDS'].setter(name) for key, (name, _) in metrics['TPV'].items()}
+    for key, (name, _) in metrics['SAT_COUNTS'].items():
+        bound[key] = bound['FIELDS'].setter(name)
+
+    if 'PPS_HIS' in metrics:
+        bound['PPS_HIS'] = metrics['PPS_HIS']
+
+    if 'PPS_WINDOW' in metrics:
+        bound['PPS_WINDOW'] = metrics['PPS_WINDOW']
+
+    if 'ADEV' in metrics:
+        bound['ADEV'] = metrics['ADEV']
+
+    for key in ('TOFF_LATENCY', 'TPV_LATENCY'):
+        if key in metrics:
+            bound[key] = metrics[key]
+
+    for key in ('GEO_OFFSET', 'GEO_OFFSET_X', 'GEO_OFFSET_Y', 'GEO_OFFSET_UP', 'GEO_OFFSET_3D'):
+        if key in metrics:
+            bound[key] = metrics[key].labels(source)
+
+    if 'GEO_PROJECTOR' in metrics:
+        bound['GEO_PROJECTOR'] = metrics['GEO_PROJECTOR']
+
+    if 'AGGREGATES' in metrics:
+        aggregator = metrics['AGGREGATES'][source] = FieldAggregator(len(args.aggregate_fields), args.aggregate_window)
+        for i, field in enumerate(args.aggregate_fields):
+            setters = bound['SKY_SETTERS'] if field in bound['SKY_SETTERS'] else bound['TPV_SETTERS']
+            setters[field] = aggregating(setters.get(field), aggregator, i)
+
+    if 'HISTORY' in metrics:
+        bound['HISTORY'] = metrics['HISTORY'].writer(source)
+
+    if 'STREAM' in metrics:
+        bound['STREAM'] = metrics['STREAM'].publish
+
+    if 'SKYMAPS' in metrics:
+        bound['SKYMAP'] = metrics['SKYMAPS'][source] = SkyMap(args.skymap_step, metrics['SKYMAPS_SAVED'].get(source))
+
+    if 'ACCURACY' in metrics:
+        bound['ACCURACY'] = metrics['ACCURACY'][source] = PositionAccuracy(args.accuracy_windows)
+
+    return bound
+
+
+def getPositionData(gpsd, read_line, metrics, args):
+    """ Read one report with read_line(gpsd), the line reader of the gps package. gps.next()
+    would decode every report and wrap it in dictwrappers, the handlers take the decoded
+    dict and most classes are not handled at all. """
     try:
         # Check if gpsd object is still valid
-        if not gpsd or not hasattr(gpsd, 'next'):
+        if not gpsd or not hasattr(gpsd, 'sock'):
             log.error("GPSD connection object is invalid")
             raise ConnectionError("GPSD connection object is invalid")
-            
-        nx = gpsd.next()
-    except KeyError as e:
-        # Handle missing satellite data fields (like 'az', 'el', etc.)
-        log.warning(f"GPSD reported incomplete satellite data: {e}")
-        return
+
+        status = read_line(gpsd)
+        if status < 0:
+            raise ConnectionError('gpsd closed the connection')
+        if status == 0:
+            # only part of a report arrived
+            return
     except (ConnectionError, OSError, socket.error, BrokenPipeError, ConnectionResetError) as e:
         # Handle connection errors - re-raise to trigger retry
         log.error(f"Connection error reading from GPSD: {type(e).__name__}: {e}")
@@ -379,113 +994,336 @@ def getPositionData(gpsd, metrics, args):
         # This is more aggressive but prevents the endless loop
         log.error(f"Re-raising unexpected error as connection error: {type(e).__name__}: {e}")
         raise ConnectionError(f"GPSD read error: {type(e).__name__}: {e}")
-    
+
+    line = gpsd.bresponse
+    metrics['READ_BYTES'].inc(len(line))
+    if metrics['RECORD']:
+        metrics['RECORD'](line.rstrip())
+
+    if skip_report(line, metrics):
+        return
+
+    try:
+        nx = json.loads(line)
+    except ValueError as e:
+        log.warning(f'Skipping malformed gpsd report: {e}')
+        return
+
+    try:
+        process_report(nx, metrics, args)
+    except KeyError as e:
+        # Handle missing satellite data fields (like 'az', 'el', etc.)
+        log.warning(f"GPSD reported incomplete satellite data: {e}")
+
+
+def process_report(nx, metrics, args):
+    """ Apply a decoded gpsd report to the metrics of its gpsd. """
+
     # For a list of all supported classes and fields refer to:
     # https://gpsd.gitlab.io/gpsd/gpsd_json.html
-    
+
+    cls = nx['class']
     if args.debug > 1:
-        log.debug(f'received {nx["class"]}: {nx}') 
+        log.debug('received %s: %s', cls, nx)
+
+    stats = metrics['REPORT_STATS'].get(cls)
+    if stats is None:
+        stats = metrics['REPORT_STATS'][cls] = report_stats(metrics, cls)
+    stats[0]()
+
+    handlers = metrics['HANDLERS'].get(cls)
+    if handlers is None:
+        return
+
+    started = time.perf_counter()
+    for handler in handlers:
+        handler(nx, metrics, args)
+
+    metrics['CACHE'].invalidate()
+    stats[1](time.perf_counter() - started)
+
+
+def skip_report(line, metrics):
+    """ True for a raw report of a class no handler needs, which is only counted. The class
+    is read from the bytes gpsd starts every report with, so the report is never decoded. """
+    if not line.startswith(CLASS_PREFIX):
+        return False
+    # the asyncio client passes bytearrays, which do not hash
+    cls = bytes(line[len(CLASS_PREFIX):line.find(b'"', len(CLASS_PREFIX))])
+    if cls in metrics['WANTED']:
+        return False
+
+    count = metrics['SKIPPED'].get(cls)
+    if count is None:
+        count = metrics['SKIPPED'][cls] = report_stats(metrics, cls.decode('ascii', 'replace'))[0]
+    count()
+    return True
+
+
+def watch_command(handlers):
+    """ The ?WATCH for the reports the handlers need. gpsd cannot leave out single classes,
+    only the PPS and TOFF reports of the pps flag. """
+    watch = dict(WATCH, pps=True) if any(cls in handlers for cls in PPS_CLASSES) else WATCH
+    return b'?WATCH=' + json.dumps(watch, separators=(',', ':')).encode() + b'\n'
+
+
+def report_stats(metrics, cls):
+    """ The message counter and, for classes with handlers, the processing time histogram of a class. """
+    count = metrics['MESSAGES'].labels(metrics['source'], cls).inc
+    if cls not in metrics['HANDLERS']:
+        return count, None
+    return count, metrics['PROCESS_TIME'].labels(metrics['source'], cls).observe
+
+
+def init_handlers(args):
+    """ The handlers per report class, only for the reports the chosen options need. """
+    handlers = {
+        'VERSION': [handle_version],
+        'DEVICES': [handle_devices],
+        'SKY': [handle_sky],
+        'TPV': [handle_tpv, handle_fix_lag, handle_liveness],
+    }
+
+    if args.pps and not (args.pps_window and args.pps_window_only):
+        handlers['PPS'] = [handle_pps]
+
+    if args.pps and args.pps_window:
+        handlers.setdefault('PPS', []).append(handle_pps_window)
+
+    if args.pps_adev:
+        handlers.setdefault('PPS', []).append(handle_pps_adev)
+
+    if args.geo_offset:
+        handlers['TPV'].append(handle_geo_offset)
+
+    if args.latency:
+        # the TPV latency is observed by handle_fix_lag()
+        handlers['TOFF'] = [handle_toff_latency]
+
+    if args.accuracy_windows:
+        handlers['TPV'].append(handle_accuracy)
+
+    if args.skymap:
+        handlers['SKY'].append(handle_skymap)
+
+    if args.stream:
+        handlers['TPV'].append(handle_stream)
+        handlers['SKY'].append(handle_stream)
+
+    if args.history:
+        handlers['TPV'].append(handle_history_tpv)
+        handlers['SKY'].append(handle_history_sky)
+        handlers.setdefault('PPS', []).append(handle_history_pps)
+
+    return handlers
+
+
+def handle_version(nx, metrics, args):
+    metrics['VERSION'].info({'release': nx['release'],
+                 'rev': nx['rev'],
+                 'proto_major': str(nx['proto_major']),
+                 'proto_minor': str(nx['proto_minor']),
+    })
+
+
+def pps_offset(nx, args):
+    """ The PPS offset in nano seconds, corrected for time1 and wrapped at +/- 0.5 s. """
+    corr = args.pps_time1 * NSEC
+    value = nx['clock_nsec'] - corr
     
-    if nx['class'] == 'VERSION':
+    if value > (NSEC / 2):
+        value = value - NSEC 
         
-        metrics['VERSION'].info({'release': nx['release'],
-                     'rev': nx['rev'],
-                     'proto_major': str(nx['proto_major']),
-                     'proto_minor': str(nx['proto_minor']),
+    log.debug('PPS offset %s -> %s', nx['clock_nsec'], value)
+    return value
+
+
+def handle_pps(nx, metrics, args):
+    metrics['PPS_HIS'].labels(metrics['source'], nx['device']).observe(pps_offset(nx, args))
+
+
+def handle_pps_window(nx, metrics, args):
+    metrics['PPS_WINDOW'].labels(metrics['source'], nx['device']).observe(pps_offset(nx, args))
+
+
+def handle_pps_adev(nx, metrics, args):
+    key = (metrics['source'], nx['device'])
+    tracker = metrics['ADEV'].get(key)
+    if tracker is None:
+        tracker = metrics['ADEV'][key] = AllanDeviation(args.adev_taus, args.adev_window)
+
+    real_sec = nx['real_sec']
+    if tracker.last_sec is not None and real_sec != tracker.last_sec + 1:
+        if real_sec == tracker.last_sec:
+            return
+        log.info(f'PPS of {nx["device"]} skipped from {tracker.last_sec} to {real_sec}, restarting the Allan deviation')
+        tracker.reset()
+    tracker.last_sec = real_sec
+
+    tracker.update(pps_offset(nx, args) / NSEC)
+
+
+def handle_toff_latency(nx, metrics, args):
+    """ clock is the system time the receiver's fix message arrived at, real the time of the fix. """
+    latency = (nx['clock_sec'] - nx['real_sec']) + (nx['clock_nsec'] - nx['real_nsec']) / NSEC
+    metrics['TOFF_LATENCY'].labels(metrics['source'], nx.get('device', '')).observe(latency)
+
+
+def handle_devices(nx, metrics, args):
+    for device in nx['devices']:
+        log.debug(device)
+    
+        metrics['DEVICES'].labels(metrics['source'], device['path']).info(
+            {       
+                'driver': device['driver'] if 'driver' in device else "Unknown",
+                'subtype': device['subtype'] if 'subtype' in device else "Unknown",
+                'subtype1': device['subtype1'] if 'subtype1' in device else "Unknown",
+                'activated': device['activated'] if 'activated' in device else "Unknown",
+                'flags': str(device['flags']) if 'flags' in device else "Unknown",
+                'native': str(device['native']) if 'native' in device else "Unknown",
+                'bps': str(device['bps']) if 'bps' in device else "Unknown",
+                'parity': str(device['parity']) if 'parity' in device else "Unknown",
+                'stopbits': str(device['stopbits']) if 'stopbits' in device else "Unknown",
+                'cycle': str(device['cycle']) if 'cycle' in device else "Unknown",
+                'mincycle': str(device['mincycle']) if 'mincycle' in device else "Unknown",
         })
-    elif nx['class'] == 'PPS':
-#         PPSSUMMARY.observe(nx['clock_nsec'])
 
-        if args.pps:
-            corr = args.pps_time1 * NSEC
-            value = nx['clock_nsec'] - corr
-            
-            if value > (NSEC / 2):
-                value = value - NSEC 
-                
-            log.debug(f"PPS offset {nx['clock_nsec']} -> {value}")
-            log.debug(nx)
-            
-            metrics['PPS_HIS'].labels(nx['device']).observe(value)
 
-    elif nx['class'] == 'DEVICES':
-        for device in nx['devices']:
-            log.debug(device)
-        
-            metrics['DEVICES'].labels(device['path']).info(
-                {       
-                    'driver': device['driver'] if 'driver' in device else "Unknown",
-                    'subtype': device['subtype'] if 'subtype' in device else "Unknown",
-                    'subtype1': device['subtype1'] if 'subtype1' in device else "Unknown",
-                    'activated': device['activated'] if 'activated' in device else "Unknown",
-                    'flags': str(device['flags']) if 'flags' in device else "Unknown",
-                    'native': str(device['native']) if 'native' in device else "Unknown",
-                    'bps': str(device['bps']) if 'bps' in device else "Unknown",
-                    'parity': str(device['parity']) if 'parity' in device else "Unknown",
-                    'stopbits': str(device['stopbits']) if 'stopbits' in device else "Unknown",
-                    'cycle': str(device['cycle']) if 'cycle' in device else "Unknown",
-                    'mincycle': str(device['mincycle']) if 'mincycle' in device else "Unknown",
-            })
+def handle_sky(nx, metrics, args):
     
-    elif nx['class'] == 'SKY':
-        
-        """process the list of satellites """
-        satellites = nx.get('satellites')
-        if satellites is None:
-            log.debug('no satellites in SKY')
-            log.debug(nx)
-            return
+    """process the list of satellites """
+    satellites = nx.get('satellites')
+    if satellites is None:
+        log.debug('no satellites in SKY: %s', nx)
+        return
 
-        metrics['SEEN'].set(0)
-        metrics['USED'].set(0)
-            
-        for sat in satellites:
-            metrics['SEEN'].inc()
-            if sat['used']:
-                metrics['USED'].inc()
-            
-        if args.mon_satellites:
-            add_sat_stats(satellites)        
-
-        """process the dop metrics """
-        for key in metrics['SKY'].keys():
-            if hasattr(nx, key):
-                value = getattr(nx, key, -1)
-                metrics['SKY'][key].set(getattr(nx, key, -1))
-                if args.debug > 2:
-                    log.debug(f'set {key} to {value}') 
-
-
-    elif nx['class'] == 'TPV':
-        for key in metrics['TPV'].keys():
-            if hasattr(nx, key):
-                value = getattr(nx, key, -1)
-                metrics['TPV'][key].set(value)
-                if args.debug > 2:
-                    log.debug(f'set {key} to {value}')
+    # one pass over the satellites for the per constellation counts and the used total
+    used = metrics['CONSTELLATIONS'].update(satellites)
+
+    metrics['SEEN'](len(satellites))
+    metrics['USED'](used)
         
-        if args.geo_offset:
-            if hasattr(nx, 'lat') and hasattr(nx, 'lon'):
-                offset = MeterOffsetSmall((args.geo_lat, args.geo_lon), (nx['lat'], nx['lon']))
-                distance  = gps.misc.EarthDistanceSmall((nx['lat'], nx['lon']), (args.geo_lat, args.geo_lon))
-                
-                log.debug(f'distance {distance:0.2f}m offset x = {offset[0]:0.2f}m y = {offset[1]:0.2f}m')
-                
-                metrics['GEO_OFFSET_X'].observe(offset[0])
-                metrics['GEO_OFFSET_Y'].observe(offset[1])
-                metrics['GEO_OFFSET'].observe(distance)
+    if args.mon_satellites:
+        metrics['SAT_STORE'].update(satellites)
+
+    """process the dop metrics, only the fields this report carries """
+    set_fields(nx, metrics['SKY_SETTERS'], args)
+    metrics['FIELDS'].publish()
+
+
+def handle_tpv(nx, metrics, args):
+    set_fields(nx, metrics['TPV_SETTERS'], args)
+    metrics['FIELDS'].publish()
+
+
+def handle_liveness(nx, metrics, args):
+    metrics['LIVENESS'].tick(time.monotonic())
+
+
+def handle_fix_lag(nx, metrics, args):
+    """ One measurement of the fix time to now for the fix lag and, with --latency, the TPV latency. """
+    if 'time' in nx:
+        lag = time.time() - parse_gpsd_time(nx['time'])
+        metrics['FIX_LAG'].observe(lag)
+        if 'TPV_LATENCY' in metrics:
+            metrics['TPV_LATENCY'].labels(metrics['source'], nx.get('device', '')).observe(lag)
+
+
+def parse_gpsd_time(value):
+    """ Seconds since the epoch of a gpsd time stamp, like 2021-01-10T12:00:00.000Z. """
+    seconds = calendar.timegm((int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                               int(value[11:13]), int(value[14:16]), int(value[17:19])))
+    return seconds + float(value[19:-1]) if len(value) > 20 else seconds
+
+
+def set_fields(nx, setters, args):
+    for key in nx:
+        setter = setters.get(key)
+        if setter is not None:
+            setter(nx[key])
+
+    if args.debug > 2:
+        log.debug('set %s', [key for key in nx if key in setters])
+
+
+def handle_geo_offset(nx, metrics, args):
+    offset = metrics['GEO_PROJECTOR'].offset(nx)
+    if offset is None:
+        return
+
+    east, north, up = offset
+    distance = math.hypot(east, north)
+
+    log.debug('distance %0.2fm offset east = %0.2fm north = %0.2fm up = %s', distance, east, north, up)
+
+    """ x and y keep the sign of MeterOffsetSmall(): geo point minus fix """
+    metrics['GEO_OFFSET_X'].observe(-east)
+    metrics['GEO_OFFSET_Y'].observe(-north)
+    metrics['GEO_OFFSET'].observe(distance)
+    if up is not None and 'GEO_OFFSET_UP' in metrics:
+        metrics['GEO_OFFSET_UP'].observe(up)
+        metrics['GEO_OFFSET_3D'].observe(math.sqrt(distance * distance + up * up))
+
+
+def aggregating(setter, aggregator, i):
+    """ Wrap the setter of a field to also add its values to field i of the aggregator. """
+    add = aggregator.add
+    if setter is None:
+        return lambda value: add(i, value)
+
+    def set_and_add(value):
+        setter(value)
+        add(i, value)
+
+    return set_and_add
+
+
+def handle_accuracy(nx, metrics, args):
+    if nx.get('mode', 0) >= 2:
+        metrics['ACCURACY'].add(nx)
+
+
+def handle_skymap(nx, metrics, args):
+    satellites = nx.get('satellites')
+    if satellites:
+        metrics['SKYMAP'].update(satellites)
+
+
+def handle_stream(nx, metrics, args):
+    metrics['STREAM'](metrics['source'], nx)
+
+
+def handle_history_tpv(nx, metrics, args):
+    metrics['HISTORY']('TPV', nx.get('device'), nx)
+
+
+def handle_history_sky(nx, metrics, args):
+    satellites = nx.get('satellites')
+    summary = dict(nx)
+    if satellites is not None:
+        used = [sat['ss'] for sat in satellites if sat.get('used') and 'ss' in sat]
+        summary['nSat'] = len(satellites)
+        summary['uSat'] = len(used)
+        if used:
+            summary['ss'] = sum(used) / len(used)
+    metrics['HISTORY']('SKY', nx.get('device'), summary)
+
+
+def handle_history_pps(nx, metrics, args):
+    metrics['HISTORY']('PPS', nx.get('device'), {
+        'offset': pps_offset(nx, args),
+        'real': nx['real_sec'] + nx['real_nsec'] / NSEC,
+        'clock': nx['clock_sec'] + nx['clock_nsec'] / NSEC,
+        'precision': nx.get('precision'),
+        'qErr': nx.get('qErr'),
+    })
 
-    elif nx['class'] == 'WATCH':
-        pass
-    
-    else:
-        log.debug(f'received {nx["class"]}')
-        log.debug(nx)
 
 def MeterOffsetSmall(c1, c2):
     "Return offset in meters of second arg from first."
     (lat1, lon1) = c1
     (lat2, lon2) = c2
+    gps = import_gps()
     dx = gps.misc.EarthDistanceSmall((lat1, lon1), (lat1, lon2))
     dy = gps.misc.EarthDistanceSmall((lat1, lon1), (lat2, lon1))
     if lat1 < lat2:
@@ -494,6 +1332,79 @@ def MeterOffsetSmall(c1, c2):
         dx = -dx
     return (dx, dy)
 
+class GeoProjector(object):
+    """
+    Offsets in meters of fixes from a fixed geo point, in the local east,
+    north, up frame of that point.
+
+    The ECEF position of the geo point, the rotation into its ENU frame and
+    the radii of curvature are computed once. A fix with ecefx/ecefy/ecefz
+    is rotated into the frame exactly. A fix with only lat/lon (and altHAE)
+    is scaled by the meters per degree, with second order corrections for
+    its height, the convergence of the meridians and the curvature of the
+    earth, within a millimeter of exact up to a kilometer from the geo
+    point. The up offset is only known when the geo point has an altitude.
+    """
+
+    def __init__(self, lat, lon, alt=None):
+        self.lat = lat
+        self.lon = lon
+        self.alt = alt
+
+        phi, lam = math.radians(lat), math.radians(lon)
+        sin_phi, cos_phi = math.sin(phi), math.cos(phi)
+        sin_lam, cos_lam = math.sin(lam), math.cos(lam)
+        h = alt or 0.0
+
+        w = math.sqrt(1 - WGS84_E2 * sin_phi * sin_phi)
+        n = WGS84_A / w  # prime vertical radius of curvature
+        m = WGS84_A * (1 - WGS84_E2) / (w * w * w)  # meridian radius of curvature
+
+        self.m_per_deg_lat = math.radians(m + h)
+        self.m_per_deg_lon = math.radians((n + h) * cos_phi)
+        self.rad_per_deg_tan = math.radians(sin_phi / cos_phi)
+        # half the change of the meridian radius per degree, squared
+        self.m_per_deg2_lat = math.radians(math.radians(1.5 * m * WGS84_E2 * sin_phi * cos_phi / (w * w)))
+        self.tan_2n = sin_phi / cos_phi / (2 * (n + h))
+        self.inv_2n = 1 / (2 * (n + h))
+        self.inv_2m = 1 / (2 * (m + h))
+
+        self.ecef = ((n + h) * cos_phi * cos_lam, (n + h) * cos_phi * sin_lam, (n * (1 - WGS84_E2) + h) * sin_phi)
+        self.east = (-sin_lam, cos_lam, 0.0)
+        self.north = (-sin_phi * cos_lam, -sin_phi * sin_lam, cos_phi)
+        self.up = (cos_phi * cos_lam, cos_phi * sin_lam, sin_phi)
+
+    def offset(self, nx):
+        """ (east, north, up) of a TPV report, up None when unknown, None without a position. """
+        if 'ecefx' in nx and 'ecefy' in nx and 'ecefz' in nx:
+            x0, y0, z0 = self.ecef
+            dx, dy, dz = nx['ecefx'] - x0, nx['ecefy'] - y0, nx['ecefz'] - z0
+            e, n, u = self.east, self.north, self.up
+            return (e[0] * dx + e[1] * dy,
+                    n[0] * dx + n[1] * dy + n[2] * dz,
+                    u[0] * dx + u[1] * dy + u[2] * dz if self.alt is not None else None)
+
+        if 'lat' in nx and 'lon' in nx:
+            dlat = nx['lat'] - self.lat
+            alt = nx.get('altHAE')
+            dh = alt - self.alt if alt is not None and self.alt is not None else None
+            # a fix above the geo point is further out from the center of the earth
+            scale = 1 + dh * self.inv_2n * 2 if dh else 1.0
+            east = ((nx['lon'] - self.lon + 540) % 360 - 180) * self.m_per_deg_lon * (scale - dlat * self.rad_per_deg_tan)
+            north = dlat * (self.m_per_deg_lat * scale + dlat * self.m_per_deg2_lat) + east * east * self.tan_2n
+            if dh is None:
+                return east, north, None
+            return east, north, dh - east * east * self.inv_2n - north * north * self.inv_2m
+
+        return None
+
+    def position(self, east, north, up=None):
+        """ Latitude, longitude and height of an offset, the inverse of offset() to first order. """
+        return (self.lat + north / self.m_per_deg_lat,
+                (self.lon + east / self.m_per_deg_lon + 540) % 360 - 180,
+                self.alt + up if up is not None and self.alt is not None else None)
+
+
 def drop_privileges(uid_name='nobody', gid_name='nogroup'):
     if os.getuid() != 0:
         # We're not root so, like, whatever dude
@@ -513,26 +1424,71 @@ def drop_privileges(uid_name='nobody', gid_name='nogroup'):
     # Ensure a very conservative umask
     os.umask(0o077)
 
+
+def hand_to_run_user(path, uid_name='nobody', gid_name='nogroup'):
+    """ Make path owned by the user drop_privileges() switches to, so the exporter can still write
+    it once it runs as that user. A symlink is changed itself, never its target. """
+    if os.getuid() != 0:
+        return
+    os.chown(path, pwd.getpwnam(uid_name).pw_uid, grp.getgrnam(gid_name).gr_gid, follow_symlinks=False)
+
+
+def writable_by_run_user(path, uid_name='nobody', gid_name='nogroup'):
+    """ Whether the exporter can create files in the directory path once drop_privileges() ran. """
+    if os.getuid() != 0:
+        return os.access(path, os.W_OK | os.X_OK)
+    st = os.stat(path)
+    # the run user has no supplementary groups, see drop_privileges()
+    if st.st_uid == pwd.getpwnam(uid_name).pw_uid:
+        return st.st_mode & 0o300 == 0o300
+    if st.st_gid == grp.getgrnam(gid_name).gr_gid:
+        return st.st_mode & 0o030 == 0o030
+    return st.st_mode & 0o003 == 0o003
+
+
+def writable_directory(path, option):
+    """ Create the directory of option before drop_privileges(), and fail at startup when the
+    exporter could not write there. Only a directory it creates is handed to the run user, an
+    existing one may hold files of others. """
+    try:
+        if not os.path.isdir(path):
+            os.makedirs(path)
+            hand_to_run_user(path)
+        writable = writable_by_run_user(path)
+    except (OSError, KeyError) as e:
+        raise CLIError(f'cannot use {path} for {option}: {e}')
+    if not writable:
+        raise CLIError(f'cannot use {path} for {option}: not writable by the user the exporter runs as')
+
 def loop_connection(metrics, args):
+    gps = import_gps()
 
     try:
-        log.info(f'Attempting to connect to gpsd at {args.hostname}:{args.port} with {args.timeout}s timeout')
-        gpsd = gps.gps(host=args.hostname, port=args.port, verbose=1, mode=gps.WATCH_ENABLE | gps.WATCH_NEWSTYLE | gps.WATCH_SCALED)
+        log.info(f'Attempting to connect to gpsd at {metrics["host"]}:{metrics["port"]} with {args.timeout}s timeout')
+        mode = gps.WATCH_ENABLE | gps.WATCH_NEWSTYLE | gps.WATCH_SCALED
+        if any(cls in metrics['HANDLERS'] for cls in PPS_CLASSES):
+            mode |= gps.WATCH_PPS
+        gpsd = gps.gps(host=metrics['host'], port=metrics['port'], verbose=1, mode=mode)
 
         if not gpsd:
-            log.critical(f'Could not connect to gpsd at {args.hostname}:{args.port}')
-            raise ConnectionRefusedError(f'Failed to establish connection to gpsd at {args.hostname}:{args.port}')
+            log.critical(f'Could not connect to gpsd at {metrics["host"]}:{metrics["port"]}')
+            raise ConnectionRefusedError(f'Failed to establish connection to gpsd at {metrics["host"]}:{metrics["port"]}')
 
         # Set timeout on the gpsd socket only (not globally, which would
         # also affect the Prometheus HTTP server sockets)
-        if hasattr(gpsd, 'ser') and hasattr(gpsd.ser, 'sock') and gpsd.ser.sock:
-            gpsd.ser.sock.settimeout(args.timeout)
-
-        log.info(f'Successfully connected to gpsd at {args.hostname}:{args.port}')
+        # newer gps packages keep the socket in gpsd.ser, older ones in gpsd itself
+        reader = getattr(gpsd, 'ser', gpsd)
+        sock = reader.sock
+        if sock:
+            sock.settimeout(args.timeout)
+            enable_keepalive(sock)
+
+        log.info(f'Successfully connected to gpsd at {metrics["host"]}:{metrics["port"]}')
+        connection_established(metrics)
         drop_privileges()
             
     except socket.timeout:
-        log.critical(f'Connection to gpsd at {args.hostname}:{args.port} timed out after {args.timeout}s')
+        log.critical(f'Connection to gpsd at {metrics["host"]}:{metrics["port"]} timed out after {args.timeout}s')
         raise ConnectionRefusedError(f'Connection timeout after {args.timeout}s')
     except ConnectionRefusedError:
         # Re-raise to be caught by the main loop
@@ -541,9 +1497,17 @@ def loop_connection(metrics, args):
         log.critical(f'Unexpected error connecting to gpsd: {e}')
         raise ConnectionRefusedError(f'Failed to connect to gpsd: {e}')
 
+    # the raw line reader, not the decoding read() of gps.gps
+    read_line = gps.client.gpscommon.read
+    liveness = metrics['LIVENESS']
+    timeout = args.timeout
     while True:
         try:
-            getPositionData(gpsd, metrics, args)
+            getPositionData(reader, read_line, metrics, args)
+            if liveness.deadline != timeout and sock:
+                # the watchdog learned the report cadence, a recv() now times out after it
+                timeout = liveness.deadline
+                sock.settimeout(timeout)
         except KeyboardInterrupt:
             log.info("Received keyboard interrupt, shutting down...")
             raise
@@ -556,108 +1520,1917 @@ def loop_connection(metrics, args):
             # Continue running to avoid crashing the container
             continue
 
+class SessionRecorder(object):
+    """
+    Appends the raw gpsd reports to a recording, one line per report:
+
+        arrival time (unix seconds) TAB source TAB report JSON
+
+    The reports are collected in memory and written in one go every
+    RECORD_BUFFER_SIZE bytes or RECORD_FLUSH_INTERVAL seconds, so recording
+    costs the reader a string format and a buffer append per report. A
+    file name ending in .gz is written gzip compressed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if path.endswith('.gz'):
+            self.file = gzip.open(path, 'ab', compresslevel=6)
+        else:
+            self.file = open(path, 'ab')
+        self.buf = bytearray()
+        self.flushed = time.monotonic()
+        self.lock = threading.Lock()
+        atexit.register(self.close)
+        log.info(f'Recording gpsd reports to {path}')
+
+    def writer(self, source):
+        """ Return the function recording the reports of one gpsd. """
+        prefix = b'\t' + source.encode() + b'\t'
+
+        def record(line):
+            self.write(b'%.6f%s%s\n' % (time.time(), prefix, line))
+
+        return record
+
+    def write(self, data):
+        with self.lock:
+            self.buf += data
+            if len(self.buf) >= RECORD_BUFFER_SIZE or time.monotonic() - self.flushed >= RECORD_FLUSH_INTERVAL:
+                self.flush()
+
+    def flush(self):
+        """ Write the collected reports, the caller holds the lock. """
+        self.flushed = time.monotonic()
+        if self.file.closed:
+            return
+        try:
+            self.file.write(self.buf)
+            self.file.flush()
+        except OSError as e:
+            log.error(f'Could not write to recording {self.path}: {e}')
+        self.buf.clear()
+
+    def close(self):
+        with self.lock:
+            self.flush()
+            self.file.close()
+
+
+def open_recording(path):
+    """ Open a recording for reading, gzip compressed or not. """
+    with open(path, 'rb') as f:
+        magic = f.read(2)
+    return gzip.open(path, 'rb') if magic == b'\x1f\x8b' else open(path, 'rb')
+
+
+def replay_session(metrics, args):
+    """
+    Feed a recording through process_report(), the path live reports take,
+    paced by the recorded arrival times divided by --replay-speed. Every
+    source in the recording gets its own metrics, as if the exporter had
+    been monitoring those gpsd instances.
+    """
+    sources = {}
+    speed = args.replay_speed
+    first = started = None
+    count = 0
+
+    log.info(f'Replaying {args.replay} at {speed or "maximum"} speed')
+    with open_recording(args.replay) as f:
+        try:
+            for line in f:
+                try:
+                    ts, source, report = line.split(b'\t', 2)
+                    ts = float(ts)
+                except ValueError:
+                    log.warning(f'Skipping malformed line in recording: {line[:80]}')
+                    continue
+
+                if speed > 0:
+                    if first is None:
+                        first, started = ts, time.monotonic()
+                    delay = started + (ts - first) / speed - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+
+                bound = sources.get(source)
+                if bound is None:
+                    bound = sources[source] = bind_source(metrics, source.decode(), None, None, args)
+
+                if skip_report(report, bound):
+                    count += 1
+                    continue
+
+                try:
+                    process_report(json.loads(report), bound, args)
+                except ValueError as e:
+                    log.warning(f'Skipping malformed gpsd report: {e}')
+                except KeyError as e:
+                    log.warning(f"GPSD reported incomplete data: {e}")
+                count += 1
+        except EOFError:
+            log.warning(f'{args.replay} ends in a truncated gzip stream')
+
+    log.info(f'Replayed {count} reports from {len(sources)} gpsd')
+    print(f'Replayed {count} reports from {len(sources)} gpsd, serving the metrics until interrupted')
+
+
+class MetricsCache(object):
+    """
+    The rendered exposition of the registry, plain and gzip compressed.
+
+    The report handlers call invalidate() after every applied report, the
+    first scrape after that renders the registry again and every other scrape
+    gets the cached bytes. A rendering older than max_age seconds is never
+    served, so metrics that change outside the report handlers can not go
+    stale. A max_age of 0 renders on every scrape.
+    """
+
+    def __init__(self, registry, max_age=DEFAULT_METRICS_MAX_AGE):
+        self.registry = registry
+        self.max_age = max_age
+        self.generation = 0
+        # (generation, rendered at, body, gzipped body)
+        self.rendered = None
+        self.lock = threading.Lock()
+
+    def invalidate(self):
+        self.generation += 1
+
+    def fresh(self, rendered):
+        return (rendered is not None and rendered[0] == self.generation
+                and time.monotonic() - rendered[1] < self.max_age)
+
+    def get(self):
+        rendered = self.rendered
+        if self.fresh(rendered):
+            return rendered
+
+        # Concurrent scrapers wait for one rendering instead of each running the registry
+        with self.lock:
+            rendered = self.rendered
+            if self.fresh(rendered):
+                return rendered
+
+            generation = self.generation
+            started = time.monotonic()
+            body = generate_latest(self.registry)
+            rendered = (generation, started, body, gzip.compress(body, compresslevel=6))
+            self.rendered = rendered
+            log.debug(f'rendered {len(body)} bytes in {(time.monotonic() - started) * MSEC:0.1f}ms')
+            return rendered
+
+
+class ExporterHandler(BaseHTTPRequestHandler):
+    """ Serves the cached metrics on /metrics and every path without its own route. """
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        path, _, query = self.path.partition('?')
+        route = self.server.routes.get(path, serve_metrics)
+        try:
+            route(self, query)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def send_body(self, body, content_type, encoding=None):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug(f'{self.address_string()} {format % args}')
+
+
+class ExporterServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, metrics):
+        self.metrics = metrics
+        # path -> callable(handler, query string)
+        self.routes = {'/metrics': serve_metrics}
+        HTTPServer.__init__(self, address, ExporterHandler)
+
+
+def serve_metrics(handler, query):
+    rendered = handler.server.metrics['CACHE'].get()
+    if 'gzip' in handler.headers.get('Accept-Encoding', ''):
+        handler.send_body(rendered[3], CONTENT_TYPE_LATEST, 'gzip')
+    else:
+        handler.send_body(rendered[2], CONTENT_TYPE_LATEST)
+
+
+def sample_profile(seconds, interval=PROFILE_INTERVAL):
+    """
+    Sample the stacks of all other threads every interval for seconds and
+    return them in the collapsed format of flamegraph.pl: one line per
+    distinct stack, root first, with the number of samples it was seen in.
+    """
+    me = threading.get_ident()
+    names = {}
+    stacks = {}
+    samples = 0
+    deadline = time.monotonic() + seconds
+
+    while time.monotonic() < deadline:
+        for thread in threading.enumerate():
+            names[thread.ident] = thread.name
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            key = ';'.join(reversed(stack))
+            stacks[key] = stacks.get(key, 0) + 1
+        samples += 1
+        time.sleep(interval)
+
+    lines = [f'{stack} {count}' for stack, count in sorted(stacks.items(), key=lambda item: -item[1])]
+    log.info(f'profiled {samples} samples of {len(stacks)} distinct stacks in {seconds}s')
+    return '\n'.join(lines) + '\n'
+
+
+def write_profile(directory, seconds, keep=KEEP_PROFILES):
+    """ Sample a profile and write it to a new file in directory, removing all but the newest keep
+    profiles there, returns the profile and its path. """
+    profile = sample_profile(seconds)
+    path = os.path.join(directory, time.strftime('gpsd_exporter-%Y%m%dT%H%M%S.folded'))
+    try:
+        with open(path, 'w') as f:
+            f.write(profile)
+        log.warning(f'Wrote profile of {seconds}s to {path}')
+        # the time stamped names sort by age
+        names = sorted(name for name in os.listdir(directory)
+                       if name.startswith('gpsd_exporter-') and name.endswith('.folded'))
+        for name in names[:-keep]:
+            os.unlink(os.path.join(directory, name))
+    except OSError as e:
+        log.error(f'Could not write profile to {path}: {e}')
+    return profile, path
+
+
+def enable_profiling(server, args):
+    """ Profile on SIGUSR1 and on GET /debug/profile, one profile at a time. """
+    writable_directory(args.profile_dir, '--profile-dir')
+    lock = threading.Lock()
+
+    def profile(seconds, write):
+        if not lock.acquire(blocking=False):
+            return None
+        try:
+            return write_profile(args.profile_dir, seconds)[0] if write else sample_profile(seconds)
+        finally:
+            lock.release()
+
+    def on_signal(signum, frame):
+        threading.Thread(target=profile, args=(args.profile_seconds, True), name='profiler', daemon=True).start()
+
+    def serve_profile(handler, query):
+        """ The profile goes out in the response only, a client can not fill up the disk. """
+        try:
+            seconds = float(urllib.parse.parse_qs(query).get('seconds', [args.profile_seconds])[0])
+        except ValueError:
+            seconds = args.profile_seconds
+        if not seconds >= MIN_PROFILE_SECONDS:
+            seconds = MIN_PROFILE_SECONDS
+        body = profile(min(seconds, MAX_PROFILE_SECONDS), False)
+        if body is None:
+            handler.send_error(409, 'A profile is already running')
+            return
+        handler.send_body(body.encode(), 'text/plain; charset=utf-8')
+
+    signal.signal(signal.SIGUSR1, on_signal)
+    server.routes['/debug/profile'] = serve_profile
+    log.info(f'Profiling enabled, profiles are written to {args.profile_dir}')
+
+
+class HistoryRing(object):
+    """
+    The recent TPV, SKY and PPS reports in a ring of fixed size records in a
+    memory mapped file, so they survive a restart of the exporter.
+
+    A record holds the arrival time, the report class, the source and the
+    device, and the 8 HISTORY_FIELDS of its class, NaN when missing. The
+    header keeps the number of records written and the names of the sources
+    and devices. Arrival times never go back, so query() finds the start
+    and end of a time range with a binary search.
+    """
+
+    def __init__(self, path, capacity):
+        self.path = path
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        size = HISTORY_HEADER_SIZE + capacity * HISTORY_RECORD.size
+
+        # opened before drop_privileges(), the mapping stays writable
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            header = os.pread(fd, HISTORY_HEADER.size, 0)
+            if len(header) == HISTORY_HEADER.size:
+                magic, version, record_size, file_capacity, count = HISTORY_HEADER.unpack(header)
+            else:
+                magic = record_size = file_capacity = None
+            if ((magic, record_size, file_capacity) != (HISTORY_MAGIC, HISTORY_RECORD.size, capacity)
+                    or os.fstat(fd).st_size != size):
+                if magic is not None:
+                    log.warning(f'{path} is not a history of {capacity} records, starting a new one')
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+                count = 0
+            self.map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        self.count = count
+        self.names = self.read_names() if count else []
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.last = self.time(count - 1) if count else 0.0
+        HISTORY_HEADER.pack_into(self.map, 0, HISTORY_MAGIC, 1, HISTORY_RECORD.size, capacity, count)
+        log.info(f'History of {capacity} records in {path}, {min(count, capacity)} kept')
+
+    def read_names(self):
+        length, = struct.unpack_from('<I', self.map, HISTORY_HEADER.size)
+        start = HISTORY_HEADER.size + 4
+        return json.loads(bytes(self.map[start:start + length])) if length else []
+
+    def name_index(self, name):
+        """ The index of a source or device name, added to the header when new. """
+        i = self.index.get(name)
+        if i is None:
+            names = self.names + [name]
+            data = json.dumps(names).encode()
+            if HISTORY_HEADER.size + 4 + len(data) > HISTORY_HEADER_SIZE:
+                log.warning(f'No room for {name} in the history names')
+                return 0xFFFF
+            self.map[HISTORY_HEADER.size + 4:HISTORY_HEADER.size + 4 + len(data)] = data
+            struct.pack_into('<I', self.map, HISTORY_HEADER.size, len(data))
+            self.names = names
+            i = self.index[name] = len(names) - 1
+        return i
+
+    def writer(self, source):
+        """ The history of one source: callable(class, device, report). """
+        classes = {cls: (i, fields, [math.nan] * (8 - len(fields))) for i, (cls, fields) in enumerate(HISTORY_FIELDS.items())}
+        with self.lock:
+            source = self.name_index(source)
+
+        def write(cls, device, report):
+            kind, fields, padding = classes[cls]
+            values = [report.get(field) for field in fields]
+            values = [math.nan if value is None else value for value in values] + padding
+            with self.lock:
+                ts = self.last = max(time.time(), self.last)
+                HISTORY_RECORD.pack_into(self.map, self.offset(self.count), ts, kind,
+                                         source, self.name_index(device or ''), *values)
+                self.count += 1
+                # after the record, a restart never finds half of one
+                struct.pack_into('<Q', self.map, HISTORY_HEADER.size - 8, self.count)
+
+        return write
+
+    def offset(self, i):
+        return HISTORY_HEADER_SIZE + (i % self.capacity) * HISTORY_RECORD.size
+
+    def time(self, i):
+        return struct.unpack_from('<d', self.map, self.offset(i))[0]
+
+    def bisect(self, lo, hi, ts):
+        """ The first record in [lo, hi) that arrived at or after ts. """
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.time(mid) < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def query(self, start, end, classes=None, sources=None, limit=MAX_HISTORY_RECORDS):
+        """ The (time, class, source, device, fields) of the records from start until end. """
+        count = self.count
+        # skip the oldest records when the ring is full, the writers may be overwriting them
+        oldest = count - self.capacity + min(HISTORY_MARGIN, self.capacity // 8) if count > self.capacity else 0
+        first = self.bisect(oldest, count, start)
+        last = self.bisect(first, count, end)
+
+        names = self.names
+        kinds = list(HISTORY_FIELDS.items())
+        for i in range(first, last):
+            ts, kind, source, device, *values = HISTORY_RECORD.unpack_from(self.map, self.offset(i))
+            if kind >= len(kinds):
+                continue
+            cls, fields = kinds[kind]
+            if classes and cls not in classes:
+                continue
+            source = names[source] if source < len(names) else '?'
+            if sources and source not in sources:
+                continue
+            yield ts, cls, source, names[device] if device < len(names) else '?', dict(zip(fields, values))
+            limit -= 1
+            if not limit:
+                return
+
+
+def serve_history(handler, query):
+    """
+    The records of the history as JSON or CSV. from= and to= are seconds
+    since the epoch, or seconds before now when negative. class=, source=
+    and fields= take comma separated lists, format= is json or csv.
+    """
+    params = {key: values[-1] for key, values in urllib.parse.parse_qs(query).items()}
+    now = time.time()
+    try:
+        start = float(params.get('from', -DEFAULT_HISTORY_SECONDS))
+        end = float(params.get('to', now))
+        limit = min(int(params.get('limit', MAX_HISTORY_RECORDS)), MAX_HISTORY_RECORDS)
+    except ValueError:
+        handler.send_error(400, 'from, to and limit must be numbers')
+        return
+    start = now + start if start < 0 else start
+    end = now + end if end < 0 else end
+    classes = set(parse_fields(params['class'].upper())) if 'class' in params else None
+    sources = set(parse_fields(params['source'])) if 'source' in params else None
+    wanted = parse_fields(params['fields']) if 'fields' in params else None
+
+    fields = []
+    for cls, names in HISTORY_FIELDS.items():
+        if classes is None or cls in classes:
+            fields.extend(name for name in names if name not in fields and (wanted is None or name in wanted))
+
+    records = handler.server.metrics['HISTORY'].query(start, end, classes, sources, max(limit, 1))
+    if params.get('format') == 'csv':
+        lines = [','.join(['time', 'class', 'source', 'device'] + fields)]
+        for ts, cls, source, device, values in records:
+            lines.append(','.join([f'{ts:.6f}', cls, source, device] +
+                                  ['' if math.isnan(values.get(field, math.nan)) else repr(values[field])
+                                   for field in fields]))
+        handler.send_body(('\n'.join(lines) + '\n').encode(), 'text/csv; charset=utf-8')
+        return
+
+    result = []
+    for ts, cls, source, device, values in records:
+        record = {'time': ts, 'class': cls, 'source': source, 'device': device}
+        for field in fields:
+            value = values.get(field, math.nan)
+            if not math.isnan(value):
+                record[field] = value
+        result.append(record)
+    handler.send_body(json.dumps(result, separators=(',', ':')).encode(), 'application/json')
+
+
+class SkyMap(object):
+    """
+    The satellites of one gpsd binned by azimuth and elevation, in cells of
+    step by step degrees. Four preallocated arrays hold per cell the
+    observations, the observations with a signal, the sum of their signal
+    strength and the observations used in the solution, so a SKY report
+    costs a few additions per satellite and the map does not grow with time.
+    saved restores the arrays of a previous run.
+    """
+
+    KEYS = ('count', 'tracked', 'ss', 'used')
+
+    def __init__(self, step, saved=None):
+        self.step = step
+        self.columns = int(math.ceil(360 / step))
+        self.rows = int(math.ceil(90 / step))
+        size = self.columns * self.rows
+        if saved and all(len(saved.get(key, ())) == size for key in self.KEYS):
+            self.count, self.tracked, self.ss, self.used = (array('d', saved[key]) for key in self.KEYS)
+        else:
+            self.count, self.tracked, self.ss, self.used = (array('d', [0.0]) * size for _ in self.KEYS)
+
+    def update(self, satellites):
+        step, columns, last_row = self.step, self.columns, self.rows - 1
+        count, tracked, ss, used = self.count, self.tracked, self.ss, self.used
+        for sat in satellites:
+            az = sat.get('az')
+            el = sat.get('el')
+            # gpsd leaves out, or reports a negative elevation for, satellites it has no position of
+            if az is None or el is None or not 0 <= el <= 90:
+                continue
+            i = min(int(el // step), last_row) * columns + int(az % 360 // step)
+            count[i] += 1
+            # 0 is a satellite gpsd knows of but does not track, like in ConstellationStats
+            signal = sat.get('ss')
+            if signal:
+                tracked[i] += 1
+                ss[i] += signal
+            if sat.get('used'):
+                used[i] += 1
+
+    def cells(self):
+        """ [azimuth, elevation, observations, mean signal strength, used fraction] of every observed
+        cell, azimuth and elevation of its lower edges. The mean signal strength is None in a cell
+        without a tracked satellite. """
+        step, columns = self.step, self.columns
+        result = []
+        for i, (count, tracked, ss, used) in enumerate(zip(self.count, self.tracked, self.ss, self.used)):
+            if count:
+                row, column = divmod(i, columns)
+                result.append([column * step, row * step, int(count), round(ss / tracked, 2) if tracked else None,
+                               round(used / count, 4)])
+        return result
+
+    def saved(self):
+        return {key: getattr(self, key).tolist() for key in self.KEYS}
+
+
+class SkyMapFile(object):
+    """
+    The saved sky maps, alternately in path and path.1 so a crash or a kill
+    during a save leaves the previous save intact. Both files are opened, or
+    created, before drop_privileges(), like the mapping of HistoryRing, and
+    the saves rewrite them through these descriptors once the exporter runs
+    as nobody. Every save carries a generation one higher than the last,
+    load() picks the newest file that reads back whole.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.paths = (path, f'{path}.1')
+        self.generation = 0
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        try:
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.fds = []
+            for name in self.paths:
+                # never through a symlink, the descriptor stays writable after the drop
+                self.fds.append(os.open(name, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o644))
+                hand_to_run_user(name)
+        except (OSError, KeyError) as e:
+            raise CLIError(f'cannot use {path} for --skymap: {e}')
+
+    def load(self, step):
+        """ source -> saved arrays of the newest sky map, none when there is none or it has other cells. """
+        newest = None
+        for name, fd in zip(self.paths, self.fds):
+            try:
+                with os.fdopen(os.dup(fd), 'rb') as f:
+                    data = f.read()
+                if not data:
+                    continue
+                saved = json.loads(data)
+            except (OSError, ValueError) as e:
+                log.warning(f'Cannot read the sky map {name}: {e}')
+                continue
+            if newest is None or saved.get('generation', 0) > newest.get('generation', 0):
+                newest = saved
+        if newest is None:
+            return {}
+        self.generation = newest.get('generation', 0)
+        if newest.get('step') != step:
+            log.warning(f'Sky map {self.path} has {newest.get("step")} degree cells, '
+                        f'starting a new one with {step} degree cells')
+            return {}
+        return newest.get('sources', {})
+
+    def save(self, skymaps, step):
+        """ Rewrite the older of the two files with the sky maps and flush it to disk. """
+        with self.lock:
+            generation = self.generation + 1
+            saved = {'version': 3, 'generation': generation, 'step': step,
+                     'sources': {source: skymap.saved() for source, skymap in list(skymaps.items())}}
+            data = json.dumps(saved, separators=(',', ':')).encode()
+            fd = self.fds[generation % 2]
+            try:
+                os.pwrite(fd, data, 0)
+                os.ftruncate(fd, len(data))
+                os.fsync(fd)
+            except OSError as e:
+                log.error(f'Cannot save the sky map to {self.paths[generation % 2]}: {e}')
+                return
+            self.generation = generation
+
+
+def start_skymap_saver(metrics, args):
+    """ Save the sky maps every SKYMAP_SAVE_INTERVAL seconds and at exit. """
+    def save():
+        metrics['SKYMAP_FILE'].save(metrics['SKYMAPS'], args.skymap_step)
+
+    def loop():
+        while True:
+            time.sleep(SKYMAP_SAVE_INTERVAL)
+            save()
+
+    threading.Thread(target=loop, name='skymap', daemon=True).start()
+    atexit.register(save)
+
+
+def serve_skymap(handler, query):
+    """
+    The observed cells of the sky maps, as JSON or with format=csv as CSV.
+    source= takes a comma separated list of sources.
+    """
+    params = {key: values[-1] for key, values in urllib.parse.parse_qs(query).items()}
+    sources = set(parse_fields(params['source'])) if 'source' in params else None
+    metrics = handler.server.metrics
+    skymaps = {source: skymap.cells() for source, skymap in list(metrics['SKYMAPS'].items())
+               if sources is None or source in sources}
+    columns = ['az', 'el', 'count', 'ss', 'used']
+
+    if params.get('format') == 'csv':
+        lines = [','.join(['source'] + columns)]
+        for source, cells in skymaps.items():
+            lines.extend(','.join([source] + ['' if value is None else str(value) for value in cell]) for cell in cells)
+        handler.send_body(('\n'.join(lines) + '\n').encode(), 'text/csv; charset=utf-8')
+        return
+
+    body = {'step': metrics['SKYMAP_STEP'], 'columns': columns, 'sources': skymaps}
+    handler.send_body(json.dumps(body, separators=(',', ':')).encode(), 'application/json')
+
+
+class StreamSubscriber(object):
+
+    def __init__(self, size, classes=None):
+        # (class of the report, Server-Sent Events frame)
+        self.queue = queue.Queue(size)
+        self.classes = classes
+        self.closed = False
+
+
+class StreamHub(object):
+    """
+    Fans the TPV and SKY reports out to the /stream clients.
+
+    publish() runs on the reader threads and only queues the report, and
+    not even that without clients. The fan-out thread turns every report
+    into a Server-Sent Events frame once and puts the same bytes in the
+    bounded queue of every client. A client whose queue is full is
+    disconnected rather than waited for, so no client can hold up gpsd.
+    """
+
+    def __init__(self, queue_size, max_clients, dropped=None):
+        self.queue_size = queue_size
+        self.max_clients = max_clients
+        self.dropped = dropped
+        self.pending = deque(maxlen=STREAM_BACKLOG)
+        self.ready = threading.Event()
+        # replaced on every change, the fan-out thread iterates it without a lock
+        self.subscribers = ()
+        self.lock = threading.Lock()
+        threading.Thread(target=self.fan_out, name='stream', daemon=True).start()
+
+    def publish(self, source, report):
+        if self.subscribers:
+            self.pending.append((source, report))
+            self.ready.set()
+
+    def subscribe(self, classes=None):
+        with self.lock:
+            if len(self.subscribers) >= self.max_clients:
+                return None
+            subscriber = StreamSubscriber(self.queue_size, classes)
+            self.subscribers += (subscriber,)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        subscriber.closed = True
+        with self.lock:
+            self.subscribers = tuple(s for s in self.subscribers if s is not subscriber)
+
+    def fan_out(self):
+        pending = self.pending
+        while True:
+            self.ready.wait()
+            self.ready.clear()
+            while pending:
+                source, report = pending.popleft()
+                cls = report.get('class')
+                try:
+                    item = (cls, b'event: %s\ndata: %s\n\n' % (
+                        cls.encode(), json.dumps(dict(report, source=source), separators=(',', ':')).encode()))
+                except (TypeError, ValueError) as e:
+                    log.error(f'Cannot stream a {cls} report: {e}')
+                    continue
+                for subscriber in self.subscribers:
+                    if subscriber.classes is not None and cls not in subscriber.classes:
+                        # reports it does not read must not fill up its queue
+                        continue
+                    try:
+                        subscriber.queue.put_nowait(item)
+                    except queue.Full:
+                        log.warning('Disconnecting a /stream client that fell behind')
+                        self.unsubscribe(subscriber)
+                        if self.dropped:
+                            self.dropped()
+
+
+def serve_stream(handler, query):
+    """ Server-Sent Events of the TPV and SKY reports, class= narrows them down. """
+    params = urllib.parse.parse_qs(query)
+    classes = set(parse_fields(params['class'][-1].upper())) if 'class' in params else None
+    hub = handler.server.metrics['STREAM']
+    subscriber = hub.subscribe(classes)
+    if subscriber is None:
+        handler.send_error(503, 'Too many /stream clients')
+        return
+
+    try:
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'text/event-stream')
+        handler.send_header('Cache-Control', 'no-cache')
+        handler.send_header('Connection', 'close')
+        handler.end_headers()
+        handler.close_connection = True
+        # a client that stops reading blocks its own writes, never the fan-out
+        handler.connection.settimeout(STREAM_WRITE_TIMEOUT)
+        handler.wfile.write(b'retry: 1000\n\n')
+
+        while not subscriber.closed:
+            try:
+                cls, frame = subscriber.queue.get(timeout=STREAM_KEEPALIVE)
+            except queue.Empty:
+                cls, frame = None, b': keepalive\n\n'
+            if subscriber.closed:
+                break
+            handler.wfile.write(frame)
+    except socket.timeout:
+        # unless the fan-out thread disconnected it already
+        if not subscriber.closed:
+            log.warning('Disconnecting a /stream client that stopped reading')
+            if hub.dropped:
+                hub.dropped()
+    except OSError:
+        pass
+    finally:
+        hub.unsubscribe(subscriber)
+
+
+class PushSpool(object):
+    """
+    Compressed batches of metrics waiting to be pushed, oldest first.
+
+    The batches are kept in memory, or with a directory as one file per
+    batch, so they survive a restart of the exporter. Adding a batch that
+    does not fit in max_bytes drops the oldest batches first, a batch that
+    is larger than max_bytes by itself is dropped. ``dropped(count)`` counts
+    the dropped batches when given.
+    """
+
+    def __init__(self, max_bytes, directory=None, dropped=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.dropped = dropped
+        # (name, size, data), data is None for batches on disk
+        self.batches = deque()
+        self.size = 0
+
+        if directory:
+            writable_directory(directory, '--push-spool')
+            for name in sorted(os.listdir(directory)):
+                if name.endswith(PUSH_SPOOL_SUFFIX):
+                    # batches of a run as root, before the exporter dropped its privileges
+                    hand_to_run_user(os.path.join(directory, name))
+                    size = os.path.getsize(os.path.join(directory, name))
+                    self.batches.append((name, size, None))
+                    self.size += size
+            if self.batches:
+                log.info(f'{len(self.batches)} batches to push left in {directory}')
+            self.trim(0)
+
+    def add(self, ts, data, on_disk=True):
+        """ Spool a batch, in memory when on_disk is False even with a directory. """
+        if len(data) > self.max_bytes:
+            log.warning(f'Dropping a batch of {len(data)} bytes, larger than the push spool')
+            if self.dropped:
+                self.dropped(1)
+            return
+        self.trim(len(data))
+
+        name = f'{int(ts * MSEC):013d}{PUSH_SPOOL_SUFFIX}'
+        size = len(data)
+        if self.directory and on_disk:
+            # written aside and renamed, a restart never finds half a batch
+            path = os.path.join(self.directory, name)
+            with open(path + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(path + '.tmp', path)
+            data = None
+        self.batches.append((name, size, data))
+        self.size += size
+
+    def trim(self, incoming):
+        dropped = 0
+        while self.batches and self.size + incoming > self.max_bytes:
+            self.discard()
+            dropped += 1
+        if dropped:
+            log.warning(f'Push spool full, dropped the {dropped} oldest batches')
+            if self.dropped:
+                self.dropped(dropped)
+
+    def oldest(self):
+        name, _, data = self.batches[0]
+        if data is None:
+            with open(os.path.join(self.directory, name), 'rb') as f:
+                data = f.read()
+        return data
+
+    def discard(self):
+        """ Forget the oldest batch, after it was pushed or when it is dropped. """
+        name, size, data = self.batches.popleft()
+        self.size -= size
+        if data is None:
+            try:
+                os.unlink(os.path.join(self.directory, name))
+            except OSError as e:
+                log.error(f'Could not remove pushed batch {name}: {e}')
+
+    def __len__(self):
+        return len(self.batches)
+
+
+def timestamped(body, ts):
+    """ Add the timestamp ts to every sample of a text exposition. """
+    suffix = b' %d' % int(ts * MSEC)
+    return b'\n'.join(line + suffix if line and not line.startswith(b'#') else line
+                      for line in body.split(b'\n'))
+
+
+def push_batch(url, data, timeout):
+    request = urllib.request.Request(url, data=data, method='POST', headers={
+        'Content-Type': CONTENT_TYPE_LATEST,
+        'Content-Encoding': 'gzip',
+    })
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        response.read()
+
+
+def push_metrics(metrics, spool, args):
+    """ Spool the current metrics and push every spooled batch, oldest first, until a push fails. """
+    now = time.time()
+    body = metrics['CACHE'].get()[2]
+    if args.push_timestamps:
+        body = timestamped(body, now)
+    else:
+        # without timestamps an older batch would overwrite the newer values
+        while spool:
+            spool.discard()
+    batch = gzip.compress(body, compresslevel=6)
+    try:
+        spool.add(now, batch)
+    except OSError as e:
+        log.error(f'Could not spool a batch in {args.push_spool}, keeping it in memory: {e}')
+        spool.add(now, batch, on_disk=False)
+
+    while spool:
+        try:
+            push_batch(args.push_url, spool.oldest(), args.timeout)
+        except urllib.error.HTTPError as e:
+            if 400 <= e.code < 500 and e.code not in (408, 429):
+                # sending it again would not help
+                log.error(f'{args.push_url} rejected a batch: {e}')
+                spool.discard()
+                metrics['PUSH_DROPPED'].inc()
+                continue
+            log.warning(f'Push to {args.push_url} failed, {len(spool)} batches spooled: {e}')
+            metrics['PUSH_FAILURES'].inc()
+            return
+        except OSError as e:
+            log.warning(f'Push to {args.push_url} failed, {len(spool)} batches spooled: {e}')
+            metrics['PUSH_FAILURES'].inc()
+            return
+        spool.discard()
+        metrics['PUSHES'].inc()
+
+
+def start_pusher(metrics, args):
+    """ Push the metrics every --push-interval seconds from a daemon thread, off the gpsd reader path. """
+    spool = PushSpool(args.push_spool_size, args.push_spool, metrics['PUSH_DROPPED'].inc)
+    metrics['PUSH_SPOOL_BYTES'].set_function(lambda: spool.size)
+
+    def push_loop():
+        while True:
+            started = time.monotonic()
+            try:
+                push_metrics(metrics, spool, args)
+            except Exception as e:
+                log.error(f'Unexpected error pushing the metrics: {type(e).__name__}: {e}')
+            time.sleep(max(args.push_interval - (time.monotonic() - started), 0))
+
+    threading.Thread(target=push_loop, name='pusher', daemon=True).start()
+    log.info(f'Pushing the metrics to {args.push_url} every {args.push_interval}s')
+
+
+def start_exporter(port, addr, metrics):
+    """ Start the HTTP server of the exporter in a daemon thread. """
+
+    # pick the address family the same way prometheus_client does
+    family, _, _, _, sockaddr = socket.getaddrinfo(addr, port, type=socket.SOCK_STREAM, flags=socket.AI_PASSIVE)[0]
+
+    class Server(ExporterServer):
+        address_family = family
+
+    server = Server((sockaddr[0], port), metrics)
+    threading.Thread(target=server.serve_forever, name='exporter', daemon=True).start()
+    return server
+
+
+class GpsdProtocol(object):
+    """
+    Reads the newline delimited JSON stream of gpsd straight from the socket.
+
+    Incoming data is appended to one reusable buffer, every complete line of
+    a class the handlers need is decoded with json.loads() and handed to
+    process_report(), the same path the gps client uses. It implements the asyncio.Protocol methods itself,
+    so asyncio is only imported when the asyncio client runs.
+    """
+
+    def __init__(self, metrics, args):
+        self.metrics = metrics
+        self.args = args
+        self.buf = bytearray()
+        self.transport = None
+        self.last_rx = time.monotonic()
+        import asyncio
+        self.closed = asyncio.get_running_loop().create_future()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.write(watch_command(self.metrics['HANDLERS']))
+
+    def data_received(self, data):
+        self.last_rx = time.monotonic()
+        self.metrics['READ_BYTES'].inc(len(data))
+        buf = self.buf
+        buf += data
+
+        start = 0
+        while True:
+            end = buf.find(b'\n', start)
+            if end < 0:
+                break
+            line = buf[start:end]
+            start = end + 1
+            if line.strip():
+                self.line_received(line)
+
+        if start:
+            del buf[:start]
+
+        if len(buf) > MAX_LINE_LENGTH:
+            log.error(f'gpsd report exceeds {MAX_LINE_LENGTH} bytes, dropping connection')
+            buf.clear()
+            self.transport.abort()
+
+    def line_received(self, line):
+        if self.metrics['RECORD']:
+            self.metrics['RECORD'](line)
+
+        if skip_report(line, self.metrics):
+            return
+
+        try:
+            report = json.loads(line)
+        except ValueError as e:
+            log.warning(f'Skipping malformed gpsd report: {e}')
+            return
+
+        try:
+            process_report(report, self.metrics, self.args)
+        except KeyError as e:
+            log.warning(f"GPSD reported incomplete data: {e}")
+        except Exception as e:
+            log.error(f"Unexpected error in main loop: {type(e).__name__}: {e}")
+
+    def eof_received(self):
+        # let the transport close itself
+        return None
+
+    def pause_writing(self):
+        # only the WATCH command is ever written
+        pass
+
+    def resume_writing(self):
+        pass
+
+    def connection_lost(self, exc):
+        if not self.closed.done():
+            self.closed.set_result(exc)
+
+
+async def async_loop_connection(metrics, args):
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    log.info(f'Attempting to connect to gpsd at {metrics["host"]}:{metrics["port"]} with {args.timeout}s timeout (asyncio)')
+    try:
+        transport, protocol = await asyncio.wait_for(
+            loop.create_connection(lambda: GpsdProtocol(metrics, args), metrics['host'], metrics['port']),
+            timeout=args.timeout)
+    except asyncio.TimeoutError:
+        log.critical(f'Connection to gpsd at {metrics["host"]}:{metrics["port"]} timed out after {args.timeout}s')
+        raise ConnectionRefusedError(f'Connection timeout after {args.timeout}s')
+
+    log.info(f'Successfully connected to gpsd at {metrics["host"]}:{metrics["port"]}')
+    connection_established(metrics)
+    drop_privileges()
+
+    liveness = metrics['LIVENESS']
+    try:
+        enable_keepalive(transport.get_extra_info('socket'))
+        while True:
+            idle = time.monotonic() - protocol.last_rx
+            if idle >= liveness.deadline:
+                raise socket.timeout(f'No data from gpsd for {liveness.deadline:.1f}s')
+            try:
+                # woken at least every WATCHDOG_MIN, the deadline shrinks once the cadence is learned
+                exc = await asyncio.wait_for(asyncio.shield(protocol.closed),
+                                             min(liveness.deadline - idle, WATCHDOG_MIN))
+            except asyncio.TimeoutError:
+                continue
+            raise ConnectionError(f'gpsd closed the connection: {exc}' if exc else 'gpsd closed the connection')
+    finally:
+        transport.abort()
+
+
+class SatelliteStore(object):
+    """
+    Last known state of every satellite, keyed by (gnssid, svid).
+
+    The reader thread updates the entries in place on every SKY report, the
+    scrape thread takes a snapshot. Satellites that gpsd has not reported for
+    ``ttl`` seconds are evicted when a snapshot is taken, and counted with
+    ``evicted(count)`` when given.
+    """
+
+    def __init__(self, ttl=DEFAULT_SAT_TTL, evicted=None):
+        self.ttl = ttl
+        self.evicted = evicted
+        self.sats = {}
+        self.lock = threading.Lock()
+
+    def update(self, satellites, ts=None):
+        if ts is None:
+            ts = time.time()
+
+        sats = self.sats
+        with self.lock:
+            for sat in satellites:
+                try:
+                    # svid defaults to PRN for GPS-only receivers,
+                    # gnssid defaults to 0 (GPS constellation per NMEA 0183)
+                    key = (sat.get('gnssid', 0), sat.get('svid', sat['PRN']))
+                except KeyError as e:
+                    log.warning(f"Skipping satellite with missing data field: {e}")
+                    continue
+
+                entry = sats.get(key)
+                if entry is None:
+                    sats[key] = [sat, ts]
+                else:
+                    entry[0] = sat
+                    entry[1] = ts
+
+    def snapshot(self, now=None):
+        """ Return the satellites seen within the ttl, evicting the others. """
+        if now is None:
+            now = time.time()
+        deadline = now - self.ttl
+
+        with self.lock:
+            expired = [key for key, entry in self.sats.items() if entry[1] < deadline]
+            for key in expired:
+                del self.sats[key]
+            current = [entry[0] for entry in self.sats.values()]
+
+        if expired:
+            log.debug(f'evicted {len(expired)} satellites not seen for {self.ttl}s')
+            if self.evicted:
+                self.evicted(len(expired))
+
+        return current
+
+    def clear(self):
+        with self.lock:
+            self.sats.clear()
+
+    def __len__(self):
+        return len(self.sats)
+
+
+class ConstellationStats(object):
+    """
+    Per constellation counts and signal strength of the last SKY report of
+    one gpsd, as a dict of gnssid -> [seen, used, above the elevation mask,
+    ss sum, ss count, ss min, ss max]. update() builds them in one pass over
+    the satellites and swaps them in whole, like FieldSnapshot, so the scrape
+    thread reads ``current`` without a lock. A constellation once seen stays
+    exported, with zero satellites when it drops out of the report.
+    """
+
+    def __init__(self, mask):
+        self.mask = mask
+        self.current = {}
+
+    def update(self, satellites):
+        """ Returns the satellites used in the solution, over all constellations. """
+        mask = self.mask
+        stats = {gnssid: [0, 0, 0, 0.0, 0, math.inf, -math.inf] for gnssid in self.current}
+        used = 0
+        for sat in satellites:
+            # gnssid defaults to 0 (GPS constellation per NMEA 0183)
+            gnssid = sat.get('gnssid', 0)
+            entry = stats.get(gnssid)
+            if entry is None:
+                entry = stats[gnssid] = [0, 0, 0, 0.0, 0, math.inf, -math.inf]
+            entry[0] += 1
+            if sat.get('used'):
+                entry[1] += 1
+                used += 1
+            el = sat.get('el')
+            if el is not None and el >= mask:
+                entry[2] += 1
+            # 0 is a satellite gpsd knows of but does not track
+            ss = sat.get('ss')
+            if ss:
+                entry[3] += ss
+                entry[4] += 1
+                if ss < entry[5]:
+                    entry[5] = ss
+                if ss > entry[6]:
+                    entry[6] = ss
+        self.current = stats
+        return used
+
+    def withdraw(self):
+        """ Stop exporting the constellations until they are reported again. """
+        self.current = {}
+
+
+class Liveness(object):
+    """
+    Watchdog deadline of one gpsd connection, learned from its report cadence.
+
+    tick() is called on every TPV report and keeps a moving average of the
+    time between them. Once a connection has delivered its second TPV,
+    ``deadline`` is ``factor`` of those intervals, at least WATCHDOG_MIN and
+    at most ``timeout`` seconds. Before that, while gpsd may still be opening
+    its device, and with a factor of 0 it is ``timeout``.
+    """
+
+    def __init__(self, factor, timeout):
+        self.factor = factor
+        self.timeout = timeout
+        self.interval = None
+        self.last = None
+        self.deadline = timeout
+
+    def reset(self):
+        """ A new connection: wait for its reports before the learned cadence applies again. """
+        self.last = None
+        self.deadline = self.timeout
+
+    def tick(self, now):
+        last, self.last = self.last, now
+        if last is None or not self.factor:
+            return
+        interval = now - last
+        if interval >= self.timeout:
+            # a gap in the reports, not their cadence
+            return
+        if self.interval is None:
+            self.interval = interval
+        else:
+            self.interval += CADENCE_WEIGHT * (interval - self.interval)
+        self.deadline = min(max(self.factor * self.interval, WATCHDOG_MIN), self.timeout)
+
+
+class FieldSnapshot(object):
+    """
+    The TPV and SKY gauges of one gpsd, as a dict of metric name -> value.
+
+    The reader thread sets the fields of a report into a pending dict and
+    publish() swaps in a new snapshot holding the previous one updated with
+    them. A snapshot is never changed once published, so the scrape thread
+    reads ``current`` without a lock and always sees whole reports.
+    """
+
+    def __init__(self, names):
+        # like a labelled Gauge child, every field reads 0 until it is reported
+        self.current = dict.fromkeys(names, 0.0)
+        self.pending = {}
+
+    def setter(self, name):
+        pending = self.pending
+
+        def set_value(value):
+            try:
+                pending[name] = float(value)
+            except (TypeError, ValueError):
+                log.debug(f'{name}: not a number: {value!r}')
+
+        return set_value
+
+    def publish(self):
+        if self.pending:
+            current = self.current.copy()
+            current.update(self.pending)
+            self.current = current
+            self.pending.clear()
+
+    def withdraw(self):
+        """ Stop exporting the fields until they are reported again. """
+        self.pending.clear()
+        self.current = {}
+
+
+class FieldCollector(object):
+    """ Collects the TPV and SKY gauges of every gpsd from its field snapshot. """
+
+    def __init__(self, snapshots, families):
+        # source label -> FieldSnapshot, filled in by bind_source()
+        self.snapshots = snapshots
+        # metric name -> help
+        self.families = families
+
+    def collect(self):
+        current = [(source, snapshot.current) for source, snapshot in list(self.snapshots.items())]
+        for name, documentation in self.families.items():
+            family = GaugeMetricFamily(name, documentation, labels=['source'])
+            for source, values in current:
+                if name in values:
+                    family.add_metric([source], values[name])
+            yield family
+
+
 class SatCollector(object):
     
     
-    def __init__(self):
-        self.state = {}
+    def __init__(self, stores, collect_time=None, used_label=True, max_series=0, dropped=None):
+        # source label -> SatelliteStore, filled in by bind_source()
+        self.stores = stores
+        self.collect_time = collect_time
+        # the used label starts a new series whenever a satellite enters or leaves the solution
+        self.labels = ['source', 'PRN', 'svid', 'gnssid', 'used'] if used_label else ['source', 'PRN', 'svid', 'gnssid']
+        self.max_series = max_series
+        self.dropped = dropped
     
     def collect(self):
         """
         This Method is called each time exporter is called to fetch the per Satellite metrics 
         """
         
+        labels = self.labels
         metrics = {
-            'ss' : GaugeMetricFamily('gpsd_sat_ss', 'Signal to Noise ratio in dBHz.', labels=['PRN', 'svid', 'gnssid', 'used']),
-            'az' : GaugeMetricFamily('gpsd_sat_az', 'Azimuth, degrees from true north.', labels=['PRN', 'svid', 'gnssid', 'used']),
-            'el' : GaugeMetricFamily('gpsd_sat_el', 'Elevation in degrees.', labels=['PRN', 'svid', 'gnssid', 'used']),
-            'used': GaugeMetricFamily('gpsd_used', 'Used Satellite', labels=['PRN', 'svid', 'gnssid', 'used']),
-            'health' : GaugeMetricFamily('gpsd_health', 'The health of this satellite. 0 is unknown, 1 is OK, and 2 is unhealthy', labels=['PRN', 'svid', 'gnssid', 'used'])
+            'ss' : GaugeMetricFamily('gpsd_sat_ss', 'Signal to Noise ratio in dBHz.', labels=labels),
+            'az' : GaugeMetricFamily('gpsd_sat_az', 'Azimuth, degrees from true north.', labels=labels),
+            'el' : GaugeMetricFamily('gpsd_sat_el', 'Elevation in degrees.', labels=labels),
+            'used': GaugeMetricFamily('gpsd_used', 'Used Satellite', labels=labels),
+            'health' : GaugeMetricFamily('gpsd_health', 'The health of this satellite. 0 is unknown, 1 is OK, and 2 is unhealthy', labels=labels)
         }
+        with_used = len(labels) == 5
         
         log.debug('SatCollector::collect started')
-        last_measurement = {}
-        
-        while not sat_queue.empty():
-            try:
-                measurement = sat_queue.get()
-                log.debug(f'measurement:: {measurement}')            
-
-                sat = measurement['sat']
-                ts = measurement['ts']
+        started = time.perf_counter()
+
+        for source, store in list(self.stores.items()):
+            sats = store.snapshot()
+            if self.max_series and len(sats) > self.max_series:
+                # keep the satellites of the solution, then the strongest signals
+                sats.sort(key=lambda sat: (bool(sat.get('used')), sat.get('ss') or 0), reverse=True)
+                if self.dropped:
+                    self.dropped.labels(source).set(len(sats) - self.max_series)
+                del sats[self.max_series:]
+            elif self.dropped:
+                self.dropped.labels(source).set(0)
+
+            for sat_dict in sats:
+                try:
+                    # Extract label values with defaults for missing optional fields
+                    # PRN is required - will raise KeyError if missing
+                    prn = str(sat_dict['PRN'])
+                    # svid defaults to PRN for GPS-only receivers (semantically correct)
+                    svid = str(sat_dict.get('svid', sat_dict['PRN']))
+                    # gnssid defaults to 0 (GPS constellation per NMEA 0183) if missing
+                    gnssid = str(sat_dict.get('gnssid', 0))
+                    values = [source, prn, svid, gnssid]
+                    if with_used:
+                        # used defaults to False if missing
+                        values.append(str(sat_dict.get('used', False)))
+
+                    # Add all available metrics for this satellite
+                    for key in metrics.keys():
+                        if key in sat_dict:
+                            metrics[key].add_metric(values, sat_dict[key])
+
+                except KeyError as e:
+                    # Only PRN is truly required - skip satellite if missing
+                    log.warning(f"Skipping satellite due to missing required field PRN: {e}")
+                    continue
+                except Exception as e:
+                    # Handle other satellite metrics processing errors
+                    log.error(f"Error processing satellite metrics: {e}")
+                    continue 
                 
-                last_measurement[sat['PRN']] = sat
-            except KeyError as e:
-                # Handle missing satellite data fields
-                log.warning(f"Skipping satellite measurement due to missing field: {e}")
-                continue
-            except Exception as e:
-                # Handle other satellite measurement processing errors
-                log.error(f"Error processing satellite measurement: {e}")
-                continue
-            
+        if self.collect_time:
+            self.collect_time.observe(time.perf_counter() - started)
         
-        log.debug(f'last_measurement {last_measurement}')
+        for key in metrics:
+            yield metrics[key]
             
-        for sat in last_measurement.keys():
-            log.debug(f'sat:: {last_measurement[sat]}')
-            try:
-                sat_dict = last_measurement[sat]
-
-                # Extract label values with defaults for missing optional fields
-                # PRN is required - will raise KeyError if missing
-                prn = str(sat_dict['PRN'])
-                # svid defaults to PRN for GPS-only receivers (semantically correct)
-                svid = str(sat_dict.get('svid', sat_dict['PRN']))
-                # gnssid defaults to 0 (GPS constellation per NMEA 0183) if missing
-                gnssid = str(sat_dict.get('gnssid', 0))
-                # used defaults to False if missing
-                used = str(sat_dict.get('used', False))
-
-                # Add all available metrics for this satellite
-                for key in metrics.keys():
-                    if key in sat_dict.keys():
-                        metrics[key].add_metric([prn, svid, gnssid, used], sat_dict[key])
-
-            except KeyError as e:
-                # Only PRN is truly required - skip satellite if missing
-                log.warning(f"Skipping satellite due to missing required field PRN: {e}")
+
+class ConstellationCollector(object):
+    """ Collects the per constellation counts and signal strength of every gpsd. """
+
+    def __init__(self, stats):
+        # source label -> ConstellationStats, filled in by bind_source()
+        self.stats = stats
+
+    def collect(self):
+        labels = ['source', 'gnssid', 'constellation']
+        seen = GaugeMetricFamily('gpsd_constellation_seen', 'Satellites of the constellation in the last SKY report.', labels=labels)
+        used = GaugeMetricFamily('gpsd_constellation_used', 'Satellites of the constellation used in the solution.', labels=labels)
+        above = GaugeMetricFamily('gpsd_constellation_above_mask', 'Satellites of the constellation at or above --elevation-mask.',
+                                  labels=labels)
+        ss_mean = GaugeMetricFamily('gpsd_constellation_ss_mean', 'Mean signal to noise ratio of the tracked satellites in dBHz.',
+                                    labels=labels)
+        ss_min = GaugeMetricFamily('gpsd_constellation_ss_min', 'Lowest signal to noise ratio of the tracked satellites in dBHz.',
+                                   labels=labels)
+        ss_max = GaugeMetricFamily('gpsd_constellation_ss_max', 'Highest signal to noise ratio of the tracked satellites in dBHz.',
+                                   labels=labels)
+
+        for source, stats in list(self.stats.items()):
+            for gnssid, (n_seen, n_used, n_above, ss_sum, n_ss, low, high) in stats.current.items():
+                values = [source, str(gnssid), GNSS_NAMES.get(gnssid, 'unknown')]
+                seen.add_metric(values, n_seen)
+                used.add_metric(values, n_used)
+                above.add_metric(values, n_above)
+                ss_mean.add_metric(values, ss_sum / n_ss if n_ss else math.nan)
+                ss_min.add_metric(values, low if n_ss else math.nan)
+                ss_max.add_metric(values, high if n_ss else math.nan)
+
+        yield from (seen, used, above, ss_mean, ss_min, ss_max)
+
+
+class TimeRing(object):
+    """
+    A sliding window of ``window`` seconds cut in ``slots`` slots, each
+    holding a ``factory()`` object. current() returns the object of the
+    running slot, starting a new one when the previous has slid out of the
+    window, live() returns the objects of the slots still in the window.
+    """
+
+    def __init__(self, window, slots, factory):
+        self.width = window / slots
+        self.factory = factory
+        self.ring = [None] * slots
+        # slot number (time // width) each ring entry belongs to
+        self.numbers = [None] * slots
+
+    def current(self, now=None):
+        number = int((time.monotonic() if now is None else now) // self.width)
+        i = number % len(self.ring)
+        if self.numbers[i] != number:
+            self.ring[i] = self.factory()
+            self.numbers[i] = number
+        return self.ring[i]
+
+    def live(self, now=None):
+        number = int((time.monotonic() if now is None else now) // self.width)
+        oldest = number - len(self.ring)
+        return [entry for entry, n in zip(self.ring, self.numbers) if n is not None and n > oldest]
+
+
+class QuantileSketch(object):
+    """
+    Mergeable quantile sketch with a relative accuracy guarantee (DDSketch).
+
+    A value v is counted in bucket ceil(log(|v|) / log(gamma)) of the
+    positive or negative store, with gamma = (1 + a) / (1 - a), so every
+    quantile is within a fraction a of the true value. Adding a value is
+    a dict update. The stores hold at most max_buckets buckets each, beyond
+    that the buckets of the smallest magnitudes are collapsed.
+    """
+
+    __slots__ = ('gamma', 'log_gamma', 'max_buckets', 'pos', 'neg', 'zero', 'count')
+
+    def __init__(self, accuracy=DEFAULT_SKETCH_ACCURACY, max_buckets=SKETCH_MAX_BUCKETS):
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.max_buckets = max_buckets
+        self.pos = {}
+        self.neg = {}
+        self.zero = 0
+        self.count = 0
+
+    def add(self, value):
+        self.count += 1
+        if value > SKETCH_MIN_VALUE:
+            store = self.pos
+        elif value < -SKETCH_MIN_VALUE:
+            store = self.neg
+            value = -value
+        else:
+            self.zero += 1
+            return
+
+        key = math.ceil(math.log(value) / self.log_gamma)
+        store[key] = store.get(key, 0) + 1
+        if len(store) > self.max_buckets:
+            self.collapse(store)
+
+    def collapse(self, store):
+        keys = sorted(store)
+        lowest = keys[-self.max_buckets]
+        for key in keys[:-self.max_buckets]:
+            store[lowest] += store.pop(key)
+
+    def merge(self, other):
+        for store, other_store in ((self.pos, other.pos), (self.neg, other.neg)):
+            for key, count in other_store.items():
+                store[key] = store.get(key, 0) + count
+            if len(store) > self.max_buckets:
+                self.collapse(store)
+        self.zero += other.zero
+        self.count += other.count
+
+    def value(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def quantiles(self, quantiles):
+        """ The values at the (sorted) quantiles, NaN without data. """
+        if not self.count:
+            return [float('nan')] * len(quantiles)
+
+        buckets = [(-self.value(key), self.neg[key]) for key in sorted(self.neg, reverse=True)]
+        if self.zero:
+            buckets.append((0.0, self.zero))
+        buckets.extend((self.value(key), self.pos[key]) for key in sorted(self.pos))
+
+        values = []
+        i, seen = 0, buckets[0][1]
+        for q in quantiles:
+            rank = q * (self.count - 1)
+            while seen <= rank and i + 1 < len(buckets):
+                i += 1
+                seen += buckets[i][1]
+            values.append(buckets[i][0])
+        return values
+
+
+class WindowedSketch(object):
+    """ Quantiles over the last --sketch-window seconds, count and sum since start. """
+
+    def __init__(self, window, accuracy):
+        self.ring = TimeRing(window, SKETCH_SLOTS, lambda: QuantileSketch(accuracy))
+        self.accuracy = accuracy
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.ring.current().add(value)
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self, quantiles):
+        merged = QuantileSketch(self.accuracy)
+        with self.lock:
+            for sketch in self.ring.live():
+                merged.merge(sketch)
+            count, total = self.count, self.sum
+        return merged.quantiles(quantiles), count, total
+
+
+class QuantileSummary(object):
+    """
+    A labeled Summary with quantiles, backed by one WindowedSketch per label
+    set. labels() and observe() mirror the Histogram API, so the handlers do
+    not care which of the two they feed.
+    """
+
+    def __init__(self, name, documentation, labelnames, args, registry):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.quantiles = args.sketch_quantiles
+        self.window = args.sketch_window
+        self.accuracy = args.sketch_accuracy
+        self.children = {}
+        self.lock = threading.Lock()
+        registry.register(self)
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, WindowedSketch(self.window, self.accuracy))
+        return child
+
+    def collect(self):
+        metric = Metric(self.name, self.documentation, 'summary')
+        for values, child in list(self.children.items()):
+            labels = dict(zip(self.labelnames, values))
+            quantiles, count, total = child.snapshot(self.quantiles)
+            for q, value in zip(self.quantiles, quantiles):
+                metric.add_sample(self.name, dict(labels, quantile=str(q)), value)
+            metric.add_sample(self.name + '_count', labels, count)
+            metric.add_sample(self.name + '_sum', labels, total)
+        yield metric
+
+
+class HistogramRing(object):
+    """
+    The sub-histograms of one label set of a WindowedHistogram: a TimeRing of
+    arrays of bucket counts plus their sum. Only the reader thread of the
+    gpsd observes, the scrape thread adds up the live sub-histograms without
+    a lock and at worst misses the observation that is being counted.
+    """
+
+    def __init__(self, lowest, width, size, window):
+        self.lowest = lowest
+        self.width = width
+        self.last = size - 1
+        self.ring = TimeRing(window, PPS_WINDOW_SLOTS, lambda: (array('L', [0]) * size, array('d', [0.0])))
+
+    def observe(self, value):
+        # bucket i counts lowest + (i - 2) * width < value <= lowest + (i - 1) * width
+        i = math.ceil((value - self.lowest) / self.width) + 1
+        if i < 1:
+            i = 1
+        elif i > self.last:
+            i = self.last
+        counts, total = self.ring.current()
+        counts[i] += 1
+        total[0] += value
+
+    def snapshot(self):
+        """ The bucket counts and the sum of the window. """
+        live = self.ring.live()
+        return [sum(column) for column in zip(*(counts for counts, _ in live))], sum(total[0] for _, total in live)
+
+
+class WindowedHistogram(object):
+    """
+    A labeled histogram over the last ``window`` seconds instead of since the
+    start, exported as a gauge histogram since its buckets go down again.
+    The buckets are -inf, ``count`` bounds ``width`` apart from ``lowest`` and
+    +inf, the layout of the PPS histogram. That makes the bucket of an
+    observation one division away, and an observation one increment.
+    labels() and observe() mirror the Histogram API.
+    """
+
+    def __init__(self, name, documentation, labelnames, lowest, width, count, window, registry):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.lowest = lowest
+        self.width = width
+        self.window = window
+        self.bounds = [floatToGoString(b) for b in
+                       [float("-inf")] + [lowest + i * width for i in range(count)] + [float("inf")]]
+        self.children = {}
+        self.lock = threading.Lock()
+        registry.register(self)
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, HistogramRing(self.lowest, self.width,
+                                                                       len(self.bounds), self.window))
+        return child
+
+    def collect(self):
+        family = GaugeHistogramMetricFamily(self.name, self.documentation, labels=self.labelnames)
+        for values, child in list(self.children.items()):
+            counts, total = child.snapshot()
+            buckets = []
+            cumulative = 0
+            for bound, count in zip(self.bounds, counts or [0] * len(self.bounds)):
+                cumulative += count
+                buckets.append((bound, cumulative))
+            family.add_metric(list(values), buckets, total)
+        yield family
+
+
+class TauState(object):
+    """ The running sums of one averaging time m (in samples) of AllanDeviation. """
+
+    __slots__ = ('m', 'terms', 'second_diffs', 'd_sum', 'd2_ring', 'd2_sum', 's2_terms', 's2_ring', 's2_sum')
+
+    def __init__(self, m, window):
+        self.m = m
+        self.terms = 0
+        # last m second differences and their sum, the inner sum of MVAR
+        self.second_diffs = array('d', bytes(8 * m))
+        self.d_sum = 0.0
+        # last window squared second differences (AVAR) and squared inner sums (MVAR)
+        self.d2_ring = array('d', bytes(8 * window))
+        self.d2_sum = 0.0
+        self.s2_terms = 0
+        self.s2_ring = array('d', bytes(8 * window))
+        self.s2_sum = 0.0
+
+
+class AllanDeviation(object):
+    """
+    Overlapping Allan deviation and time deviation of a phase series sampled
+    every second, over the last ``window`` terms of every averaging time.
+
+    Every sample adds one second difference d = x[n] - 2x[n-m] + x[n-2m] per
+    averaging time m, and the ring buffers of the squared terms keep windowed
+    sums: AVAR = sum(d^2) / (2 m^2 T) and TVAR = sum(S^2) / (6 m^2 T), with S
+    the sum of the last m second differences. An update touches a fixed
+    number of values per tau, memory is fixed per tau. The sums are
+    recomputed from their rings once per window to cancel rounding drift.
+    """
+
+    def __init__(self, taus, window=DEFAULT_ADEV_WINDOW):
+        self.taus = taus
+        self.window = window
+        self.size = 2 * max(taus) + 1
+        self.reset()
+
+    def reset(self):
+        self.phase = array('d', bytes(8 * self.size))
+        self.samples = 0
+        self.last_sec = None
+        self.states = [TauState(m, self.window) for m in self.taus]
+
+    def update(self, x):
+        phase, size, window = self.phase, self.size, self.window
+        n = self.samples
+        phase[n % size] = x
+        self.samples = n + 1
+
+        for st in self.states:
+            m = st.m
+            if n < 2 * m:
+                break
+            d = x - 2 * phase[(n - m) % size] + phase[(n - 2 * m) % size]
+
+            k = st.terms
+            st.terms = k + 1
+            i = k % window
+            st.d2_sum += d * d - st.d2_ring[i]
+            st.d2_ring[i] = d * d
+            if i == window - 1:
+                st.d2_sum = math.fsum(st.d2_ring)
+
+            i = k % m
+            st.d_sum += d - st.second_diffs[i]
+            st.second_diffs[i] = d
+            if i == m - 1:
+                st.d_sum = math.fsum(st.second_diffs)
+            if k + 1 < m:
                 continue
-            except Exception as e:
-                # Handle other satellite metrics processing errors
-                log.error(f"Error processing satellite metrics: {e}")
-                continue 
-                
-        
+
+            s2 = st.d_sum * st.d_sum
+            i = st.s2_terms % window
+            st.s2_terms += 1
+            st.s2_sum += s2 - st.s2_ring[i]
+            st.s2_ring[i] = s2
+            if i == window - 1:
+                st.s2_sum = math.fsum(st.s2_ring)
+
+    def deviations(self):
+        """ (tau, adev, tdev) of every averaging time with data, tdev in seconds. """
+        result = []
+        for st in self.states:
+            if not st.s2_terms:
+                break
+            m = st.m
+            d2_terms = min(st.terms, self.window)
+            s2_terms = min(st.s2_terms, self.window)
+            adev = math.sqrt(max(st.d2_sum, 0.0) / (2 * m * m * d2_terms))
+            tdev = math.sqrt(max(st.s2_sum, 0.0) / (6 * m * m * s2_terms))
+            result.append((m, adev, tdev))
+        return result
+
+
+class AdevCollector(object):
+
+    def __init__(self, trackers):
+        # (source label, device) -> AllanDeviation, filled in by handle_pps_adev()
+        self.trackers = trackers
+
+    def collect(self):
+        adev = GaugeMetricFamily('gpsd_pps_adev', 'Overlapping Allan deviation of the PPS offset per averaging time tau (seconds).',
+                                 labels=['source', 'device', 'tau'])
+        tdev = GaugeMetricFamily('gpsd_pps_tdev', 'Time deviation of the PPS offset in seconds per averaging time tau (seconds).',
+                                 labels=['source', 'device', 'tau'])
+
+        for (source, device), tracker in list(self.trackers.items()):
+            for tau, a, t in tracker.deviations():
+                adev.add_metric([source, device, str(tau)], a)
+                tdev.add_metric([source, device, str(tau)], t)
+
+        yield adev
+        yield tdev
+
+
+class PositionAccuracy(object):
+    """
+    Spread of the fixes of one gpsd over sliding windows.
+
+    Every window is a TimeRing of ACCURACY_SLOTS slots of running sums
+    (count, sum and sum of squares of the east, north and up offsets), so a
+    fix adds a handful of numbers to one slot per window and a scrape sums
+    at most ACCURACY_SLOTS slots. The offsets are taken in the frame of the
+    first fix, never of the geo point: the sums of squares lose their
+    precision and the inverse projection of the mean its accuracy when the
+    offsets grow to kilometers.
+    """
+
+    # slot layout: fixes, sum e, sum n, sum e^2, sum n^2, fixes with up, sum u, sum u^2
+    SLOT = array('d', bytes(8 * 8))
+
+    def __init__(self, windows):
+        self.windows = windows
+        self.projector = None
+        self.rings = [TimeRing(window, ACCURACY_SLOTS, self.SLOT.__copy__) for window in windows]
+        self.lock = threading.Lock()
+
+    def add(self, nx, now=None):
+        if self.projector is None:
+            if 'lat' not in nx or 'lon' not in nx:
+                return
+            self.projector = GeoProjector(nx['lat'], nx['lon'], nx.get('altHAE'))
+
+        offset = self.projector.offset(nx)
+        if offset is None:
+            return
+        e, n, u = offset
+
+        with self.lock:
+            for ring in self.rings:
+                slot = ring.current(now)
+                slot[0] += 1
+                slot[1] += e
+                slot[2] += n
+                slot[3] += e * e
+                slot[4] += n * n
+                if u is not None:
+                    slot[5] += 1
+                    slot[6] += u
+                    slot[7] += u * u
+
+    def statistics(self, now=None):
+        """ Per window: (window, fixes, mean (e, n, u), std (e, n, u)), u None without heights. """
+        result = []
+        with self.lock:
+            totals = [[math.fsum(column) for column in zip(*ring.live(now))] for ring in self.rings]
+
+        for window, total in zip(self.windows, totals):
+            if not total or total[0] < 2:
+                continue
+            mean = [total[1] / total[0], total[2] / total[0], None]
+            std = [self.std(total[0], total[1], total[3]), self.std(total[0], total[2], total[4]), None]
+            if total[5] >= 2:
+                mean[2] = total[6] / total[5]
+                std[2] = self.std(total[5], total[6], total[7])
+            result.append((window, int(total[0]), mean, std))
+        return result
+
+    @staticmethod
+    def std(count, total, squares):
+        return math.sqrt(max(squares - total * total / count, 0.0) / (count - 1))
+
+
+class AccuracyCollector(object):
+
+    def __init__(self, trackers):
+        # source label -> PositionAccuracy, filled in by bind_source()
+        self.trackers = trackers
+
+    def collect(self):
+        labels = ['source', 'window']
+        metrics = {
+            'fixes': GaugeMetricFamily('gpsd_accuracy_fixes', 'Fixes in the window.', labels=labels),
+            'cep50': GaugeMetricFamily('gpsd_accuracy_cep50_m', 'Circular error probable (50%) of the fixes in the window in meters.', labels=labels),
+            'cep95': GaugeMetricFamily('gpsd_accuracy_cep95_m', 'Radius containing 95% of the fixes in the window in meters.', labels=labels),
+            '2drms': GaugeMetricFamily('gpsd_accuracy_2drms_m', 'Twice the distance root mean square of the fixes in the window in meters.', labels=labels),
+            'std': GaugeMetricFamily('gpsd_accuracy_std_m', 'Standard deviation of the fixes in the window per axis in meters.', labels=labels + ['axis']),
+            'lat': GaugeMetricFamily('gpsd_accuracy_mean_lat', 'Mean latitude of the fixes in the window in degrees.', labels=labels),
+            'lon': GaugeMetricFamily('gpsd_accuracy_mean_long', 'Mean longitude of the fixes in the window in degrees.', labels=labels),
+            'alt': GaugeMetricFamily('gpsd_accuracy_mean_altHAE', 'Mean height above ellipsoid of the fixes in the window in meters.', labels=labels),
+        }
+
+        for source, tracker in list(self.trackers.items()):
+            projector = tracker.projector
+            for window, fixes, mean, std in tracker.statistics():
+                values = [source, str(window)]
+                sigma_e, sigma_n, sigma_u = std
+                cep50 = 0.5887 * (sigma_e + sigma_n)
+                metrics['fixes'].add_metric(values, fixes)
+                metrics['cep50'].add_metric(values, cep50)
+                metrics['cep95'].add_metric(values, 2.0789 * cep50)
+                metrics['2drms'].add_metric(values, 2 * math.hypot(sigma_e, sigma_n))
+                metrics['std'].add_metric(values + ['east'], sigma_e)
+                metrics['std'].add_metric(values + ['north'], sigma_n)
+                if sigma_u is not None:
+                    metrics['std'].add_metric(values + ['up'], sigma_u)
+
+                lat, lon, alt = projector.position(*mean)
+                metrics['lat'].add_metric(values, lat)
+                metrics['lon'].add_metric(values, lon)
+                if alt is not None:
+                    metrics['alt'].add_metric(values, alt)
+
         for key in metrics:
             yield metrics[key]
-            
 
-def add_sat_stats(satellites):
-    
-    for sat in satellites:
+
+class FieldAggregator(object):
+    """
+    Min, max, sum and count of a number of fields, in one flat array('d')
+    of four values per field.
+
+    Without a window the array collects the values since the previous
+    take() (the previous scrape). With a window the arrays are the slots of
+    a TimeRing and take() combines the slots still in the window.
+    """
+
+    def __init__(self, count, window=0):
+        self.count = count
+        self.ring = TimeRing(window, AGGREGATE_SLOTS, self.empty) if window else None
+        self.values = self.empty()
+        self.lock = threading.Lock()
+
+    def empty(self):
+        return array('d', [math.inf, -math.inf, 0.0, 0.0] * self.count)
+
+    def add(self, i, value):
         try:
-            ts = time.time()
-            sat_queue.put({'sat': sat, 'ts': ts})
-        except KeyError as e:
-            # Handle missing satellite data fields
-            log.warning(f"Skipping satellite with missing data field: {e}")
-            continue
-        except Exception as e:
-            # Handle other satellite data processing errors
-            log.error(f"Error processing satellite data: {e}")
-            continue
-    
-    """ Keep the queue managable. """
-       
-    q_size = sat_queue.qsize()
-    log.debug(f'Queue size = {q_size} items.')
-    while sat_queue.qsize() > 2000:
-        sat_queue.get()
-
-    q_size_end = sat_queue.qsize()
-    log.debug(f'Current satellite queue size = {q_size_end}, pruned {q_size - q_size_end}')
-    
+            value = float(value)
+        except (TypeError, ValueError):
+            # a field like time or device, there is nothing to aggregate
+            return
+        i *= 4
+        with self.lock:
+            values = self.ring.current() if self.ring else self.values
+            if value < values[i]:
+                values[i] = value
+            if value > values[i + 1]:
+                values[i + 1] = value
+            values[i + 2] += value
+            values[i + 3] += 1
+
+    def take(self):
+        """ The aggregates of the period, starts a new period when there is no window. """
+        if not self.ring:
+            with self.lock:
+                values, self.values = self.values, self.empty()
+            return values
+
+        total = self.empty()
+        with self.lock:
+            for values in self.ring.live():
+                for i in range(0, len(total), 4):
+                    total[i] = min(total[i], values[i])
+                    total[i + 1] = max(total[i + 1], values[i + 1])
+                    total[i + 2] += values[i + 2]
+                    total[i + 3] += values[i + 3]
+        return total
+
+
+class AggregateCollector(object):
+
+    def __init__(self, aggregators, fields, names):
+        # source label -> FieldAggregator, filled in by bind_source()
+        self.aggregators = aggregators
+        self.fields = fields
+        self.names = names
+
+    def collect(self):
+        families = []
+        for field, name in zip(self.fields, self.names):
+            families.append((
+                GaugeMetricFamily(name + '_min', f'Minimum of {field} since the previous scrape or in the window.', labels=['source']),
+                GaugeMetricFamily(name + '_max', f'Maximum of {field} since the previous scrape or in the window.', labels=['source']),
+                GaugeMetricFamily(name + '_mean', f'Mean of {field} since the previous scrape or in the window.', labels=['source']),
+                GaugeMetricFamily(name + '_count', f'Reports with {field} since the previous scrape or in the window.', labels=['source']),
+            ))
+
+        for source, aggregator in list(self.aggregators.items()):
+            values = aggregator.take()
+            for i, (low, high, mean, count) in enumerate(families):
+                n = values[4 * i + 3]
+                low.add_metric([source], values[4 * i] if n else math.nan)
+                high.add_metric([source], values[4 * i + 1] if n else math.nan)
+                mean.add_metric([source], values[4 * i + 2] / n if n else math.nan)
+                count.add_metric([source], n)
+
+        for family in families:
+            yield from family
+
+
 if __name__ == "__main__":
         
     sys.exit(main())